@@ -17,6 +17,23 @@
 
 from swift.common.utils import readconf, config_true_value
 
+
+def parse_reseller_prefixes(value):
+    """
+    Returns the list of reseller prefixes of a comma separated
+    reseller_prefix option, each ending with "_" unless empty. The first
+    one is the default prefix.
+    """
+    prefixes = []
+    for prefix in value.split(','):
+        prefix = prefix.strip()
+        if prefix and prefix[-1] != '_':
+            prefix += '_'
+        if prefix and prefix not in prefixes:
+            prefixes.append(prefix)
+    return prefixes or ['']
+
+
 config_file = {}
 try:
     config_file = readconf("/etc/swift/proxy-server.conf",
@@ -32,5 +49,13 @@ try:
 except SystemExit:
     pass
 TOKEN_LIFE = int(config_file.get('token_life', 86400))
-RESELLER_PREFIX = config_file.get('reseller_prefix', "AUTH_")
+RESELLER_PREFIXES = parse_reseller_prefixes(
+    config_file.get('reseller_prefix', "AUTH_"))
+RESELLER_PREFIX = RESELLER_PREFIXES[0]
+# token_life may be set for a single prefix, like SERVICE_token_life
+TOKEN_LIFES = dict((prefix, int(config_file.get('%stoken_life' % prefix,
+                                                TOKEN_LIFE)))
+                   for prefix in RESELLER_PREFIXES)
 DEBUG_HEADERS = config_true_value(config_file.get('debug_headers', 'yes'))
+TOKEN_STORE_CONF = dict((k, v) for k, v in config_file.items()
+                        if k.startswith('token_store'))
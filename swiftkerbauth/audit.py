@@ -0,0 +1,141 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Audit trail of logins, token validations and denials.
+
+Requests only append a tuple to a bounded in-memory ring; a greenthread
+formats and writes the records in batches, to a rotating file or to syslog.
+Each record is a JSON document on its own line, with the keys:
+
+    time      time of the event
+    event     login, validate, invalidate, token or denied
+    status    status kerbauth answered with, or 0 if it passed the
+              request on
+    user      user name, if known
+    account   account of the request, if any
+    client    address of the client
+    trans_id  transaction id of the request
+
+When the ring is full the oldest records are dropped, and a record with
+the event "dropped" and their number in "count" is written in their place.
+Tokens and passwords are never recorded.
+"""
+
+import json
+import logging
+from logging.handlers import RotatingFileHandler, SysLogHandler
+from collections import deque
+from time import time
+from eventlet import spawn_n
+
+from swiftkerbauth.periodic import call_every
+
+FIELDS = ('time', 'event', 'status', 'user', 'account', 'client',
+          'trans_id')
+
+
+class AuditLog(object):
+    """
+    Buffers audit records and writes them in batches to handler.
+
+    :param handler: logging.Handler the records are written to
+    :param buffer_size: number of records buffered before the oldest ones
+                        are dropped
+    :param flush_interval: seconds between two writes
+    :param logger: logger of the filter, reporting drops and write errors
+    """
+
+    def __init__(self, handler, buffer_size=10000, flush_interval=1,
+                 logger=None):
+        self.handler = handler
+        # Syslog messages are one record each, files take a whole batch in
+        # one write.
+        self.per_line = isinstance(handler, SysLogHandler)
+        self.ring = deque(maxlen=buffer_size)
+        self.flush_interval = flush_interval
+        self.logger = logger
+        self.dropped = 0
+        self.running = False
+
+    def record(self, event, status, user=None, account=None, client=None,
+               trans_id=None):
+        """Buffers a record, dropping the oldest one if the ring is full."""
+        if len(self.ring) == self.ring.maxlen:
+            self.dropped += 1
+        self.ring.append((time(), event, status, user, account, client,
+                          trans_id))
+        if not self.running:
+            # Not when the filter is loaded: the Swift parent process loads
+            # it too, and never serves a request that would be recorded
+            self.running = True
+            spawn_n(call_every, self.flush_interval, self.flush,
+                    self.logger, 'Writing audit records')
+
+    def flush(self):
+        """Writes the buffered records."""
+        lines = []
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(json.dumps({'time': round(time(), 3),
+                                     'event': 'dropped', 'count': dropped},
+                                    separators=(',', ':')))
+            if self.logger:
+                self.logger.update_stats('audit.dropped', dropped)
+        ring = self.ring
+        while ring:
+            values = ring.popleft()
+            record = dict((name, value) for name, value in
+                          zip(FIELDS, values) if value is not None)
+            record['time'] = round(record['time'], 3)
+            lines.append(json.dumps(record, separators=(',', ':')))
+        if not lines:
+            return
+        if self.per_line:
+            for line in lines:
+                self.handler.handle(self._log_record(line))
+        else:
+            self.handler.handle(self._log_record('\n'.join(lines)))
+
+    def _log_record(self, msg):
+        return logging.LogRecord('kerbauth.audit', logging.INFO, __file__, 0,
+                                 msg, None, None)
+
+
+def get_audit_log(conf, logger=None):
+    """
+    Returns the AuditLog configured by the audit_log option of conf: a file
+    path, "syslog", or empty (the default) for no audit trail.
+
+    :param conf: dict of configuration values
+    :param logger: logger of the filter
+    """
+    target = conf.get('audit_log', '').strip()
+    if not target:
+        return None
+    if target == 'syslog':
+        facility = conf.get('audit_syslog_facility', 'LOG_AUTHPRIV')
+        handler = SysLogHandler(
+            address=conf.get('audit_syslog_address', '/dev/log'),
+            facility=getattr(SysLogHandler, facility,
+                             SysLogHandler.LOG_AUTHPRIV))
+        handler.setFormatter(logging.Formatter('kerbauth-audit: %(message)s'))
+    else:
+        handler = RotatingFileHandler(
+            target, maxBytes=int(conf.get('audit_log_max_bytes',
+                                          100 * 1024 * 1024)),
+            backupCount=int(conf.get('audit_log_backups', 5)))
+    return AuditLog(handler, int(conf.get('audit_buffer_size', 10000)),
+                    float(conf.get('audit_flush_interval', 1)), logger)
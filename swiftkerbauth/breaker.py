@@ -0,0 +1,135 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from time import time
+from eventlet import Timeout
+
+
+class MemcacheUnavailable(Exception):
+    """Raised when a guarded memcache call fails or the circuit is open."""
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker bounding the time spent on a flaky dependency.
+
+    Every call runs under a deadline of call_timeout seconds. A call that
+    raises, times out or takes longer than latency_threshold seconds counts
+    as a failure; error_threshold consecutive failures open the circuit.
+    While open, calls fail immediately. After reset_timeout seconds one
+    trial call is let through (half open) and its outcome either closes or
+    re-opens the circuit.
+
+    :param on_transition: optional callable invoked with the new state
+                          whenever the state changes
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, call_timeout=0.5, latency_threshold=0.25,
+                 error_threshold=5, reset_timeout=30, on_transition=None):
+        self.call_timeout = call_timeout
+        self.latency_threshold = latency_threshold
+        self.error_threshold = error_threshold
+        self.reset_timeout = reset_timeout
+        self.on_transition = on_transition
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_running = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            if self.on_transition:
+                self.on_transition(state)
+
+    def allow(self):
+        """Returns True if a call may be attempted right now."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.trial_running:
+            return False
+        self.trial_running = True
+        return True
+
+    def record_success(self):
+        self.trial_running = False
+        self.failures = 0
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.trial_running = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or \
+                self.failures >= self.error_threshold:
+            self.opened_at = time()
+            self._set_state(self.OPEN)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Runs func under the breaker.
+
+        :raises MemcacheUnavailable: if the circuit is open, or the call
+                                     failed or exceeded its deadline
+        """
+        if not self.allow():
+            raise MemcacheUnavailable('Circuit open')
+        start = time()
+        try:
+            with Timeout(self.call_timeout):
+                result = func(*args, **kwargs)
+        except (Exception, Timeout) as err:
+            self.record_failure()
+            raise MemcacheUnavailable(str(err) or err.__class__.__name__)
+        if time() - start > self.latency_threshold:
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+
+class GuardedMemcache(object):
+    """
+    Wraps a MemcacheRing so every call goes through a CircuitBreaker.
+
+    :param memcache_client: MemcacheRing object
+    :param breaker: CircuitBreaker shared by all requests of the worker
+    """
+
+    def __init__(self, memcache_client, breaker):
+        self.memcache_client = memcache_client
+        self.breaker = breaker
+
+    def get(self, key):
+        return self.breaker.call(self.memcache_client.get, key)
+
+    def set(self, key, value, timeout=0):
+        return self.breaker.call(self.memcache_client.set, key, value,
+                                 timeout=timeout)
+
+    def delete(self, key):
+        return self.breaker.call(self.memcache_client.delete, key)
+
+    def incr(self, key, delta=1, time=0):
+        return self.breaker.call(self.memcache_client.incr, key,
+                                 delta=delta, time=time)
@@ -0,0 +1,82 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Anonymized capture of authentication traffic, for swiftkerbauth.replay.
+
+Each event is a JSON document on its own line, with the keys:
+
+    t   start time of the request
+    p   code path: get_token, validate, token or anonymous
+    m   request method
+    o   status kerbauth answered with, or 0 if it passed the request on
+    ms  milliseconds spent in kerbauth
+    k   keyed hash of the token, if any
+    u   keyed hash of the user, if known
+    a   keyed hash of the account of a token request
+
+Hashes use HMAC-SHA256 with a key that is never written to the capture, so
+tokens and names cannot be recovered from it, but the same token or user
+always gets the same hash within a capture.
+"""
+
+import os
+import hmac
+import json
+from hashlib import sha256
+
+from swiftkerbauth.jsonlines import JSONLinesWriter
+
+
+class TrafficCapture(JSONLinesWriter):
+    """
+    Appends events to <path>.<pid>, one file per worker.
+
+    :param path: path prefix of the capture files
+    :param key: HMAC key; a random one is used if None, so hashes differ
+                between workers
+    :param flush_every: number of events buffered before writing them
+    :param flush_interval: seconds events may stay buffered
+    """
+
+    def __init__(self, path, key=None, flush_every=100, flush_interval=1):
+        super(TrafficCapture, self).__init__(path, flush_every,
+                                             flush_interval)
+        self.key = key or os.urandom(16)
+
+    def digest(self, value):
+        """Returns the keyed hash of value, or None if value is empty."""
+        if not value:
+            return None
+        return hmac.new(self.key, value, sha256).hexdigest()[:16]
+
+    def record(self, start, elapsed, code_path, method, outcome, token=None,
+               user=None, account=None):
+        event = {'t': round(start, 3), 'p': code_path, 'm': method,
+                 'o': outcome, 'ms': round(elapsed * 1000, 3)}
+        for name, value in (('k', token), ('u', user), ('a', account)):
+            if value:
+                event[name] = self.digest(value)
+        self.write((event,))
+
+
+def read_events(paths):
+    """Returns the events of the capture files at paths, in time order."""
+    events = []
+    for path in paths:
+        with open(path) as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+    events.sort(key=lambda event: event['t'])
+    return events
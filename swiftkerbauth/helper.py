@@ -0,0 +1,189 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Credential helper processes.
+
+Forking a proxy worker to run kinit or id costs time proportional to the
+worker's memory. A HelperPool starts a few small helper processes once, and
+hands them kinit and group lookup jobs over pipes, one JSON document per
+line. Run as a script, this module is the helper itself.
+"""
+
+import os
+import sys
+import json
+import atexit
+from eventlet import Timeout
+from eventlet.green import subprocess
+from eventlet.queue import LightQueue
+
+from swiftkerbauth import kerbauth_utils
+
+HELPER_COMMAND = [sys.executable, '-m', 'swiftkerbauth.helper']
+
+
+class HelperError(Exception):
+    """Raised when a helper process dies or does not answer in time."""
+    pass
+
+
+def serve(stdin, stdout):
+    """Runs jobs read from stdin until it is closed."""
+    operations = {'kinit': kerbauth_utils.run_kinit,
+                  'kinit_hedged': kerbauth_utils.run_kinit_hedged,
+                  'groups': kerbauth_utils.get_groups_from_username}
+    for line in iter(stdin.readline, ''):
+        job = json.loads(line)
+        try:
+            reply = {'result': operations[job['op']](*job['args'])}
+        except OSError as err:
+            reply = {'error': 'OSError', 'errno': err.errno,
+                     'message': err.strerror}
+        except Exception as err:
+            reply = {'error': 'RuntimeError', 'message': str(err)}
+        stdout.write(json.dumps(reply) + '\n')
+        stdout.flush()
+
+
+class HelperPool(object):
+    """
+    Pool of helper processes owned by one proxy worker.
+
+    Swift loads the filter in the parent process before forking the
+    workers, so the helpers are only started by the first job, in the
+    process running it. They are stopped by close(), at the latest when
+    that process exits.
+
+    A helper that dies or does not answer within timeout seconds is killed
+    and replaced, and the job fails with HelperError.
+
+    :param size: number of helper processes
+    :param timeout: seconds to wait for the answer to a job
+    :param command: command starting a helper
+    """
+
+    def __init__(self, size, timeout=5, command=None):
+        self.size = size
+        self.timeout = timeout
+        self.command = command or HELPER_COMMAND
+        self.idle = LightQueue()
+        self.respawns = 0
+        self.pid = None
+        atexit.register(self.close)
+
+    def start(self):
+        """
+        Starts the helpers, unless this process already did. Helpers
+        inherited through a fork belong to the parent process: the child
+        closes its ends of their pipes and starts its own.
+        """
+        if self.pid == os.getpid():
+            return
+        while not self.idle.empty():
+            helper = self.idle.get()
+            helper.stdin.close()
+            helper.stdout.close()
+        # Set first, concurrent jobs wait for the helpers in idle.get()
+        self.pid = os.getpid()
+        for i in range(self.size):
+            self.idle.put(self._spawn())
+
+    def _spawn(self):
+        return subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, close_fds=True)
+
+    def _replace(self, helper):
+        try:
+            helper.kill()
+            helper.wait()
+        except OSError:
+            pass
+        self.respawns += 1
+        return self._spawn()
+
+    def call(self, op, *args):
+        """
+        Runs op with args in a helper and returns its result.
+
+        :raises OSError: if the helper could not run the command
+        :raises RuntimeError: if the operation itself failed
+        :raises HelperError: if the helper died or timed out
+        """
+        self.start()
+        helper = self.idle.get()
+        try:
+            with Timeout(self.timeout):
+                helper.stdin.write(json.dumps({'op': op, 'args': args}) +
+                                   '\n')
+                helper.stdin.flush()
+                line = helper.stdout.readline()
+            if not line:
+                raise HelperError('Helper process exited')
+            reply = json.loads(line)
+        except (Exception, Timeout) as err:
+            helper = self._replace(helper)
+            if isinstance(err, HelperError):
+                raise
+            raise HelperError('Helper failed: %s' %
+                              (str(err) or err.__class__.__name__))
+        finally:
+            self.idle.put(helper)
+        if reply.get('error') == 'OSError':
+            raise OSError(reply['errno'], reply['message'])
+        if 'error' in reply:
+            raise RuntimeError(reply['message'])
+        return reply['result']
+
+    def run_kinit(self, username, password):
+        """Like kerbauth_utils.run_kinit(), -1 if the helper times out."""
+        try:
+            return self.call('kinit', username, password)
+        except HelperError:
+            return -1
+
+    def run_kinit_hedged(self, username, password, krb5_configs,
+                         hedge_delay):
+        """Like kerbauth_utils.run_kinit_hedged(), -1 on helper timeout."""
+        try:
+            return self.call('kinit_hedged', username, password,
+                             krb5_configs, hedge_delay)
+        except HelperError:
+            return -1
+
+    def get_groups_from_username(self, username):
+        """Like kerbauth_utils.get_groups_from_username()."""
+        try:
+            return self.call('groups', username)
+        except HelperError as err:
+            raise RuntimeError("Failure running id -G for %s: %s" %
+                               (username, err))
+
+    def close(self):
+        """
+        Stops all idle helpers started by this process; the next job starts
+        new ones.
+        """
+        if self.pid != os.getpid():
+            return
+        self.pid = None
+        while not self.idle.empty():
+            helper = self.idle.get()
+            helper.stdin.close()
+            helper.wait()
+
+
+if __name__ == '__main__':
+    serve(sys.stdin, sys.stdout)
@@ -0,0 +1,55 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Buffered writing of JSON documents, one per line, to a file per worker.
+"""
+
+import os
+import json
+from time import time
+
+
+class JSONLinesWriter(object):
+    """
+    Appends JSON documents to <path>.<pid>, one file per worker, in batches.
+
+    :param path: path prefix of the files
+    :param flush_every: number of documents buffered before writing them
+    :param flush_interval: seconds documents may stay buffered
+    """
+
+    def __init__(self, path, flush_every=100, flush_interval=1):
+        self.path = '%s.%d' % (path, os.getpid())
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time()
+
+    def write(self, documents):
+        """Buffers documents, writing the buffer once it is due."""
+        self.pending.extend(json.dumps(document, separators=(',', ':'))
+                            for document in documents)
+        if len(self.pending) >= self.flush_every or \
+                time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered documents."""
+        self.last_flush = time()
+        if self.pending:
+            lines, self.pending = self.pending, []
+            with open(self.path, 'a') as f:
+                f.write('\n'.join(lines) + '\n')
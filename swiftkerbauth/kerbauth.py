@@ -12,22 +12,116 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import re
+import sys
+import signal
+import hmac
+import logging
+from zlib import crc32
+import base64
 import errno
+import json
+from math import ceil
+from hashlib import sha256
 from time import time, ctime
-from traceback import format_exc
-from eventlet import Timeout
+from eventlet import Timeout, tpool, sleep, spawn_n
 from urllib import unquote
 
 from swift.common.swob import Request, Response
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, HTTPNotFound, \
-    HTTPSeeOther, HTTPUnauthorized, HTTPServerError
+    HTTPSeeOther, HTTPUnauthorized, HTTPServerError, \
+    HTTPRequestEntityTooLarge
 
 from swift.common.middleware.acl import clean_acl, parse_acl, referrer_allowed
 from swift.common.utils import cache_from_env, get_logger,  \
     split_path, config_true_value
 
+from swiftkerbauth import MEMCACHE_SERVERS, parse_reseller_prefixes
 from swiftkerbauth.kerbauth_utils import get_auth_data, generate_token, \
-    set_auth_data, run_kinit, get_groups_from_username
+    set_auth_data, run_kinit, run_kinit_hedged, get_groups_from_username, \
+    LatencyTracker, GROUP_NAMES, token_key, get_generation, bump_generation, \
+    KINIT_UNREACHABLE
+from swiftkerbauth.audit import get_audit_log
+from swiftkerbauth.capture import TrafficCapture
+from swiftkerbauth.breaker import CircuitBreaker, GuardedMemcache, \
+    MemcacheUnavailable
+from swiftkerbauth.helper import HelperPool
+from swiftkerbauth.ldap_groups import get_group_resolver
+from swiftkerbauth.local_cache import LocalCache
+from swiftkerbauth.periodic import call_every
+from swiftkerbauth.memory import sizeof, tracemalloc, write_memory_snapshot
+from swiftkerbauth.ratelimit import get_limiter
+from swiftkerbauth.rejection import Counters, Rejection
+from swiftkerbauth.profiler import RequestProfiler
+from swiftkerbauth.negotiate import GSSAcceptor, NegotiateError, \
+    parse_negotiate_header
+from swiftkerbauth.singleflight import SingleFlight
+from swiftkerbauth.token_store import get_token_store, get_multi, \
+    memcache_store
+from swiftkerbauth.tracing import get_tracer, NO_SPAN
+from swiftkerbauth.warmup import lock_token_snapshot, read_token_snapshot, \
+    write_token_snapshot
+
+
+class MemoizedAuthorize(object):
+    """
+    The swift.authorize callback of one authenticated client request.
+
+    Swift copies swift.authorize into the environment of the sub-requests
+    it makes for large object segments, bulk operations and COPY, so all of
+    them share this object. Decisions of KerbAuth.authorize() are memoized
+    for identical users, methods, paths (up to the object name), ACLs and
+    referers, and a hit replays the swift_owner flag instead of evaluating
+    the request again.
+
+    :param auth: the KerbAuth instance
+    :param max_entries: number of decisions memoized
+    :param trace: Trace of the client request, if it is traced
+    """
+
+    def __init__(self, auth, max_entries=1000, trace=None):
+        self.auth = auth
+        self.max_entries = max_entries
+        self.memo = {}
+        self.hits = 0
+        self.trace = trace
+
+    def __call__(self, req):
+        if self.trace is None:
+            return self._authorize(req)
+        # Sub-requests do not inherit the environment of the client request
+        req.environ.setdefault('kerbauth.trace', self.trace)
+        with self.trace.span('authorize') as span:
+            resp = self._authorize(req)
+            span.set(denied=bool(resp))
+            return resp
+
+    def _authorize(self, req):
+        # Container sync decisions depend on request headers, and requests
+        # already marked as owner would hide what authorize() did.
+        if req.environ.get('swift_sync_key') or \
+                'swift_owner' in req.environ:
+            return self.auth.authorize(req)
+        try:
+            version, account, container, obj = req.split_path(1, 4, True)
+        except ValueError:
+            return self.auth.authorize(req)
+        key = (req.remote_user, req.method, account, container, bool(obj),
+               getattr(req, 'acl', None), req.referer)
+        decision = self.memo.get(key)
+        if decision is None:
+            resp = self.auth.authorize(req)
+            if len(self.memo) < self.max_entries:
+                self.memo[key] = 'deny' if resp else \
+                    ('owner' if req.environ.get('swift_owner') else 'allow')
+            return resp
+        self.hits += 1
+        if decision == 'deny':
+            return self.auth.denied_response(req)
+        if decision == 'owner':
+            req.environ['swift_owner'] = True
+        return None
 
 
 class KerbAuth(object):
@@ -60,9 +154,15 @@ class KerbAuth(object):
         self.conf = conf
         self.logger = get_logger(conf, log_route='kerbauth')
         self.log_headers = config_true_value(conf.get('log_headers', 'f'))
-        self.reseller_prefix = conf.get('reseller_prefix', 'AUTH').strip()
-        if self.reseller_prefix and self.reseller_prefix[-1] != '_':
-            self.reseller_prefix += '_'
+        self.reseller_prefixes = parse_reseller_prefixes(
+            conf.get('reseller_prefix', 'AUTH'))
+        # The first prefix is the default one, used when nothing selects
+        # another: for statsd metrics, rate limits and Negotiate logins.
+        self.reseller_prefix = self.reseller_prefixes[0]
+        # Longest first, so that AUTH_ADMIN_ wins over AUTH_
+        self.reseller_prefix_re = re.compile('(%s)' % '|'.join(
+            re.escape(prefix) for prefix in
+            sorted(self.reseller_prefixes, key=len, reverse=True)))
         self.logger.set_statsd_prefix('kerbauth.%s' % (
             self.reseller_prefix if self.reseller_prefix else 'NONE',))
         self.auth_prefix = conf.get('auth_prefix', '/auth/')
@@ -80,6 +180,17 @@ class KerbAuth(object):
         self.debug_headers = config_true_value(
             conf.get('debug_headers', 'yes'))
         self.realm_name = conf.get('realm_name', None)
+        # token_life, auth_method and realm_name may be set for a single
+        # prefix, such as SERVICE_token_life for the SERVICE_ prefix.
+        self.reseller_options = {}
+        for prefix in self.reseller_prefixes:
+            self.reseller_options[prefix] = {
+                'token_life': int(conf.get('%stoken_life' % prefix,
+                                           self.token_life)),
+                'auth_method': conf.get('%sauth_method' % prefix,
+                                        self.auth_method),
+                'realm_name': conf.get('%srealm_name' % prefix,
+                                       self.realm_name)}
         self.allow_overrides = config_true_value(
             conf.get('allow_overrides', 't'))
         self.storage_url_scheme = conf.get('storage_url_scheme', 'default')
@@ -87,6 +198,396 @@ class KerbAuth(object):
         if not self.ext_authentication_url:
             raise RuntimeError("Missing filter parameter ext_authentication_"
                                "url in /etc/swift/proxy-server.conf")
+        # Rejections are answered with responses built once
+        self.unauthorized = Rejection(401)
+        self.forbidden = Rejection(403)
+        self.redirect = Rejection(303, location=self.ext_authentication_url)
+        self.rejection_stats = Counters(
+            self.logger, float(conf.get('rejection_stats_interval', 1)))
+        self.negotiate_acceptor = None
+        if config_true_value(conf.get('negotiate', 'no')):
+            self.negotiate_acceptor = GSSAcceptor(
+                conf.get('negotiate_keytab', '/etc/swift/http.keytab'),
+                conf.get('negotiate_service', 'HTTP'))
+        self.kinit_hedge_configs = [
+            c.strip() for c in conf.get('kinit_hedge_configs', '').split(',')
+            if c.strip()]
+        self.kinit_hedge_delay = float(conf.get('kinit_hedge_delay', 0.2))
+        self.kinit_latency = LatencyTracker()
+        self.helper_pool = None
+        helper_processes = int(conf.get('helper_processes', 0))
+        if helper_processes > 0:
+            self.helper_pool = HelperPool(
+                helper_processes, float(conf.get('helper_timeout', 5)))
+        self.group_resolver = get_group_resolver(conf)
+        self.token_store = get_token_store(conf)
+        self.local_cache = LocalCache(
+            int(conf.get('local_token_cache_size', 10000)),
+            int(conf.get('local_token_cache_bytes', 0)))
+        self.local_token_ttl = float(conf.get('local_token_ttl', 0))
+        self.token_write_behind = config_true_value(
+            conf.get('token_write_behind', 'no'))
+        self.token_write_retries = int(conf.get('token_write_retries', 3))
+        self.token_write_retry_delay = float(
+            conf.get('token_write_retry_delay', 0.1))
+        # Tokens minted in write-behind mode and not yet in the token store,
+        # by token key and by (prefix, generation, user)
+        self.pending_tokens = {}
+        self.pending_users = {}
+        self.generation_ttl = float(conf.get('token_generation_ttl', 5))
+        self.generations = {}
+        self.token_lookups = SingleFlight()
+        self.failed_login_ttl = float(conf.get('failed_login_cache_ttl', 30))
+        self.failed_logins = LocalCache(
+            int(conf.get('failed_login_cache_size', 10000))
+            if self.failed_login_ttl > 0 else 0)
+        self.failed_login_salt = os.urandom(16)
+        self.login_ratelimit_shared = config_true_value(
+            conf.get('login_ratelimit_shared', 'no'))
+        login_rate_burst = int(conf.get('login_rate_burst', 10))
+        self.user_limiter = get_limiter(
+            float(conf.get('login_rate_per_user', 0)), login_rate_burst,
+            self.login_ratelimit_shared,
+            '%s/ratelimit/user' % self.reseller_prefix)
+        self.ip_limiter = get_limiter(
+            float(conf.get('login_rate_per_ip', 0)), login_rate_burst,
+            self.login_ratelimit_shared,
+            '%s/ratelimit/ip' % self.reseller_prefix)
+        self.validate_max_tokens = int(conf.get('validate_max_tokens', 1000))
+        self.validate_max_body = int(conf.get(
+            'validate_max_body', self.validate_max_tokens * 256))
+        self.memcache_breaker = None
+        if config_true_value(conf.get('memcache_breaker', 'no')):
+            self.memcache_breaker = CircuitBreaker(
+                call_timeout=float(conf.get('memcache_timeout', 0.5)),
+                latency_threshold=float(
+                    conf.get('breaker_latency_threshold', 0.25)),
+                error_threshold=int(conf.get('breaker_error_threshold', 5)),
+                reset_timeout=float(conf.get('breaker_reset_timeout', 30)),
+                on_transition=self._breaker_transition)
+        self.warmup_max_groups = int(conf.get('warmup_max_groups', 10000))
+        self.warmup_max_tokens = int(conf.get('warmup_max_tokens', 10000))
+        self.warmup_token_snapshot = conf.get('warmup_token_snapshot')
+        self.warmup_snapshot_interval = \
+            float(conf.get('warmup_snapshot_interval', 300))
+        self.snapshot_lock = None
+        self.memcache_servers = conf.get('memcache_servers', MEMCACHE_SERVERS)
+        self.debug_logging = self.logger.logger.isEnabledFor(logging.DEBUG)
+        self.debug_sample_rate = int(conf.get('debug_sample_rate', 1))
+        self.exception_limiter = get_limiter(
+            float(conf.get('exception_log_rate', 1)),
+            int(conf.get('exception_log_burst', 10)))
+        self.suppressed_exceptions = {}
+        self.audit = get_audit_log(conf, self.logger)
+        self.capture = None
+        if conf.get('capture_path'):
+            self.capture = TrafficCapture(
+                conf['capture_path'], conf.get('capture_key'),
+                int(conf.get('capture_flush_every', 100)))
+            self.next_app = self.app
+            self.app = self._pass_on
+        self.tracer = get_tracer(conf)
+        self.profiler = None
+        profile_sample_rate = int(conf.get('profile_sample_rate', 0))
+        if profile_sample_rate > 0:
+            self.profiler = RequestProfiler(
+                profile_sample_rate,
+                conf.get('profile_dump_path',
+                         '/var/cache/swift/kerbauth_profile'),
+                float(conf.get('profile_dump_interval', 60)))
+        # Chosen once, so that requests pay nothing for observers turned off
+        if self.tracer:
+            self.dispatch = self._traced_call
+        elif self.capture or self.profiler:
+            self.dispatch = self._observed_call
+        else:
+            self.dispatch = self._call
+        self.memory_report_interval = \
+            float(conf.get('memory_report_interval', 60))
+        if self.memory_report_interval > 0 and \
+                getattr(self.logger.logger, 'statsd_client', None):
+            spawn_n(call_every, self.memory_report_interval,
+                    self.report_memory, self.logger, 'Reporting memory usage')
+        tracemalloc_frames = int(conf.get('tracemalloc_frames', 0))
+        if tracemalloc_frames > 0:
+            if tracemalloc is None:
+                self.logger.warning('tracemalloc_frames is set but the '
+                                    'tracemalloc module is not available')
+            elif not tracemalloc.is_tracing():
+                tracemalloc.start(tracemalloc_frames)
+        self.memory_snapshot_path = conf.get('memory_snapshot_path')
+        if self.memory_snapshot_path:
+            # Installed by the first request, so only in workers: the Swift
+            # parent process loads the filter too
+            self.worker_dispatch = self.dispatch
+            self.dispatch = self._first_call
+        if self.warmup_token_snapshot and self.local_token_ttl <= 0:
+            # get_groups() would never read the prefetched tokens
+            self.logger.warning('warmup_token_snapshot is ignored unless '
+                                'local_token_ttl is set')
+            self.warmup_token_snapshot = None
+        if config_true_value(conf.get('warmup', 'no')):
+            # Runs once the worker starts serving, without delaying it
+            spawn_n(self.warmup)
+            if self.warmup_token_snapshot:
+                spawn_n(call_every, self.warmup_snapshot_interval,
+                        self.snapshot_tokens, self.logger,
+                        'Writing token snapshot')
+
+    def warmup(self):
+        """
+        Preloads the gid to group name index and the tokens listed in the
+        warmup_token_snapshot file into the local token cache.
+        """
+        try:
+            # NSS enumeration blocks, and may walk a whole directory
+            groups = tpool.execute(GROUP_NAMES.preload,
+                                   self.warmup_max_groups)
+            tokens = 0
+            if self.warmup_token_snapshot:
+                tokens = self.prefetch_tokens(read_token_snapshot(
+                    self.warmup_token_snapshot, self.warmup_max_tokens))
+            self.logger.info('Warmup loaded %d groups and %d tokens',
+                             groups, tokens)
+        except Exception:
+            self.logger.exception('Warmup failed')
+
+    def prefetch_tokens(self, tokens):
+        """
+        Loads tokens into the local token cache, outside of any request.
+
+        :returns: number of valid tokens loaded
+        """
+        if self.token_store is not None:
+            store = self.token_store
+        elif self.memcache_servers:
+            store = memcache_store(self.memcache_servers)
+        else:
+            return 0
+        return len([auth_data for auth_data in
+                    self.get_auth_data_multi({'swift.cache': store},
+                                             tokens).itervalues()
+                    if auth_data])
+
+    def snapshot_tokens(self):
+        """
+        Writes the tokens of the local token cache to the snapshot, if this
+        worker is the snapshot writer.
+        """
+        if self.snapshot_lock is None:
+            self.snapshot_lock = lock_token_snapshot(
+                self.warmup_token_snapshot)
+            if self.snapshot_lock is None:
+                return
+        tokens = []
+        for key in self.local_cache.store.keys():
+            namespace, sep, token = key.partition('/token/')
+            if sep and namespace.split('/')[0] in self.reseller_options:
+                tokens.append(token)
+        if tokens:
+            tpool.execute(write_token_snapshot, self.warmup_token_snapshot,
+                          tokens[:self.warmup_max_tokens])
+
+    def memory_usage(self):
+        """
+        Returns a dict mapping the name of each in-process cache to its
+        number of entries and estimated bytes.
+        """
+        usage = {'local_token_cache': (len(self.local_cache),
+                                       self.local_cache.bytes),
+                 'failed_login_cache': (len(self.failed_logins),
+                                        self.failed_logins.bytes),
+                 'group_names': (len(GROUP_NAMES.names),
+                                 sizeof(GROUP_NAMES.names))}
+        cache = getattr(self.group_resolver, 'cache', None)
+        if cache is not None:
+            usage['ldap_group_cache'] = (len(cache), cache.bytes)
+        return usage
+
+    def report_memory(self):
+        """
+        Sends the entries and bytes of the caches to statsd. The swift
+        logger has no gauges, so they are sent as timer samples, one per
+        interval: their mean is the size over the statsd flush interval.
+        """
+        for name, (entries, size) in self.memory_usage().iteritems():
+            self.logger.timing('memory.%s.entries' % name, entries)
+            self.logger.timing('memory.%s.bytes' % name, size)
+
+    def _first_call(self, env, start_response):
+        """Installs the SIGUSR2 handler of the worker, then serves."""
+        self.dispatch = self.worker_dispatch
+        signal.signal(signal.SIGUSR2, self._memory_snapshot_signal)
+        return self.dispatch(env, start_response)
+
+    def _memory_snapshot_signal(self, signum, frame):
+        # Written outside of the signal handler
+        spawn_n(self.memory_snapshot)
+
+    def memory_snapshot(self):
+        """Writes a memory snapshot, see write_memory_snapshot()."""
+        try:
+            path = write_memory_snapshot(self.memory_snapshot_path)
+            self.logger.info('Memory snapshot written to %s; cache usage '
+                             '(entries, bytes): %s', path,
+                             self.memory_usage())
+        except Exception:
+            self.logger.exception('Writing memory snapshot failed')
+
+    def generation(self, env, prefix):
+        """
+        Returns the current token generation of prefix, read from the token
+        store at most every token_generation_ttl seconds, or None if it is
+        unknown: the token store failed and this worker never read it.
+        """
+        cached = self.generations.get(prefix)
+        now = time()
+        if cached and now - cached[1] < self.generation_ttl:
+            return cached[0]
+        store = self._token_store(env)
+        try:
+            generation = self.token_lookups.do(
+                '%s/generation' % prefix, get_generation, store, prefix)
+            if cached and generation < cached[0]:
+                # Generations never go back: memcache lost the key or failed
+                # to answer. Older tokens must stay invalid.
+                generation = cached[0]
+                store.set('%s/generation' % prefix, generation)
+        except MemcacheUnavailable:
+            self.logger.increment('memcache_breaker.fallback')
+            return cached[0] if cached else 0
+        except Exception:
+            # Not cached, so the next request reads it again. Guessing 0
+            # would accept the tokens revoked by every bump.
+            self.log_exception('generation', env)
+            return cached[0] if cached else None
+        self.generations[prefix] = (generation, now)
+        return generation
+
+    def match_prefix(self, name):
+        """
+        Returns the reseller prefix name (a token or an account) starts
+        with, or None if it belongs to none of ours. An empty or missing
+        name belongs to none, even with an empty reseller prefix.
+        """
+        if not name:
+            return None
+        match = self.reseller_prefix_re.match(name)
+        if match:
+            return match.group(1)
+        return None
+
+    def debug_sampled(self, env):
+        """
+        Returns True if debug messages about the request of env are to be
+        logged. With debug_sample_rate = N, all or none of the messages of
+        a transaction are logged, for one transaction in N on average.
+        """
+        if not self.debug_logging:
+            return False
+        if self.debug_sample_rate <= 1:
+            return True
+        trans_id = env.get('swift.trans_id') or ''
+        return crc32(trans_id) % self.debug_sample_rate == 0
+
+    def log_exception(self, where, env):
+        """
+        Logs the exception being handled and counts it as an error. Each
+        kind of exception is logged at most exception_log_rate times per
+        second, after which the number of suppressed ones is reported.
+        """
+        self.logger.increment('errors')
+        kind = sys.exc_info()[0].__name__
+        if self.exception_limiter and self.exception_limiter.acquire(kind):
+            self.suppressed_exceptions[kind] = \
+                self.suppressed_exceptions.get(kind, 0) + 1
+            return
+        self.logger.exception(
+            'EXCEPTION IN %s: %s %s (trans_id %s, %d similar suppressed)',
+            where, env.get('REQUEST_METHOD'), env.get('PATH_INFO'),
+            env.get('swift.trans_id'),
+            self.suppressed_exceptions.pop(kind, 0))
+
+    def audit_event(self, env, event, status, user=None, account=None):
+        """Adds an event about the request of env to the audit trail."""
+        self.audit.record(event, status, user, account,
+                          env.get('REMOTE_ADDR'), env.get('swift.trans_id'))
+
+    def _breaker_transition(self, state):
+        self.logger.warning('Memcache circuit breaker is now %s', state)
+        self.logger.increment('memcache_breaker.%s' % state)
+
+    def run_kinit(self, user, key):
+        """
+        Verifies the password of user, in a helper process if any. With
+        kinit_hedge_configs, a second KDC is tried once the first one has
+        been slower than the 95th percentile of recent verifications.
+        """
+        if not self.kinit_hedge_configs:
+            if self.helper_pool:
+                return self.helper_pool.run_kinit(user, key)
+            return run_kinit(user, key)
+        hedge_delay = max(self.kinit_hedge_delay,
+                          self.kinit_latency.percentile(95) or 0)
+        start = time()
+        if self.helper_pool:
+            ret = self.helper_pool.run_kinit_hedged(
+                user, key, self.kinit_hedge_configs, hedge_delay)
+        else:
+            ret = run_kinit_hedged(user, key, self.kinit_hedge_configs,
+                                   hedge_delay)
+        if ret != -1:
+            self.kinit_latency.add(time() - start)
+        return ret
+
+    def get_groups_from_username(self, user):
+        """
+        Returns the groups string of user, from the configured group
+        resolver, or else from id -G run in a helper if any.
+        """
+        if self.group_resolver:
+            return self.group_resolver.get_groups(user)
+        if self.helper_pool:
+            return self.helper_pool.get_groups_from_username(user)
+        return get_groups_from_username(user)
+
+    def check_login_rate(self, req, limiter, key, kind):
+        """
+        Counts a login attempt of key against limiter.
+
+        :returns: None if the attempt may proceed, or else a 429
+                  swob.Response with a Retry-After header.
+        """
+        if limiter is None or not key:
+            return None
+        memcache_client = None
+        if self.login_ratelimit_shared:
+            memcache_client = cache_from_env(req.environ)
+            if memcache_client and self.memcache_breaker:
+                memcache_client = GuardedMemcache(memcache_client,
+                                                  self.memcache_breaker)
+        retry_after = limiter.acquire(key, memcache_client)
+        if not retry_after:
+            return None
+        self.logger.increment('ratelimited.%s' % kind)
+        return Response(request=req, status='429 Too Many Requests',
+                        headers={'Retry-After': int(ceil(retry_after))},
+                        body='Too many login attempts\n')
+
+    def _token_store(self, env):
+        """
+        Returns the token store for the request: the configured token_store,
+        or else the memcache client for the request, guarded by the circuit
+        breaker if one is configured.
+        """
+        if self.token_store is not None:
+            return self.token_store
+        memcache_client = cache_from_env(env)
+        if not memcache_client:
+            raise Exception('Memcache required')
+        if self.memcache_breaker:
+            return GuardedMemcache(memcache_client, self.memcache_breaker)
+        return memcache_client
 
     def __call__(self, env, start_response):
         """
@@ -99,55 +600,162 @@ class KerbAuth(object):
         routed through the internal auth request handler (self.handle).
         This is to handle granting tokens, etc.
         """
+        return self.dispatch(env, start_response)
+
+    def _traced_call(self, env, start_response):
+        """Authenticates a request like __call__() and exports its trace."""
+        trace = self.tracer.start(env)
+        if trace is None:
+            return self._observed_call(env, start_response)
+        code_path = self.code_path(env)
+        statuses = []
+
+        def trace_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        env['kerbauth.trace'] = trace
+        try:
+            return self._observed_call(env, trace_start_response)
+        finally:
+            self.tracer.finish(trace, code_path=code_path,
+                               status=int(statuses[0].split(' ', 1)[0])
+                               if statuses else 0)
+
+    def _observed_call(self, env, start_response):
+        """Authenticates a request, captured or profiled if configured."""
+        if self.capture:
+            return self._captured_call(env, start_response)
+        if self.profiler and self.profiler.sample():
+            return self.profiler.run(self.code_path(env), self._call, env,
+                                     start_response)
+        return self._call(env, start_response)
+
+    def _captured_call(self, env, start_response):
+        """Authenticates a request like __call__() and records it."""
+        start = time()
+        code_path = self.code_path(env)
+        statuses = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            return start_response(status, headers, exc_info)
+
+        if self.profiler and self.profiler.sample():
+            resp = self.profiler.run(code_path, self._call, env,
+                                     capture_start_response)
+        else:
+            resp = self._call(env, capture_start_response)
+        passed_on = env.get('kerbauth.passed_on')
+        if passed_on:
+            outcome, elapsed = 0, passed_on - start
+        else:
+            outcome = int(statuses[0].split(' ', 1)[0]) if statuses else 0
+            elapsed = time() - start
+        token = user = account = None
+        if code_path == 'get_token':
+            account, _junk, user = env.get(
+                'HTTP_X_AUTH_USER', env.get('HTTP_X_STORAGE_USER', '')) \
+                .partition(':')
+            user = user.split('@')[0]
+        elif code_path == 'token':
+            token = env.get('HTTP_X_AUTH_TOKEN',
+                            env.get('HTTP_X_STORAGE_TOKEN'))
+            user = env.get('REMOTE_USER', '').split(',')[0]
+            parts = env.get('PATH_INFO', '').split('/')
+            prefix = self.match_prefix(parts[2]) if len(parts) > 2 else None
+            if prefix is not None:
+                account = parts[2][len(prefix):]
+        self.capture.record(start, elapsed, code_path,
+                            env.get('REQUEST_METHOD'), outcome, token, user,
+                            account)
+        return resp
+
+    def _pass_on(self, env, start_response):
+        """Calls the next app, noting when kerbauth handed over a request."""
+        env['kerbauth.passed_on'] = time()
+        return self.next_app(env, start_response)
+
+    def code_path(self, env):
+        """Names the code path of a request in profiles and captures."""
+        path = env.get('PATH_INFO', '')
+        if path.startswith(self.auth_prefix):
+            if path.rstrip('/').endswith('/validate'):
+                return 'validate'
+            if path.rstrip('/').endswith('/invalidate'):
+                return 'invalidate'
+            return 'get_token'
+        if env.get('HTTP_X_AUTH_TOKEN', env.get('HTTP_X_STORAGE_TOKEN')):
+            return 'token'
+        return 'anonymous'
+
+    def span(self, env, name, **attrs):
+        """
+        Returns a context manager timing the stage name of the request of
+        env if it is traced, or doing nothing otherwise.
+        """
+        trace = env.get('kerbauth.trace')
+        if trace is None:
+            return NO_SPAN
+        return trace.span(name, **attrs)
+
+    def _call(self, env, start_response):
+        """Authenticates a request, see __call__()."""
         if self.allow_overrides and env.get('swift.authorize_override', False):
             return self.app(env, start_response)
         if env.get('PATH_INFO', '').startswith(self.auth_prefix):
             return self.handle(env, start_response)
         token = env.get('HTTP_X_AUTH_TOKEN', env.get('HTTP_X_STORAGE_TOKEN'))
-        if token and token.startswith(self.reseller_prefix):
-            groups = self.get_groups(env, token)
+        prefix = self.match_prefix(token)
+        if prefix is not None:
+            groups = self.get_groups(env, token, prefix)
             if groups:
-                user = groups and groups.split(',', 1)[0] or ''
-                trans_id = env.get('swift.trans_id')
-                self.logger.debug('User: %s uses token %s (trans_id %s)' %
-                                  (user, token, trans_id))
+                if self.debug_sampled(env):
+                    self.logger.debug('User: %s uses token %s (trans_id %s)',
+                                      groups.split(',', 1)[0], token,
+                                      env.get('swift.trans_id'))
                 env['REMOTE_USER'] = groups
-                env['swift.authorize'] = self.authorize
+                if self.audit:
+                    self.audit_event(env, 'token', 0, groups.split(',', 1)[0],
+                                     self.request_account(env))
+                env['swift.authorize'] = MemoizedAuthorize(
+                    self, trace=env.get('kerbauth.trace'))
                 env['swift.clean_acl'] = clean_acl
                 if '.reseller_admin' in groups:
                     env['reseller_request'] = True
             else:
                 # Invalid token (may be expired)
-                if self.auth_method == "active":
-                    return HTTPSeeOther(
-                        location=self.ext_authentication_url)(env,
-                                                              start_response)
-                elif self.auth_method == "passive":
-                    self.logger.increment('unauthorized')
-                    return HTTPUnauthorized()(env, start_response)
+                auth_method = self.reseller_options[prefix]['auth_method']
+                if self.audit:
+                    self.audit_event(env, 'token',
+                                     303 if auth_method == 'active' else 401,
+                                     account=self.request_account(env))
+                if auth_method == "active":
+                    return self.redirect(env, start_response)
+                elif auth_method == "passive":
+                    self.rejection_stats.increment('unauthorized')
+                    return self.unauthorized(env, start_response)
         else:
-            # With a non-empty reseller_prefix, I would like to be called
-            # back for anonymous access to accounts I know I'm the
-            # definitive auth for.
-            try:
-                version, rest = split_path(env.get('PATH_INFO', ''),
-                                           1, 2, True)
-            except ValueError:
-                version, rest = None, None
-                self.logger.increment('errors')
             # Not my token, not my account, I can't authorize this request,
             # deny all is a good idea if not already set...
             if 'swift.authorize' not in env:
                 env['swift.authorize'] = self.denied_response
 
-        return self.app(env, start_response)
+        with self.span(env, 'app'):
+            return self.app(env, start_response)
+
+    def request_account(self, env):
+        """Returns the account of a storage request, or None."""
+        parts = env.get('PATH_INFO', '').split('/', 3)
+        return parts[2] if len(parts) > 2 and parts[2] else None
 
-    def get_groups(self, env, token):
+    def get_groups(self, env, token, prefix=None):
         """
         Get groups for the given token.
 
         :param env: The current WSGI environment dictionary.
         :param token: Token to validate and return a group string for.
+        :param prefix: Reseller prefix of the token, if already known.
 
         :returns: None if the token is invalid or a string containing a comma
                   separated list of groups the authenticated user is a member
@@ -155,11 +763,23 @@ class KerbAuth(object):
                   identifier for that user.
         """
         groups = None
-        memcache_client = cache_from_env(env)
-        if not memcache_client:
-            raise Exception('Memcache required')
-        memcache_token_key = '%s/token/%s' % (self.reseller_prefix, token)
-        cached_auth_data = memcache_client.get(memcache_token_key)
+        if prefix is None:
+            prefix = self.match_prefix(token)
+            if prefix is None:
+                return None
+        generation = self.generation(env, prefix)
+        if generation is None:
+            return None
+        memcache_token_key = token_key(token, prefix, generation)
+        cached_auth_data = None
+        if self.local_token_ttl > 0:
+            cached_auth_data = self.local_cache.get(
+                memcache_token_key, max_age=self.local_token_ttl)
+        if not cached_auth_data:
+            with self.span(env, 'memcache.get') as span:
+                cached_auth_data = self._fetch_auth_data(env,
+                                                         memcache_token_key)
+                span.set(hit=bool(cached_auth_data))
         if cached_auth_data:
             expires, groups = cached_auth_data
             if expires < time():
@@ -167,6 +787,88 @@ class KerbAuth(object):
 
         return groups
 
+    def _fetch_auth_data(self, env, memcache_token_key):
+        """
+        Reads the expiry and groups of a token from the token store, keeping
+        the local token cache in sync.
+        """
+        store = self._token_store(env)
+        try:
+            cached_auth_data = self.token_lookups.do(
+                memcache_token_key, store.get, memcache_token_key)
+        except MemcacheUnavailable:
+            # Degraded mode: trust what this worker has already seen.
+            self.logger.increment('memcache_breaker.fallback')
+            return self.local_cache.get(memcache_token_key)
+        if cached_auth_data:
+            self.local_cache.set(memcache_token_key, cached_auth_data,
+                                 timeout=cached_auth_data[0] - time())
+        elif memcache_token_key in self.pending_tokens:
+            # Minted here, still being written
+            return self.pending_tokens[memcache_token_key]
+        else:
+            self.local_cache.delete(memcache_token_key)
+        return cached_auth_data
+
+    def get_auth_data_multi(self, env, tokens):
+        """
+        Looks up many tokens at once.
+
+        :param env: The current WSGI environment dictionary.
+        :param tokens: List of tokens to validate.
+
+        :returns: dict mapping each token to a tuple of its expiry time and
+                  groups string, or to None if the token is invalid.
+        """
+        now = time()
+        results = dict((token, None) for token in tokens)
+        tokens, keys = [], []
+        generations = {}
+        for token in results:
+            prefix = self.match_prefix(token)
+            if prefix is None:
+                continue
+            if prefix not in generations:
+                generations[prefix] = self.generation(env, prefix)
+            if generations[prefix] is None:
+                continue
+            key = token_key(token, prefix, generations[prefix])
+            value = None
+            if self.local_token_ttl > 0:
+                value = self.local_cache.get(key, max_age=self.local_token_ttl)
+            if value:
+                if value[0] >= now:
+                    results[token] = tuple(value)
+            else:
+                tokens.append(token)
+                keys.append(key)
+        if not keys:
+            return results
+        store = self._token_store(env)
+        try:
+            with self.span(env, 'memcache.get_multi', keys=len(keys)):
+                values = get_multi(store, keys)
+        except MemcacheUnavailable:
+            self.logger.increment('memcache_breaker.fallback')
+            values = map(self.local_cache.get, keys)
+        for token, key, value in zip(tokens, keys, values):
+            value = value or self.pending_tokens.get(key)
+            if value and value[0] >= now:
+                results[token] = tuple(value)
+                self.local_cache.set(key, value, timeout=value[0] - now)
+        return results
+
+    def is_reseller_admin(self, groups, prefix=None):
+        """
+        Returns True if the comma separated groups string grants reseller
+        admin rights for prefix, by default our first reseller prefix.
+        """
+        if prefix is None:
+            prefix = self.reseller_prefix
+        admin_group = ("%sreseller_admin" % prefix).lower()
+        groups = groups.split(',')
+        return '.reseller_admin' in groups or admin_group in groups
+
     def authorize(self, req):
         """
         Returns None if the request is authorized to continue or a standard
@@ -181,10 +883,13 @@ class KerbAuth(object):
             self.logger.increment('errors')
             return HTTPNotFound(request=req)
 
-        if not account or not account.startswith(self.reseller_prefix):
-            self.logger.debug("Account name: %s doesn't start with "
-                              "reseller_prefix: %s."
-                              % (account, self.reseller_prefix))
+        debug = self.debug_sampled(req.environ)
+        prefix = self.match_prefix(account)
+        if not account or prefix is None:
+            if debug:
+                self.logger.debug("Account name: %s doesn't start with "
+                                  "reseller_prefix: %s.", account,
+                                  ','.join(self.reseller_prefixes))
             return self.denied_response(req)
 
         user_groups = (req.remote_user or '').split(',')
@@ -192,10 +897,10 @@ class KerbAuth(object):
         # If the user is in the reseller_admin group for our prefix, he gets
         # full access to all accounts we manage. For the default reseller
         # prefix, the group name is auth_reseller_admin.
-        admin_group = ("%sreseller_admin" % self.reseller_prefix).lower()
+        admin_group = ("%sreseller_admin" % prefix).lower()
         if admin_group in user_groups and \
-                account != self.reseller_prefix and \
-                account[len(self.reseller_prefix)] != '.':
+                account != prefix and \
+                account[len(prefix)] != '.':
             req.environ['swift_owner'] = True
             return None
 
@@ -206,35 +911,43 @@ class KerbAuth(object):
             # If the user is admin for the account and is not trying to do an
             # account DELETE or PUT...
             req.environ['swift_owner'] = True
-            self.logger.debug("User %s has admin authorizing."
-                              % account_user)
+            if debug:
+                self.logger.debug("User %s has admin authorizing.",
+                                  account_user)
             return None
 
         if (req.environ.get('swift_sync_key')
                 and (req.environ['swift_sync_key'] ==
                      req.headers.get('x-container-sync-key', None))
                 and 'x-timestamp' in req.headers):
-            self.logger.debug("Allow request with container sync-key: %s."
-                              % req.environ['swift_sync_key'])
+            if debug:
+                self.logger.debug("Allow request with container sync-key: "
+                                  "%s.", req.environ['swift_sync_key'])
             return None
 
         if req.method == 'OPTIONS':
             #allow OPTIONS requests to proceed as normal
-            self.logger.debug("Allow OPTIONS request.")
+            if debug:
+                self.logger.debug("Allow OPTIONS request.")
             return None
 
-        referrers, groups = parse_acl(getattr(req, 'acl', None))
+        with self.span(req.environ, 'acl'):
+            referrers, groups = parse_acl(getattr(req, 'acl', None))
+            referrer_ok = referrer_allowed(req.referer, referrers)
 
-        if referrer_allowed(req.referer, referrers):
+        if referrer_ok:
             if obj or '.rlistings' in groups:
-                self.logger.debug("Allow authorizing %s via referer ACL."
-                                  % req.referer)
+                if debug:
+                    self.logger.debug("Allow authorizing %s via referer "
+                                      "ACL.", req.referer)
                 return None
 
         for user_group in user_groups:
             if user_group in groups:
-                self.logger.debug("User %s allowed in ACL: %s authorizing."
-                                  % (account_user, user_group))
+                if debug:
+                    self.logger.debug("User %s allowed in ACL: %s "
+                                      "authorizing.", account_user,
+                                      user_group)
                 return None
 
         return self.denied_response(req)
@@ -245,14 +958,27 @@ class KerbAuth(object):
         depending on whether the REMOTE_USER is set or not.
         """
         if req.remote_user:
-            self.logger.increment('forbidden')
-            return HTTPForbidden(request=req)
+            self.rejection_stats.increment('forbidden')
+            if self.audit:
+                self.audit_event(req.environ, 'denied', 403,
+                                 req.remote_user.split(',', 1)[0],
+                                 self.request_account(req.environ))
+            return self.forbidden
         else:
-            if self.auth_method == "active":
-                return HTTPSeeOther(location=self.ext_authentication_url)
-            elif self.auth_method == "passive":
-                self.logger.increment('unauthorized')
-                return HTTPUnauthorized(request=req)
+            auth_method = self.auth_method
+            account = self.request_account(req.environ)
+            prefix = self.match_prefix(account)
+            if prefix is not None:
+                auth_method = self.reseller_options[prefix]['auth_method']
+            if self.audit:
+                self.audit_event(req.environ, 'denied',
+                                 303 if auth_method == 'active' else 401,
+                                 account=account)
+            if auth_method == "active":
+                return self.redirect
+            elif auth_method == "passive":
+                self.rejection_stats.increment('unauthorized')
+                return self.unauthorized
 
     def handle(self, env, start_response):
         """
@@ -274,8 +1000,7 @@ class KerbAuth(object):
                 req.headers['x-auth-token'] = req.headers['x-storage-token']
             return self.handle_request(req)(env, start_response)
         except (Exception, Timeout):
-            print "EXCEPTION IN handle: %s: %s" % (format_exc(), env)
-            self.logger.increment('errors')
+            self.log_exception('handle', env)
             start_response('500 Server Error',
                            [('Content-Type', 'text/plain')])
             return ['Internal server error.\n']
@@ -294,7 +1019,13 @@ class KerbAuth(object):
         except ValueError:
             self.logger.increment('errors')
             return HTTPNotFound(request=req)
-        if version in ('v1', 'v1.0', 'auth'):
+        if req.path_info.rstrip('/') == '/validate':
+            if req.method == 'POST':
+                handler = self.handle_validate
+        elif req.path_info.rstrip('/') == '/invalidate':
+            if req.method == 'POST':
+                handler = self.handle_invalidate
+        elif version in ('v1', 'v1.0', 'auth'):
             if req.method == 'GET':
                 handler = self.handle_get_token
         if not handler:
@@ -302,8 +1033,24 @@ class KerbAuth(object):
             req.response = HTTPBadRequest(request=req)
         else:
             req.response = handler(req)
+            if self.audit:
+                self.audit_auth_request(req, handler)
         return req.response
 
+    def audit_auth_request(self, req, handler):
+        """Adds the outcome of a token or validate request to the audit."""
+        if handler != self.handle_get_token:
+            self.audit_event(req.environ, handler.__name__[len('handle_'):],
+                             req.response.status_int,
+                             req.environ.get('kerbauth.user'))
+            return
+        account, _junk, user = unquote(
+            req.headers.get('x-auth-user', '') or
+            req.headers.get('x-storage-user', '')).rpartition(':')
+        self.audit_event(req.environ, 'login', req.response.status_int,
+                         req.environ.get('kerbauth.user') or user or None,
+                         account or None)
+
     def handle_get_token(self, req):
         """
         Handles the various `request for token and service end point(s)` calls.
@@ -354,12 +1101,21 @@ class KerbAuth(object):
                 or pathsegs[0] in ('auth', 'v1.0')):
                     return HTTPBadRequest(request=req)
 
+        resp = self.check_login_rate(req, self.ip_limiter, req.remote_addr,
+                                     'ip')
+        if resp:
+            return resp
+
+        prefix = self.login_prefix(req, pathsegs)
+        options = self.reseller_options[prefix]
+
         # Client is inside the domain
-        if self.auth_method == "active":
-            return HTTPSeeOther(location=self.ext_authentication_url)
+        if options['auth_method'] == "active":
+            return self.handle_negotiate(req, prefix) or \
+                HTTPSeeOther(location=self.ext_authentication_url)
 
         # Client is outside the domain
-        elif self.auth_method == "passive":
+        elif options['auth_method'] == "passive":
             account, user, key = None, None, None
             # Extract user, account and key from request
             if pathsegs[0] == 'v1' and pathsegs[2] == 'auth':
@@ -392,16 +1148,34 @@ class KerbAuth(object):
 
             if not (account or user or key):
                 # If all are not given, client may be part of the domain
-                return HTTPSeeOther(location=self.ext_authentication_url)
+                return self.handle_negotiate(req, prefix) or \
+                    HTTPSeeOther(location=self.ext_authentication_url)
             elif None in (key, user, account):
                 # If only one or two of them is given, but not all
                 return HTTPUnauthorized(request=req)
+            if prefix and account.startswith(prefix):
+                account = account[len(prefix):]
+
+            # AD user names are case insensitive, so are the limits
+            resp = self.check_login_rate(req, self.user_limiter, user.lower(),
+                                         'user')
+            if resp:
+                return resp
 
             # Run kinit on the user
-            if self.realm_name and "@" not in user:
-                user = user + "@" + self.realm_name
+            if options['realm_name'] and "@" not in user:
+                user = user + "@" + options['realm_name']
+            # Don't bother the KDC again with credentials it just rejected
+            failed_login_key = hmac.new(self.failed_login_salt,
+                                        '%s\0%s' % (user.lower(), key),
+                                        sha256).hexdigest()
+            if self.failed_logins.get(failed_login_key):
+                self.logger.increment('failed_login_cache.hit')
+                return HTTPUnauthorized(request=req)
             try:
-                ret = run_kinit(user, key)
+                with self.span(req.environ, 'kinit') as span:
+                    ret = self.run_kinit(user, key)
+                    span.set(ret=ret)
             except OSError as e:
                 if e.errno == errno.ENOENT:
                     return HTTPServerError("kinit command not found\n")
@@ -411,6 +1185,11 @@ class KerbAuth(object):
                     self.logger.warning("Failed: kinit: Password has probably "
                                         "expired.")
                     return HTTPServerError("Kinit is taking too long.\n")
+                if ret == KINIT_UNREACHABLE:
+                    # Says nothing about the password, don't cache it
+                    return HTTPServerError("Cannot contact any KDC.\n")
+                self.failed_logins.set(failed_login_key, True,
+                                       timeout=self.failed_login_ttl)
                 return HTTPUnauthorized(request=req)
             self.logger.debug("kinit succeeded")
 
@@ -418,39 +1197,309 @@ class KerbAuth(object):
                 user = user.split("@")[0]
 
             # Check if user really belongs to the account
-            groups_list = get_groups_from_username(user).strip().split(",")
-            user_group = ("%s%s" % (self.reseller_prefix, account)).lower()
-            reseller_admin_group = \
-                ("%sreseller_admin" % self.reseller_prefix).lower()
+            with self.span(req.environ, 'groups'):
+                groups_list = \
+                    self.get_groups_from_username(user).strip().split(",")
+            user_group = ("%s%s" % (prefix, account)).lower()
+            reseller_admin_group = ("%sreseller_admin" % prefix).lower()
             if user_group not in groups_list:
                 # Check if user is reseller_admin. If not, return Unauthorized.
                 # On AD/IdM server, auth_reseller_admin is a separate group
                 if reseller_admin_group not in groups_list:
                     return HTTPUnauthorized(request=req)
 
-            mc = cache_from_env(req.environ)
-            if not mc:
-                raise Exception('Memcache required')
-            token, expires, groups = get_auth_data(mc, user)
+            token, expires, groups = self.issue_token(req, user, prefix)
             if not token:
-                token = generate_token()
-                expires = time() + self.token_life
-                groups = get_groups_from_username(user)
-                set_auth_data(mc, user, token, expires, groups)
+                return HTTPServerError("Token store unavailable.\n")
+            resp = self.token_response(req, user, token, expires, groups,
+                                       prefix)
+            resp.headers['X-Storage-Url'] = \
+                '%s/v1/%s%s' % (resp.host_url, prefix, account)
+            return resp
 
-            headers = {'X-Auth-Token': token,
-                       'X-Storage-Token': token}
+    def login_prefix(self, req, pathsegs):
+        """
+        Returns the reseller prefix a token request logs in to: the one the
+        account of the request starts with, if any, else the default one.
 
-            if self.debug_headers:
-                headers.update({'X-Debug-Remote-User': user,
-                                'X-Debug-Groups:': groups,
-                                'X-Debug-Token-Life': self.token_life,
-                                'X-Debug-Token-Expires': ctime(expires)})
+        :param req: The swob.Request to process.
+        :param pathsegs: The split path of the token request.
+        """
+        if pathsegs[0] == 'v1':
+            account = pathsegs[1]
+        else:
+            account = unquote(req.headers.get('x-auth-user', '')) or \
+                req.headers.get('x-storage-user') or ''
+            account = account.split(':', 1)[0] if ':' in account else ''
+        prefix = self.match_prefix(account)
+        if prefix is None:
+            return self.reseller_prefix
+        return prefix
 
-            resp = Response(request=req, headers=headers)
-            resp.headers['X-Storage-Url'] = \
-                '%s/v1/%s%s' % (resp.host_url, self.reseller_prefix, account)
+    def handle_validate(self, req):
+        """
+        Handles the batch token validation call, meant for internal services
+        that need to check many tokens::
+
+            POST <auth-prefix>validate
+                X-Auth-Token: <token of a reseller admin>
+
+                ["<token>", "<token>", ...]
+
+        The body may also be a JSON object with the list under "tokens". The
+        response is a JSON object mapping each token to null if it is not
+        valid, or else to an object with its "user", "groups" and "expires"
+        (seconds since the epoch).
+
+        :param req: The swob.Request to process.
+        :returns: swob.Response, 200 with the JSON body explained above.
+        """
+        prefix, resp = self.check_reseller_admin(req)
+        if resp:
             return resp
+        if req.content_length is not None and \
+                req.content_length > self.validate_max_body:
+            return HTTPRequestEntityTooLarge(request=req)
+        # Chunked bodies have no Content-Length: read one byte past the
+        # limit to tell whether the body is over it
+        body = []
+        size = 0
+        while size <= self.validate_max_body:
+            chunk = req.body_file.read(self.validate_max_body + 1 - size)
+            if not chunk:
+                break
+            body.append(chunk)
+            size += len(chunk)
+        if size > self.validate_max_body:
+            return HTTPRequestEntityTooLarge(request=req)
+        try:
+            tokens = json.loads(''.join(body))
+        except ValueError:
+            return HTTPBadRequest(request=req, body='Malformed JSON body\n')
+        if isinstance(tokens, dict):
+            tokens = tokens.get('tokens')
+        if not isinstance(tokens, list) or \
+                not all(isinstance(t, basestring) for t in tokens):
+            return HTTPBadRequest(request=req,
+                                  body='Expected a list of tokens\n')
+        if len(tokens) > self.validate_max_tokens:
+            return HTTPRequestEntityTooLarge(request=req)
+
+        results = {}
+        for token, auth_data in \
+                self.get_auth_data_multi(req.environ, tokens).iteritems():
+            if auth_data:
+                expires, groups = auth_data
+                groups = groups.split(',')
+                auth_data = {'user': groups[0], 'groups': groups,
+                             'expires': expires}
+            results[token] = auth_data
+        return Response(request=req, body=json.dumps(results),
+                        content_type='application/json')
+
+    def check_reseller_admin(self, req):
+        """
+        Checks that the X-Auth-Token of req belongs to a reseller admin.
+
+        :returns: the reseller prefix of the token and None, or None and
+                  the 401 or 403 swob.Response to answer with.
+        """
+        token = req.headers.get('x-auth-token')
+        groups = None
+        prefix = self.match_prefix(token)
+        if prefix is not None:
+            groups = self.get_groups(req.environ, token, prefix)
+        if not groups:
+            self.logger.increment('unauthorized')
+            return None, HTTPUnauthorized(request=req)
+        req.environ['kerbauth.user'] = groups.split(',', 1)[0]
+        if not self.is_reseller_admin(groups, prefix):
+            self.logger.increment('forbidden')
+            return None, HTTPForbidden(request=req)
+        return prefix, None
+
+    def handle_invalidate(self, req):
+        """
+        Handles the call invalidating every token of a reseller prefix at
+        once, such as after a change of group policy::
+
+            POST <auth-prefix>invalidate
+                X-Auth-Token: <token of a reseller admin>
+
+        The tokens of the reseller prefix of the admin token, including that
+        one, stop being accepted by this worker at once, and by the others
+        within token_generation_ttl seconds. The response is a JSON object
+        with the new "generation".
+
+        :param req: The swob.Request to process.
+        :returns: swob.Response, 200 with the JSON body explained above.
+        """
+        prefix, resp = self.check_reseller_admin(req)
+        if resp:
+            return resp
+        generation = bump_generation(self._token_store(req.environ), prefix)
+        self.generations[prefix] = (generation, time())
+        self.logger.warning('Tokens of %s invalidated by %s, now in '
+                            'generation %d', prefix or 'NONE',
+                            req.environ['kerbauth.user'], generation)
+        self.logger.increment('invalidated')
+        return Response(request=req, body=json.dumps(
+            {'generation': generation}), content_type='application/json')
+
+    def handle_negotiate(self, req, prefix=None):
+        """
+        Authenticates a request carrying "Authorization: Negotiate" in
+        process, sparing the client the redirect to ext_authentication_url.
+        The keytab check runs in a native thread so it does not stall the
+        other greenthreads of the worker.
+
+        :param req: The swob.Request to process.
+        :param prefix: Reseller prefix of the token, by default the first.
+        :returns: swob.Response with the token on success, or None if the
+                  client has to be redirected to ext_authentication_url.
+        """
+        if self.negotiate_acceptor is None:
+            return None
+        in_token = parse_negotiate_header(req.headers.get('Authorization'))
+        if in_token is None:
+            return None
+        try:
+            with self.span(req.environ, 'negotiate'):
+                principal, out_token = tpool.execute(
+                    self.negotiate_acceptor.accept, in_token)
+        except NegotiateError as err:
+            self.logger.increment('negotiate.failure')
+            self.logger.info("Negotiate authentication failed: %s", err)
+            return None
+        self.logger.increment('negotiate.success')
+        user = principal.split('@')[0]
+        token, expires, groups = self.issue_token(req, user, prefix)
+        if not token:
+            return HTTPServerError("Token store unavailable.\n")
+        resp = self.token_response(req, user, token, expires, groups, prefix)
+        if out_token:
+            resp.headers['WWW-Authenticate'] = \
+                'Negotiate %s' % base64.b64encode(out_token)
+        return resp
+
+    def issue_token(self, req, user, prefix=None):
+        """
+        Returns the token, expiry time and groups of an authenticated user,
+        reusing the user's current token if there is one and minting a new
+        one otherwise.
+
+        :param req: The swob.Request being processed.
+        :param user: Name of the authenticated user, without realm.
+        :param prefix: Reseller prefix of the token, by default the first.
+
+        :returns: (None, None, None) if the token generation is unknown.
+        """
+        if prefix is None:
+            prefix = self.reseller_prefix
+        token_life = self.reseller_options[prefix]['token_life']
+        generation = self.generation(req.environ, prefix)
+        if generation is None:
+            return None, None, None
+        mc = self._token_store(req.environ)
+        pending_user = (prefix, generation, user)
+        token = self.pending_users.get(pending_user)
+        if token:
+            # Minted by an earlier login whose write is still in flight
+            expires, groups = self.pending_tokens[
+                token_key(token, prefix, generation)]
+            if expires > time():
+                return token, expires, groups
+        try:
+            with self.span(req.environ, 'memcache.get'):
+                token, expires, groups = get_auth_data(mc, user, prefix,
+                                                       generation)
+        except MemcacheUnavailable:
+            # Degraded mode: hand out a token only this worker knows.
+            self.logger.increment('memcache_breaker.fallback')
+            mc = self.local_cache
+            token, expires, groups = get_auth_data(mc, user, prefix,
+                                                   generation)
+        if not token:
+            token = generate_token(prefix)
+            expires = time() + token_life
+            with self.span(req.environ, 'groups'):
+                groups = self.get_groups_from_username(user)
+            if self.token_write_behind and mc is not self.local_cache:
+                key = token_key(token, prefix, generation)
+                self.local_cache.set(key, (expires, groups),
+                                     timeout=expires - time())
+                self.pending_tokens[key] = (expires, groups)
+                self.pending_users[pending_user] = token
+                spawn_n(self.write_token, req.environ, mc, user, token,
+                        expires, groups, prefix, token_life, generation)
+                return token, expires, groups
+            try:
+                with self.span(req.environ, 'memcache.set'):
+                    set_auth_data(mc, user, token, expires, groups, prefix,
+                                  token_life, generation)
+            except MemcacheUnavailable:
+                self.logger.increment('memcache_breaker.fallback')
+                mc = self.local_cache
+                set_auth_data(mc, user, token, expires, groups, prefix,
+                              token_life, generation)
+            if mc is not self.local_cache:
+                self.local_cache.set(token_key(token, prefix, generation),
+                                     (expires, groups),
+                                     timeout=expires - time())
+        return token, expires, groups
+
+    def write_token(self, env, mc, user, token, expires, groups, prefix,
+                    token_life, generation):
+        """
+        Stores a token minted in write-behind mode in the token store,
+        retrying token_write_retries times with exponential backoff. If all
+        attempts fail the token is revoked, since other workers cannot see
+        it.
+
+        MemcacheRing does not report failed writes, so each write is
+        confirmed by reading the token back.
+        """
+        start = time()
+        key = token_key(token, prefix, generation)
+        try:
+            for attempt in range(self.token_write_retries + 1):
+                if attempt:
+                    sleep(self.token_write_retry_delay * 2 ** (attempt - 1))
+                try:
+                    if set_auth_data(mc, user, token, expires, groups, prefix,
+                                     token_life, generation) and \
+                            mc.get(key):
+                        # Time during which other workers refuse the token
+                        self.logger.timing_since('token_write.timing', start)
+                        return
+                except Exception:
+                    self.log_exception('write_token', env)
+            self.local_cache.delete(key)
+            self.logger.increment('token_write.errors')
+        finally:
+            self.pending_tokens.pop(key, None)
+            if self.pending_users.get((prefix, generation, user)) == token:
+                del self.pending_users[(prefix, generation, user)]
+
+    def token_response(self, req, user, token, expires, groups, prefix=None):
+        """
+        Returns a 200 swob.Response carrying the token, plus debug headers
+        if debug_headers is set.
+        """
+        if prefix is None:
+            prefix = self.reseller_prefix
+        req.environ['kerbauth.user'] = user
+        headers = {'X-Auth-Token': token,
+                   'X-Storage-Token': token}
+
+        if self.debug_headers:
+            headers.update({'X-Debug-Remote-User': user,
+                            'X-Debug-Groups:': groups,
+                            'X-Debug-Token-Life':
+                            self.reseller_options[prefix]['token_life'],
+                            'X-Debug-Token-Expires': ctime(expires)})
+
+        return Response(request=req, headers=headers)
 
 
 def filter_factory(global_conf, **local_conf):
@@ -13,12 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import re
 import random
 import grp
-import signal
+import ctypes
+import ctypes.util
+from itertools import islice
 from subprocess import Popen, PIPE
 from time import time
+from eventlet import sleep
 from swiftkerbauth import TOKEN_LIFE, RESELLER_PREFIX
 
 
@@ -31,19 +35,70 @@ def get_remote_user(env):
     return matches.group(1)
 
 
-def get_auth_data(mc, username):
+def namespace(reseller_prefix=RESELLER_PREFIX, generation=0):
+    """
+    Returns the start of the memcache keys of tokens and users of
+    reseller_prefix issued in generation. Generation 0 uses the keys of
+    earlier releases, so tokens issued before an upgrade stay valid.
+    """
+    if generation:
+        return '%s/g%d' % (reseller_prefix, generation)
+    return reseller_prefix
+
+
+def token_key(token, reseller_prefix=RESELLER_PREFIX, generation=0):
+    """Returns the memcache key of token."""
+    return '%s/token/%s' % (namespace(reseller_prefix, generation), token)
+
+
+def get_generation(mc, reseller_prefix=RESELLER_PREFIX):
+    """
+    Returns the current token generation of reseller_prefix.
+
+    MemcacheRing.get returns None both for a missing key and when memcache
+    fails, so a missing generation is confirmed with an incr by 0, which
+    creates the key at 0 and raises if memcache fails.
+    """
+    key = '%s/generation' % reseller_prefix
+    generation = mc.get(key)
+    if generation is None and hasattr(mc, 'incr'):
+        generation = mc.incr(key, delta=0)
+    return int(generation or 0)
+
+
+def bump_generation(mc, reseller_prefix=RESELLER_PREFIX):
+    """
+    Starts a new token generation for reseller_prefix, which invalidates
+    all of its tokens at once, and returns it. Tokens of earlier generations
+    are no longer looked up and age out of memcache.
+    """
+    key = '%s/generation' % reseller_prefix
+    if hasattr(mc, 'incr'):
+        return int(mc.incr(key))
+    # Token stores other than memcache have no incr
+    generation = get_generation(mc, reseller_prefix) + 1
+    mc.set(key, generation)
+    return generation
+
+
+def get_auth_data(mc, username, reseller_prefix=RESELLER_PREFIX,
+                  generation=0):
     """
     Returns the token, expiry time and groups for the user if it already exists
     on memcache. Returns None otherwise.
 
     :param mc: MemcacheRing object
     :param username: swift user
+    :param reseller_prefix: reseller prefix the token belongs to
+    :param generation: current token generation of reseller_prefix
     """
     token, expires, groups = None, None, None
-    memcache_user_key = '%s/user/%s' % (RESELLER_PREFIX, username)
+    memcache_user_key = '%s/user/%s' % (namespace(reseller_prefix, generation),
+                                        username)
     candidate_token = mc.get(memcache_user_key)
     if candidate_token:
-        memcache_token_key = '%s/token/%s' % (RESELLER_PREFIX, candidate_token)
+        memcache_token_key = token_key(candidate_token, reseller_prefix,
+                                       generation)
         cached_auth_data = mc.get(memcache_token_key)
         if cached_auth_data:
             expires, groups = cached_auth_data
@@ -54,22 +109,28 @@ def get_auth_data(mc, username):
     return (token, expires, groups)
 
 
-def set_auth_data(mc, username, token, expires, groups):
+def set_auth_data(mc, username, token, expires, groups,
+                  reseller_prefix=RESELLER_PREFIX, token_life=TOKEN_LIFE,
+                  generation=0):
     """
     Stores the following key value pairs on Memcache:
         (token, expires+groups)
         (user, token)
+
+    Returns False if mc reported that a write failed.
     """
     auth_data = (expires, groups)
-    memcache_token_key = "%s/token/%s" % (RESELLER_PREFIX, token)
-    mc.set(memcache_token_key, auth_data, timeout=TOKEN_LIFE)
+    memcache_token_key = token_key(token, reseller_prefix, generation)
+    stored = mc.set(memcache_token_key, auth_data, timeout=token_life)
 
     # Record the token with the user info for future use.
-    memcache_user_key = '%s/user/%s' % (RESELLER_PREFIX, username)
-    mc.set(memcache_user_key, token, timeout=TOKEN_LIFE)
+    memcache_user_key = '%s/user/%s' % (namespace(reseller_prefix, generation),
+                                        username)
+    mc.set(memcache_user_key, token, timeout=token_life)
+    return stored is not False
 
 
-def generate_token():
+def generate_token(reseller_prefix=RESELLER_PREFIX):
     """Generates a random token."""
     # We don't use uuid.uuid4() here because importing the uuid module
     # causes (harmless) SELinux denials in the audit log on RHEL 6. If this
@@ -77,11 +138,93 @@ def generate_token():
     # written to not log those denials.
     r = random.SystemRandom()
     token = '%stk%s' % \
-            (RESELLER_PREFIX,
+            (reseller_prefix,
              ''.join(r.choice('abcdef0123456789') for x in range(32)))
     return token
 
 
+class _Group(ctypes.Structure):
+    """struct group of <grp.h>."""
+    _fields_ = [('gr_name', ctypes.c_char_p),
+                ('gr_passwd', ctypes.c_char_p),
+                ('gr_gid', ctypes.c_uint),
+                ('gr_mem', ctypes.POINTER(ctypes.c_char_p))]
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.getgrent.restype = ctypes.POINTER(_Group)
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_LIBC = _libc()
+
+
+def iter_groups():
+    """
+    Yields the (gid, name) pairs of the group database one at a time with
+    getgrent(3), so that a consumer stopping early does not pay for the
+    enumeration of a whole directory, unlike grp.getgrall().
+    """
+    if _LIBC is None:
+        for group in grp.getgrall():
+            yield group.gr_gid, group.gr_name
+        return
+    _LIBC.setgrent()
+    try:
+        while True:
+            group = _LIBC.getgrent()
+            if not group:
+                return
+            yield group.contents.gr_gid, group.contents.gr_name
+    finally:
+        _LIBC.endgrent()
+
+
+class GroupNameIndex(object):
+    """
+    Caches the gid to group name mapping of NSS for ttl seconds.
+
+    :param ttl: seconds after which the whole index is dropped
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.names = {}
+        self.created = time()
+
+    def preload(self, limit=10000):
+        """
+        Fills the index from a single enumeration of the group database,
+        stopped after limit groups. Directories that do not allow
+        enumeration only return the local groups.
+
+        The enumeration blocks; it may run in another thread, since the
+        index is only replaced once complete.
+
+        :returns: number of groups loaded
+        """
+        names = dict(islice(iter_groups(), limit))
+        self.names, self.created = names, time()
+        return len(names)
+
+    def name(self, gid):
+        """Returns the name of the group gid."""
+        if time() - self.created > self.ttl:
+            self.names = {}
+            self.created = time()
+        name = self.names.get(gid)
+        if name is None:
+            name = self.names[gid] = grp.getgrgid(gid)[0]
+        return name
+
+
+GROUP_NAMES = GroupNameIndex()
+
+
 def get_groups_from_username(username):
     """Return a set of groups to which the user belongs to."""
     # Retrieve the numerical group IDs. We cannot list the group names
@@ -96,41 +239,174 @@ def get_groups_from_username(username):
     # Convert the group numbers into group names.
     groups = []
     for gid in p_stdout.strip().split(" "):
-        groups.append(grp.getgrgid(int(gid))[0])
+        groups.append(GROUP_NAMES.name(int(gid)))
+    return format_groups(username, groups)
+
 
+def format_groups(username, groups):
+    """Returns the comma separated groups string of a user."""
     # The first element of the list is considered a unique identifier
     # for the user. We add the username to accomplish this.
-    if username in groups:
-        groups.remove(username)
-    groups = [username] + groups
-    groups = ','.join(groups)
-    return groups
+    groups = [group for group in groups if group != username]
+    return ','.join([username] + groups)
+
+
+def private_ccache():
+    """
+    Returns a KRB5CCNAME value naming a fresh in-memory credential cache.
 
+    A MEMORY: cache only lives inside the process using it, so a kinit run
+    with it never shares a cache with a concurrent login, never touches the
+    disk, and its ticket is destroyed when kinit exits.
+    """
+    r = random.SystemRandom()
+    return 'MEMORY:kerbauth_%s' % \
+        ''.join(r.choice('abcdef0123456789') for x in range(16))
 
-def run_kinit(username, password):
-    """Runs kinit command as a child process and returns the status code."""
+
+def start_kinit(username, password, krb5_config=None):
+    """
+    Starts kinit for username with a private credential cache and feeds it
+    the password. If krb5_config is given, kinit uses that configuration
+    file, and hence its KDCs, instead of the default one.
+    """
+    env = dict(os.environ)
+    env['KRB5CCNAME'] = private_ccache()
+    if krb5_config:
+        env['KRB5_CONFIG'] = krb5_config
     kinit = Popen(['kinit', username],
-                  stdin=PIPE, stdout=PIPE, stderr=PIPE)
+                  stdin=PIPE, stdout=PIPE, stderr=PIPE, env=env)
     kinit.stdin.write('%s\n' % password)
+    kinit.stdin.flush()
+    return kinit
+
+
+# kinit exits with 1 for both a wrong password and an unreachable KDC; only
+# the former tells anything about the password.
+KDC_UNREACHABLE = ('Cannot contact any KDC', 'Cannot find KDC',
+                   'Cannot resolve network address')
+
+# Status returned instead of kinit's when no KDC could be reached
+KINIT_UNREACHABLE = -2
+
+
+def _exit_status(kinit):
+    """
+    Returns the exit status of a finished kinit, or KINIT_UNREACHABLE if it
+    failed because it could not reach a KDC.
+    """
+    if kinit.returncode != 0:
+        stderr = kinit.stderr.read()
+        if any(msg in stderr for msg in KDC_UNREACHABLE):
+            return KINIT_UNREACHABLE
+    return kinit.returncode
+
+
+def _reap(kinit):
+    """Kills kinit if it is still running and closes its pipes."""
+    if kinit.poll() is None:
+        kinit.kill()
+        kinit.wait()
+    for pipe in (kinit.stdin, kinit.stdout, kinit.stderr):
+        pipe.close()
+
+
+def run_kinit(username, password, timeout=1):
+    """
+    Runs kinit command as a child process and returns the status code,
+    KINIT_UNREACHABLE if no KDC could be reached, or -1 if it did not
+    finish within timeout seconds.
+    """
+    kinit = start_kinit(username, password)
 
     # The following code handles a corner case where the Kerberos password
     # has expired and a prompt is displayed to enter new password. Ideally,
     # we would want to read from stdout but these are blocked reads. This is
-    # a hack to kill the process if it's taking too long!
+    # a hack to kill the process if it's taking too long! Polling, unlike
+    # SIGALRM, works outside the main thread and lets other greenthreads run.
+    deadline = time() + timeout
+    interval = 0.001
+    returncode = -1
+    while time() < deadline:
+        if kinit.poll() is not None:
+            returncode = _exit_status(kinit)
+            break
+        sleep(interval)
+        interval = min(interval * 2, 0.02)
+    _reap(kinit)
+    return returncode
+
+
+def run_kinit_hedged(username, password, krb5_configs, hedge_delay,
+                     timeout=1):
+    """
+    Verifies the password like run_kinit(), but against several KDCs.
 
-    class Alarm(Exception):
-        pass
+    kinit is started with the first configuration of krb5_configs. Whenever
+    the attempts in progress have not answered within hedge_delay seconds,
+    or an attempt reports its KDC unreachable, another attempt is started
+    with the next configuration. The first definitive exit status wins and
+    the remaining attempts are killed.
 
-    def signal_handler(signum, frame):
-        raise Alarm
-    # Set the signal handler and a 1-second alarm
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(1)
+    :returns: first definitive exit status of kinit, KINIT_UNREACHABLE if
+              every KDC was unreachable, or -1 if no attempt answered within
+              timeout seconds
+    """
+    configs = list(krb5_configs)
+    attempts = []
+    deadline = time() + timeout
+    next_start = 0
+    interval = 0.001
+    returncode = -1
     try:
-        kinit.wait()  # Wait for the child to exit
-        signal.alarm(0)  # Reset the alarm
-        return kinit.returncode  # Exit status of child on graceful exit
-    except Alarm:
-        # Taking too long, kill and return error
-        kinit.kill()
-        return -1
+        while time() < deadline:
+            now = time()
+            if configs and (now >= next_start or not attempts):
+                attempts.append(start_kinit(username, password,
+                                            configs.pop(0)))
+                next_start = now + hedge_delay
+            for kinit in [k for k in attempts if k.poll() is not None]:
+                attempts.remove(kinit)
+                status = _exit_status(kinit)
+                _reap(kinit)
+                if status == KINIT_UNREACHABLE:
+                    # Not definitive, keep waiting for the others
+                    returncode = status
+                    continue
+                return status
+            if not attempts and not configs:
+                break
+            sleep(interval)
+            interval = min(interval * 2, 0.02)
+    finally:
+        for kinit in attempts:
+            _reap(kinit)
+    return returncode
+
+
+def percentile(samples, pct):
+    """Returns the pct-th percentile of samples, or None without samples."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, len(ordered) * pct // 100)]
+
+
+class LatencyTracker(object):
+    """Keeps the last size latency samples and reports their percentiles."""
+
+    def __init__(self, size=200):
+        self.size = size
+        self.samples = []
+        self.next = 0
+
+    def add(self, seconds):
+        if len(self.samples) < self.size:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.next] = seconds
+            self.next = (self.next + 1) % self.size
+
+    def percentile(self, pct):
+        """Returns the pct-th percentile, or None without samples."""
+        return percentile(self.samples, pct)
@@ -0,0 +1,242 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Group resolution straight from the directory server.
+
+When NSS reaches IdM or Active Directory through slow paths, id -G is the
+slowest part of a login. LDAPGroupResolver asks the directory directly with
+one search per user over a small pool of persistent connections, and caches
+the answers.
+"""
+
+import re
+from eventlet import tpool
+from eventlet.queue import LightQueue
+
+from swiftkerbauth.kerbauth_utils import format_groups
+from swiftkerbauth.local_cache import LocalCache
+
+try:
+    import ldap
+    from ldap.controls import SimplePagedResultsControl
+except ImportError:
+    ldap = None
+    SimplePagedResultsControl = None
+
+RDN_VALUE = re.compile(r'[^=]+=((?:\\.|[^,+\\])*)')
+ESCAPED = re.compile(r'\\([0-9a-fA-F]{2}|.)')
+
+
+def escape_filter(value):
+    """Escapes value for use in an LDAP search filter (RFC 4515)."""
+    return ''.join('\\%02x' % ord(c) if c in '\\*()\0' else c
+                   for c in value)
+
+
+def first_rdn_value(dn):
+    """
+    Returns the value of the first RDN of dn, such as "auth_test" for
+    "cn=auth_test,cn=groups,dc=example,dc=com".
+    """
+    match = RDN_VALUE.match(dn)
+    if not match:
+        return dn
+
+    def unescape(m):
+        if len(m.group(1)) == 2:
+            return chr(int(m.group(1), 16))
+        return m.group(1)
+    return ESCAPED.sub(unescape, match.group(1).strip())
+
+
+class LDAPGroupResolver(object):
+    """
+    Resolves the groups of a user with a single LDAP search.
+
+    By default the memberOf attribute of the user entry is read, and group
+    names are taken from the first RDN of each group DN. If group_filter is
+    set, groups matching it (such as "(memberUid=%s)") are searched for
+    under group_base_dn instead, one page of page_size entries at a time,
+    and their group_attr attribute is used as the name.
+
+    :param uri: LDAP URI of the directory, such as "ldaps://idm.example.com"
+    :param base_dn: search base of user entries
+    :param bind_dn: DN to bind as; anonymous bind if None
+    :param bind_password: password of bind_dn
+    :param user_filter: filter finding the entry of a user, %s is the user
+    :param group_filter: filter finding the groups of a user, %s is the user
+    :param group_base_dn: search base of group entries, base_dn if None
+    :param group_attr: attribute holding the group name
+    :param pool_size: maximum number of connections
+    :param timeout: seconds allowed to connect and for each search
+    :param cache_ttl: seconds the groups of a user are cached
+    :param cache_size: number of users whose groups are cached
+    :param cache_bytes: estimated bytes of cached groups; 0 for no limit
+    :param page_size: entries per page of a group search
+    """
+
+    def __init__(self, uri, base_dn, bind_dn=None, bind_password=None,
+                 user_filter='(uid=%s)', group_filter=None,
+                 group_base_dn=None, group_attr='cn', pool_size=4, timeout=2,
+                 cache_ttl=300, cache_size=10000, page_size=500,
+                 cache_bytes=0):
+        if ldap is None:
+            raise RuntimeError("group_resolver = ldap requires the "
+                               "python-ldap module")
+        self.uri = uri
+        self.base_dn = base_dn
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.user_filter = user_filter
+        self.group_filter = group_filter
+        self.group_base_dn = group_base_dn or base_dn
+        self.group_attr = group_attr
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache = LocalCache(cache_size, cache_bytes)
+        self.page_size = page_size
+        self.idle = LightQueue()
+        self.connections = 0
+
+    def _connect(self):
+        conn = ldap.initialize(self.uri)
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+        conn.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        conn.simple_bind_s(self.bind_dn or '', self.bind_password or '')
+        return conn
+
+    def _get_connection(self):
+        """Returns an idle connection, or a new one if the pool has room."""
+        if self.idle.empty() and self.connections < self.pool_size:
+            self.connections += 1
+            try:
+                return tpool.execute(self._connect)
+            except Exception:
+                self.connections -= 1
+                raise
+        return self.idle.get()
+
+    def _discard(self, conn):
+        self.connections -= 1
+        try:
+            conn.unbind_s()
+        except Exception:
+            pass
+
+    def _paged_search(self, conn, base, filterstr, attrs):
+        control = SimplePagedResultsControl(True, size=self.page_size,
+                                            cookie='')
+        entries = []
+        while True:
+            msgid = conn.search_ext(base, ldap.SCOPE_SUBTREE, filterstr,
+                                    attrs, serverctrls=[control],
+                                    timeout=self.timeout)
+            rtype, rdata, rmsgid, serverctrls = \
+                conn.result3(msgid, timeout=self.timeout)
+            # Entries without a DN are search references
+            entries.extend(entry for entry in rdata if entry[0])
+            cookies = [ctrl.cookie for ctrl in serverctrls
+                       if ctrl.controlType == control.controlType]
+            if not cookies or not cookies[0]:
+                return entries
+            control.cookie = cookies[0]
+
+    def search(self, base, filterstr, attrs):
+        """
+        Returns the (dn, attributes) entries under base matching filterstr.
+        A connection the server dropped is replaced and the search retried
+        once.
+        """
+        for attempt in (1, 2):
+            conn = self._get_connection()
+            try:
+                entries = tpool.execute(self._paged_search, conn, base,
+                                        filterstr, attrs)
+            except ldap.SERVER_DOWN:
+                self._discard(conn)
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                self.idle.put(conn)
+                raise
+            self.idle.put(conn)
+            return entries
+
+    def lookup(self, username):
+        """Returns the list of group names of username."""
+        escaped = escape_filter(username)
+        if self.group_filter:
+            entries = self.search(self.group_base_dn,
+                                  self.group_filter % escaped,
+                                  [self.group_attr])
+            return [attrs[self.group_attr][0] for dn, attrs in entries
+                    if attrs.get(self.group_attr)]
+        entries = self.search(self.base_dn, self.user_filter % escaped,
+                              ['memberOf'])
+        if not entries:
+            raise RuntimeError("No LDAP entry for %s" % username)
+        return [first_rdn_value(dn)
+                for dn in entries[0][1].get('memberOf', [])]
+
+    def get_groups(self, username):
+        """
+        Returns the groups string of username, in the format of
+        kerbauth_utils.get_groups_from_username().
+
+        :raises RuntimeError: if the user or the directory cannot be found
+        """
+        groups = self.cache.get(username)
+        if groups is None:
+            try:
+                names = self.lookup(username)
+            except ldap.LDAPError as err:
+                raise RuntimeError("Failure looking up groups of %s in "
+                                   "LDAP: %s" % (username, err))
+            groups = format_groups(username, names)
+            self.cache.set(username, groups, timeout=self.cache_ttl)
+        return groups
+
+
+def get_group_resolver(conf):
+    """
+    Returns the group resolver selected by the group_resolver option of
+    conf, or None when NSS (the default, through id -G) is selected.
+
+    :param conf: dict of configuration values
+    :raises ValueError: if the group_resolver option is not recognized
+    """
+    resolver = conf.get('group_resolver', 'nss').strip().lower()
+    if resolver == 'nss':
+        return None
+    if resolver == 'ldap':
+        return LDAPGroupResolver(
+            conf.get('ldap_uri', 'ldap://localhost'),
+            conf.get('ldap_base_dn', ''),
+            bind_dn=conf.get('ldap_bind_dn'),
+            bind_password=conf.get('ldap_bind_password'),
+            user_filter=conf.get('ldap_user_filter', '(uid=%s)'),
+            group_filter=conf.get('ldap_group_filter'),
+            group_base_dn=conf.get('ldap_group_base_dn'),
+            group_attr=conf.get('ldap_group_attr', 'cn'),
+            pool_size=int(conf.get('ldap_pool_size', 4)),
+            timeout=float(conf.get('ldap_timeout', 2)),
+            cache_ttl=float(conf.get('ldap_cache_ttl', 300)),
+            cache_size=int(conf.get('ldap_cache_size', 10000)),
+            cache_bytes=int(conf.get('ldap_cache_bytes', 0)))
+    raise ValueError('Unknown group_resolver "%s"' % resolver)
@@ -0,0 +1,98 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from time import time
+
+from swiftkerbauth.memory import sizeof
+
+
+class LocalCache(object):
+    """
+    Bounded in-process cache with per-entry expiry.
+
+    It exposes the subset of the MemcacheRing interface used by kerbauth
+    (get, set and delete), so it can be handed to get_auth_data() and
+    set_auth_data() in place of a memcache client.
+
+    The estimated bytes of the keys and values held are accounted in bytes,
+    and kept under max_bytes if it is set.
+
+    :param max_entries: maximum number of entries kept; 0 disables caching
+    :param max_bytes: maximum estimated bytes of the entries; 0 for no limit
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.store)
+
+    def get(self, key, max_age=None):
+        """
+        Returns the value of key, or None if it is missing, has expired, or
+        was stored more than max_age seconds ago.
+        """
+        entry = self.store.get(key)
+        if entry is not None:
+            value, expires, stored, size = entry
+            now = time()
+            if expires and expires <= now:
+                self.delete(key)
+            elif max_age is None or stored + max_age > now:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, timeout=0):
+        if self.max_entries <= 0:
+            return False
+        size = sizeof(key) + sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return False
+        self.delete(key)
+        if len(self.store) >= self.max_entries or \
+                (self.max_bytes and self.bytes + size > self.max_bytes):
+            self._evict(size)
+        now = time()
+        self.store[key] = (value, now + timeout if timeout else 0, now, size)
+        self.bytes += size
+        return True
+
+    def delete(self, key):
+        entry = self.store.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+        return True
+
+    def _evict(self, size=0):
+        """
+        Drops expired entries, or else arbitrary ones, until an entry of
+        size bytes fits.
+        """
+        now = time()
+        expired = [key for key, entry in self.store.iteritems()
+                   if entry[1] and entry[1] <= now]
+        for key in expired:
+            self.delete(key)
+        while self.store and (len(self.store) >= self.max_entries or
+                              (self.max_bytes and
+                               self.bytes + size > self.max_bytes)):
+            self.bytes -= self.store.popitem()[1][3]
@@ -0,0 +1,77 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Memory accounting of the in-process structures of kerbauth.
+"""
+
+import gc
+import os
+import sys
+from time import time
+
+try:
+    # Standard on Python 3, available as pytracemalloc for Python 2
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def sizeof(obj):
+    """
+    Returns an estimate of the bytes used by obj and the containers, strings
+    and numbers it holds, as stored in kerbauth caches. Objects shared with
+    the rest of the process, such as interned strings, are counted too.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list, set, frozenset)):
+        size += sum(sizeof(item) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(sizeof(key) + sizeof(value)
+                    for key, value in obj.iteritems())
+    return size
+
+
+def type_census(limit=50):
+    """
+    Returns the limit object types using the most memory among the objects
+    tracked by the garbage collector, as (bytes, count, type name) tuples.
+    """
+    usage = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        size, count = usage.get(name, (0, 0))
+        usage[name] = (size + sys.getsizeof(obj), count + 1)
+    return sorted(((size, count, name) for name, (size, count) in
+                   usage.iteritems()), reverse=True)[:limit]
+
+
+def write_memory_snapshot(path):
+    """
+    Writes a snapshot of the memory of this worker and returns its file
+    name: a tracemalloc snapshot (<path>.<pid>.<time>.tracemalloc, to be
+    read with tracemalloc.Snapshot.load()) when tracemalloc is tracing, or
+    else a census of object types by size (<path>.<pid>.<time>.txt).
+    """
+    path = '%s.%d.%d' % (path, os.getpid(), time())
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        path += '.tracemalloc'
+        tracemalloc.take_snapshot().dump(path)
+        return path
+    path += '.txt'
+    with open(path, 'w') as f:
+        for size, count, name in type_census():
+            f.write('%12d %10d %s\n' % (size, count, name))
+    return path
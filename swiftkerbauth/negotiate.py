@@ -0,0 +1,81 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import binascii
+
+try:
+    import gssapi
+except ImportError:
+    gssapi = None
+
+
+class NegotiateError(Exception):
+    """Raised when a SPNEGO token cannot be verified."""
+    pass
+
+
+class GSSAcceptor(object):
+    """
+    Verifies SPNEGO (Negotiate) tokens against a keytab using python-gssapi,
+    the way mod_auth_kerb does for the swift-auth CGI script.
+
+    :param keytab: path of the keytab holding the service key
+    :param service: service name, such as "HTTP" or "HTTP@client.example.com";
+                    any key in the keytab is accepted if None
+    """
+
+    def __init__(self, keytab, service=None):
+        if gssapi is None:
+            raise RuntimeError("negotiate requires the python-gssapi module")
+        self.keytab = keytab
+        self.service = service
+        name = None
+        if service:
+            name = gssapi.Name(service, gssapi.NameType.hostbased_service)
+        self.creds = gssapi.Credentials(name=name, usage='accept',
+                                        store={'keytab': keytab})
+
+    def accept(self, in_token):
+        """
+        Verifies a single-round-trip SPNEGO token.
+
+        :param in_token: the raw (base64 decoded) token sent by the client
+        :returns: tuple of the client principal and the raw token to send
+                  back for mutual authentication (may be None)
+        :raises NegotiateError: if the token is not valid
+        """
+        try:
+            ctx = gssapi.SecurityContext(creds=self.creds, usage='accept')
+            out_token = ctx.step(in_token)
+        except gssapi.exceptions.GSSError as err:
+            raise NegotiateError(str(err))
+        if not ctx.complete:
+            raise NegotiateError("Negotiate needs more than one round trip")
+        return str(ctx.initiator_name), out_token
+
+
+def parse_negotiate_header(value):
+    """
+    Returns the decoded token of an "Authorization: Negotiate <token>"
+    header value, or None if the header does not carry one.
+    """
+    parts = (value or '').split(None, 1)
+    if len(parts) != 2 or parts[0].lower() != 'negotiate':
+        return None
+    try:
+        return base64.b64decode(parts[1].strip())
+    except (TypeError, binascii.Error):
+        return None
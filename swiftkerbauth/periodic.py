@@ -0,0 +1,39 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Background tasks of a worker, run in their own greenthread.
+"""
+
+from eventlet import sleep
+
+
+def call_every(interval, func, logger=None, description='Periodic task'):
+    """
+    Calls func every interval seconds, forever. An exception raised by func
+    is logged as "<description> failed" and does not stop the loop.
+
+    :param interval: seconds slept before each call
+    :param func: function called without arguments
+    :param logger: logger the exceptions are logged to, if any
+    :param description: what func does, for the log message
+    """
+    while True:
+        sleep(interval)
+        try:
+            func()
+        except Exception:
+            if logger:
+                logger.exception('%s failed', description)
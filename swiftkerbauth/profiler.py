@@ -0,0 +1,78 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import cProfile
+import pstats
+from time import time
+
+
+class RequestProfiler(object):
+    """
+    Profiles one request in every sample_rate with cProfile and aggregates
+    the statistics per code path, such as "get_token" or "token".
+
+    Statistics are written every dump_interval seconds to one file per code
+    path and worker, named <dump_path>.<code path>.<pid>.prof, which can be
+    read with pstats or any cProfile viewer.
+
+    cProfile hooks the whole OS thread, so only one request is profiled at a
+    time, and the calls of other greenthreads running while the profiled
+    request waits for I/O are counted too.
+
+    :param sample_rate: profile one request in sample_rate
+    :param dump_path: path prefix of the statistics files
+    :param dump_interval: seconds between two writes of the statistics
+    """
+
+    def __init__(self, sample_rate, dump_path, dump_interval=60):
+        self.sample_rate = sample_rate
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.requests = 0
+        self.active = False
+        self.stats = {}
+        self.last_dump = time()
+
+    def sample(self):
+        """Counts a request and returns True if it is to be profiled."""
+        self.requests += 1
+        return not self.active and self.requests % self.sample_rate == 0
+
+    def run(self, code_path, func, *args):
+        """Returns func(*args), adding its profile to code_path."""
+        profile = cProfile.Profile()
+        self.active = True
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            self.active = False
+            self.add(code_path, profile)
+            if time() - self.last_dump >= self.dump_interval:
+                self.dump()
+
+    def add(self, code_path, profile):
+        stats = self.stats.get(code_path)
+        if stats is None:
+            self.stats[code_path] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+
+    def dump(self):
+        """Writes the statistics of every code path."""
+        self.last_dump = time()
+        for code_path, stats in self.stats.items():
+            stats.dump_stats('%s.%s.%d.prof' % (self.dump_path, code_path,
+                                                os.getpid()))
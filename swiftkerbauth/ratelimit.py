@@ -0,0 +1,110 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from math import ceil
+from time import time
+
+
+class TokenBucketLimiter(object):
+    """
+    Per-key token buckets kept in the worker.
+
+    Each key may make burst requests at once and then rate requests per
+    second on average.
+
+    :param rate: requests per second allowed per key
+    :param burst: bucket size
+    :param max_keys: number of buckets kept, the least recently used one is
+                     dropped beyond it
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def acquire(self, key, memcache_client=None):
+        """
+        Takes one token from the bucket of key.
+
+        :returns: 0 if the request may proceed, or else the number of
+                  seconds until it would be allowed
+        """
+        now = time()
+        # Popped and set again to move the bucket to the most recent end
+        tokens, last = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if len(self.buckets) >= self.max_keys:
+            self.buckets.popitem(last=False)
+        if tokens >= 1:
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+        self.buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+
+class MemcacheLimiter(object):
+    """
+    Limiter shared by all workers and proxies through memcache.
+
+    Memcache cannot refill a bucket, so this counts requests in fixed
+    windows of burst / rate seconds with incr, allowing burst requests per
+    window: the same average rate as TokenBucketLimiter.
+
+    :param rate: requests per second allowed per key
+    :param burst: requests allowed per window
+    :param prefix: prefix of the memcache keys
+    """
+
+    def __init__(self, rate, burst, prefix='kerbauth/ratelimit'):
+        self.rate = rate
+        self.burst = burst
+        self.window = burst / float(rate)
+        self.prefix = prefix
+
+    def acquire(self, key, memcache_client=None):
+        """
+        Counts one request of key. Fails open when memcache is unavailable.
+
+        :returns: 0 if the request may proceed, or else the number of
+                  seconds until it would be allowed
+        """
+        if memcache_client is None:
+            return 0
+        now = time()
+        window = int(now // self.window)
+        try:
+            count = memcache_client.incr(
+                '%s/%s/%d' % (self.prefix, key, window),
+                time=int(ceil(self.window)) + 1)
+        except Exception:
+            return 0
+        if count is None or count <= self.burst:
+            return 0
+        return (window + 1) * self.window - now
+
+
+def get_limiter(rate, burst, shared=False, prefix='kerbauth/ratelimit'):
+    """
+    Returns a limiter allowing rate requests per second per key, shared
+    through memcache if shared is set, or None if rate is 0 (no limit).
+    """
+    if rate <= 0:
+        return None
+    if shared:
+        return MemcacheLimiter(rate, burst, prefix)
+    return TokenBucketLimiter(rate, burst)
@@ -0,0 +1,116 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cheap answers to the requests kerbauth rejects.
+
+A flood of requests without a valid token should cost the proxy as little
+as possible. The responses rejecting them are built once, when the filter
+is loaded, and shared by all requests; the counters of the rejections are
+summed in memory and sent to statsd once per interval.
+"""
+
+from collections import defaultdict
+from urllib import quote
+from eventlet import spawn_n
+from swift.common.swob import RESPONSE_REASONS, Response
+
+from swiftkerbauth.periodic import call_every
+
+HTML = 'text/html; charset=UTF-8'
+EMPTY = ['']
+
+
+def www_authenticate(env):
+    """Returns the WWW-Authenticate header swob sends with a 401."""
+    parts = env.get('PATH_INFO', '').split('/', 3)
+    realm = parts[2] if len(parts) > 2 and parts[1] and parts[2] \
+        else 'unknown'
+    if realm in ('v1.0', 'auth'):
+        realm = 'unknown'
+    return ('Www-Authenticate', 'Swift realm="%s"' % quote(realm))
+
+
+class Rejection(object):
+    """
+    WSGI response with a fixed status, headers and body, answering like the
+    swob response of the same status. It may be returned by swift.authorize.
+
+    :param status_int: HTTP status
+    :param location: Location header of a redirect
+    """
+
+    def __init__(self, status_int, location=None):
+        title, explanation = RESPONSE_REASONS[status_int]
+        self.status_int = status_int
+        self.status = '%d %s' % (status_int, title)
+        self.location = location
+        self.body = '<html><h1>%s</h1><p>%s</p></html>' % (
+            title, explanation % defaultdict(lambda: 'unknown',
+                                             location=location))
+        self.headers = [('Content-Type', HTML),
+                        ('Content-Length', str(len(self.body)))]
+        self.head_headers = [('Content-Type', HTML), ('Content-Length', '0')]
+        if location:
+            self.headers.append(('Location', location))
+            self.head_headers.append(('Location', location))
+        self.app_iter = [self.body]
+
+    def __call__(self, env, start_response):
+        if self.location and self.location.startswith('/'):
+            # swob knows how to make the location absolute
+            return Response(status=self.status_int,
+                            location=self.location)(env, start_response)
+        if env.get('REQUEST_METHOD') == 'HEAD':
+            headers, app_iter = self.head_headers, EMPTY
+        else:
+            headers, app_iter = self.headers, self.app_iter
+        if self.status_int == 401:
+            headers = headers + [www_authenticate(env)]
+        start_response(self.status, headers)
+        return app_iter
+
+
+class Counters(object):
+    """
+    Sums statsd counters and sends the totals every interval seconds, so a
+    flood costs one statsd packet per counter and interval.
+
+    :param logger: logger of the filter
+    :param interval: seconds between two sends, 0 to send every increment
+    """
+
+    def __init__(self, logger, interval=1):
+        self.logger = logger
+        self.interval = interval
+        self.counts = {}
+        self.running = False
+
+    def increment(self, metric):
+        if self.interval <= 0:
+            self.logger.increment(metric)
+            return
+        self.counts[metric] = self.counts.get(metric, 0) + 1
+        if not self.running:
+            # A worker that never rejects anything sends nothing
+            self.running = True
+            spawn_n(call_every, self.interval, self.flush, self.logger,
+                    'Sending rejection counters')
+
+    def flush(self):
+        """Sends the counts summed since the last flush."""
+        counts, self.counts = self.counts, {}
+        for metric, count in counts.iteritems():
+            self.logger.update_stats(metric, count)
@@ -0,0 +1,234 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replays captured authentication traffic (see swiftkerbauth.capture)
+against a KerbAuth instance whose memcache, kinit and group lookups are
+stand-ins with fixed latencies, and reports throughput, cache hit rates
+and latencies, so a configuration can be checked against real traffic.
+
+    python -m swiftkerbauth.replay [options] capture_file...
+
+Tokens found valid in the capture are in the stand-in memcache when the
+replay starts, token requests succeed when they succeeded in the capture,
+and events are replayed in capture order, as fast as possible.
+"""
+
+import sys
+from optparse import OptionParser
+from time import time
+from eventlet import GreenPool, sleep
+from swift.common.swob import Request
+from swift.common.utils import readconf
+
+from swiftkerbauth.capture import read_events
+from swiftkerbauth.kerbauth import KerbAuth
+from swiftkerbauth.kerbauth_utils import percentile
+from swiftkerbauth.token_store import MemoryTokenStore
+
+
+class StubMemcache(MemoryTokenStore):
+    """In-process token store taking latency seconds per call."""
+
+    def __init__(self, latency=0):
+        super(StubMemcache, self).__init__()
+        self.latency = latency
+        self.gets = 0
+        self.hits = 0
+
+    def _wait(self):
+        if self.latency:
+            sleep(self.latency)
+
+    def get(self, key):
+        self._wait()
+        self.gets += 1
+        value = super(StubMemcache, self).get(key)
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=0):
+        self._wait()
+        return super(StubMemcache, self).set(key, value, timeout)
+
+    def incr(self, key, delta=1, time=0):
+        self._wait()
+        return super(StubMemcache, self).incr(key, delta, time)
+
+    def delete(self, key):
+        self._wait()
+        return super(StubMemcache, self).delete(key)
+
+
+class Replay(object):
+    """
+    Drives a KerbAuth built from conf with events.
+
+    :param conf: dict of kerbauth configuration values
+    :param events: events as returned by capture.read_events()
+    :param memcache_latency: seconds per memcache call
+    :param kinit_latency: seconds per password check
+    :param groups_latency: seconds per group lookup
+    :param concurrency: number of events replayed at once
+    """
+
+    def __init__(self, conf, events, memcache_latency=0.0005,
+                 kinit_latency=0.03, groups_latency=0.005, concurrency=1):
+        self.events = events
+        self.kinit_latency = kinit_latency
+        self.groups_latency = groups_latency
+        self.concurrency = concurrency
+        self.memcache = StubMemcache(memcache_latency)
+        self.auth = KerbAuth(self.app, conf)
+        self.auth.run_kinit = self.run_kinit
+        self.auth.get_groups_from_username = self.get_groups_from_username
+        self.kinits = 0
+        self.group_lookups = 0
+        self.latencies = {}
+        self.matched = 0
+        self.skipped = 0
+        self.elapsed = 0
+
+    def app(self, env, start_response):
+        env['replay.passed_on'] = True
+        start_response('200 OK', [('Content-Length', '0')])
+        return ['']
+
+    def run_kinit(self, user, key):
+        self.kinits += 1
+        sleep(self.kinit_latency)
+        return 0 if key == 'good' else 1
+
+    def get_groups_from_username(self, user):
+        self.group_lookups += 1
+        sleep(self.groups_latency)
+        return '%s,%s%s' % (user, self.auth.reseller_prefix.lower(),
+                            user.split('.')[0])
+
+    def names(self, event):
+        """Returns the user and account standing for those of event."""
+        account = 'a%s' % event.get('a', '')
+        return '%s.u%s' % (account, event.get('u', '')), account
+
+    def preload(self):
+        """Stores the tokens found valid in the capture."""
+        expires = time() + self.auth.token_life
+        for event in self.events:
+            if event['p'] == 'token' and event['o'] == 0:
+                user, account = self.names(event)
+                # Without the latency of the replayed calls
+                MemoryTokenStore.set(self.memcache, '%s/token/%stk%s' % (
+                    self.auth.reseller_prefix, self.auth.reseller_prefix,
+                    event['k']), (expires, '%s,%s%s' % (
+                        user, self.auth.reseller_prefix.lower(), account)))
+
+    def request(self, event):
+        """Returns the request standing for event, or None."""
+        user, account = self.names(event)
+        prefix = self.auth.reseller_prefix
+        env = {'REQUEST_METHOD': event['m'], 'swift.cache': self.memcache}
+        if event['p'] == 'token':
+            return Request.blank(
+                '/v1/%s%s' % (prefix, account), environ=env,
+                headers={'X-Auth-Token': '%stk%s' % (prefix, event['k'])})
+        if event['p'] == 'get_token':
+            return Request.blank(
+                '%sv1.0' % self.auth.auth_prefix, environ=env,
+                headers={'X-Auth-User': '%s:%s' % (account, user),
+                         'X-Auth-Key': 'good' if event['o'] == 200
+                         else 'bad'})
+        if event['p'] == 'anonymous':
+            return Request.blank('/v1/%s%s' % (prefix, account), environ=env)
+        return None
+
+    def replay_event(self, event):
+        req = self.request(event)
+        if req is None:
+            self.skipped += 1
+            return
+        start = time()
+        resp = req.get_response(self.auth)
+        self.latencies.setdefault(event['p'], []).append(time() - start)
+        outcome = 0 if req.environ.get('replay.passed_on') \
+            else resp.status_int
+        if outcome == event['o']:
+            self.matched += 1
+
+    def run(self):
+        self.preload()
+        start = time()
+        pool = GreenPool(self.concurrency)
+        for event in self.events:
+            pool.spawn_n(self.replay_event, event)
+        pool.waitall()
+        self.elapsed = time() - start
+
+    def report(self):
+        """Returns the results as a list of lines."""
+        replayed = len(self.events) - self.skipped
+        cache = self.auth.local_cache
+        lines = ['%d events replayed in %.2fs: %.1f events/s, %d skipped' %
+                 (replayed, self.elapsed,
+                  replayed / self.elapsed if self.elapsed else 0,
+                  self.skipped),
+                 'outcomes matching the capture: %d/%d' %
+                 (self.matched, replayed),
+                 'local token cache: %d hits, %d misses' %
+                 (cache.hits, cache.misses),
+                 'memcache: %d gets, %d hits' %
+                 (self.memcache.gets, self.memcache.hits),
+                 'kinit runs: %d, group lookups: %d' %
+                 (self.kinits, self.group_lookups)]
+        for code_path, samples in sorted(self.latencies.items()):
+            lines.append('%s: p50=%.2fms p90=%.2fms p99=%.2fms' % (
+                code_path, 1000 * percentile(samples, 50),
+                1000 * percentile(samples, 90),
+                1000 * percentile(samples, 99)))
+        return lines
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] capture_file...')
+    parser.add_option('-f', '--conf-file',
+                      help='read [filter:kerbauth] of this proxy-server.conf')
+    parser.add_option('-o', '--option', action='append', default=[],
+                      metavar='NAME=VALUE',
+                      help='set a kerbauth option, may be repeated')
+    parser.add_option('--concurrency', type='int', default=1)
+    parser.add_option('--memcache-ms', type='float', default=0.5)
+    parser.add_option('--kinit-ms', type='float', default=30)
+    parser.add_option('--groups-ms', type='float', default=5)
+    options, paths = parser.parse_args(argv)
+    if not paths:
+        parser.error('no capture file given')
+    conf = {'ext_authentication_url': 'http://localhost/',
+            'log_level': 'ERROR'}
+    if options.conf_file:
+        conf.update(readconf(options.conf_file, 'filter:kerbauth'))
+    for option in options.option:
+        name, _junk, value = option.partition('=')
+        conf[name.strip()] = value.strip()
+    # Captures are not to be written again while replaying one
+    conf.pop('capture_path', None)
+    replay = Replay(conf, read_events(paths), options.memcache_ms / 1000,
+                    options.kinit_ms / 1000, options.groups_ms / 1000,
+                    options.concurrency)
+    replay.run()
+    print '\n'.join(replay.report())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
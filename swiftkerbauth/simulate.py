@@ -0,0 +1,459 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline load simulator for capacity planning.
+
+Drives a KerbAuth built from a configuration with the requests of a
+synthetic user population over simulated time, with stand-ins for memcache,
+kinit and group lookups that answer instantly, and reports the load each
+dependency would take: KDC logins, group lookups, memcache operations and
+memcache memory, per time bucket and at their peak.
+
+    python -m swiftkerbauth.simulate [options] [population.json]
+
+The population model is a JSON object; every key is optional:
+
+    {"users": 1000,          number of users
+     "accounts": 100,        number of accounts users are spread over
+     "groups_per_user": 5,   groups besides the user and account ones
+     "hours": 24,            simulated duration
+     "bucket": 300,          seconds per point of the load curves
+     "seed": 1,
+     "steady_state": true,   users start with a token issued within the
+                             last token_life; false starts them all
+                             logged out, as after a memcache restart
+     "clients": [            client behaviours, each for a share of users
+        {"share": 1.0,
+         "requests_per_hour": 30,   mean rate of storage requests
+         "active_hours": [0, 24],   hours of the day requests are made
+         "login_every": null,       seconds after which the client logs in
+                                    again; null keeps the token until it
+                                    is refused, 0 logs in for every request
+         "bad_password": 0.0}]}     share of users with a wrong password
+
+"What if" questions are answered by simulating the same population with
+other options, such as --what-if token_life=3600, and comparing the peaks.
+"""
+
+import sys
+import json
+import heapq
+import random
+from optparse import OptionParser
+from swift.common.swob import Request
+from swift.common.utils import readconf
+
+from swiftkerbauth import breaker, kerbauth, kerbauth_utils, local_cache, \
+    ratelimit, token_store
+from swiftkerbauth.kerbauth import KerbAuth
+from swiftkerbauth.token_store import MemoryTokenStore
+
+# Day aligned, so that active_hours are hours of the simulated day
+START = 86400 * 17000
+# Per item overhead of memcached, on top of the key and the value
+ITEM_OVERHEAD = 50
+DEPENDENCIES = ('kinit', 'groups', 'memcache.get', 'memcache.set',
+                'memcache.incr', 'memcache.delete')
+# Modules whose time() the simulated clock stands in for
+CLOCK_MODULES = (kerbauth, kerbauth_utils, local_cache, ratelimit, breaker,
+                 token_store)
+
+
+class SimMemcache(MemoryTokenStore):
+    """
+    In-process token store counting its calls and the memory memcached
+    would take for its items. Items expire in simulated time, since the
+    clock stands in for the time() of token_store.
+    """
+
+    def __init__(self, clock, load):
+        super(SimMemcache, self).__init__()
+        self.clock = clock
+        self.load = load
+        self.sizes = {}
+        self.expiries = []
+
+    @property
+    def bytes(self):
+        return sum(self.sizes[key] for key in self.store)
+
+    def _account(self, key, value, timeout):
+        self.sizes[key] = len(key) + len(json.dumps(value)) + ITEM_OVERHEAD
+        if timeout:
+            heapq.heappush(self.expiries, (self.store[key][1], key))
+
+    def expire(self):
+        """Drops the items that have expired, as memcached would."""
+        now = self.clock()
+        while self.expiries and self.expiries[0][0] <= now:
+            expires, key = heapq.heappop(self.expiries)
+            item = self.store.get(key)
+            if item is None or item[1] == expires:
+                self.store.pop(key, None)
+                self.sizes.pop(key, None)
+
+    def get(self, key):
+        self.load.count('memcache.get')
+        return super(SimMemcache, self).get(key)
+
+    def set(self, key, value, timeout=0):
+        self.load.count('memcache.set')
+        super(SimMemcache, self).set(key, value, timeout)
+        self._account(key, value, timeout)
+        return True
+
+    def incr(self, key, delta=1, time=0):
+        self.load.count('memcache.incr')
+        value = super(SimMemcache, self).incr(key, delta, time)
+        self._account(key, value, time)
+        return value
+
+    def delete(self, key):
+        self.load.count('memcache.delete')
+        self.sizes.pop(key, None)
+        return super(SimMemcache, self).delete(key)
+
+
+class SimClock(object):
+    """Simulated time, standing in for time.time()."""
+
+    def __init__(self, now=START):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Load(object):
+    """
+    Counts the calls to each dependency per bucket of simulated time, and
+    samples the memcache memory at the end of each bucket.
+    """
+
+    def __init__(self, clock, bucket):
+        self.clock = clock
+        self.bucket = bucket
+        self.counts = []
+        self.memory = []
+        self.counting = True
+
+    def index(self):
+        return int((self.clock() - START) // self.bucket)
+
+    def _grow(self, index):
+        while len(self.counts) <= index:
+            self.counts.append(dict.fromkeys(
+                DEPENDENCIES + ('requests', 'logins', 'refused'), 0))
+
+    def count(self, name):
+        if not self.counting:
+            return
+        index = self.index()
+        self._grow(index)
+        self.counts[index][name] += 1
+
+    def sample_memory(self, memcache, until):
+        """Records the memcache memory of the buckets ending before until."""
+        while len(self.memory) < until:
+            memcache.expire()
+            self.memory.append((len(memcache.store), memcache.bytes))
+
+    def total(self, name):
+        return sum(counts[name] for counts in self.counts)
+
+    def peak(self, name):
+        """Returns the peak rate per second of name and its bucket."""
+        rate, index = max((counts[name], i)
+                          for i, counts in enumerate(self.counts))
+        return float(rate) / self.bucket, index
+
+
+class ClientModel(object):
+    """Behaviour of one class of clients, see the module docstring."""
+
+    def __init__(self, share=1.0, requests_per_hour=30, active_hours=(0, 24),
+                 login_every=None, bad_password=0.0):
+        self.share = share
+        self.rate = requests_per_hour / 3600.0
+        self.active_hours = active_hours
+        self.login_every = login_every
+        self.bad_password = bad_password
+
+    def next_arrival(self, now, rng):
+        """Returns the time of the next request made after now."""
+        start, end = [hours * 3600 for hours in self.active_hours]
+        t = now + rng.expovariate(self.rate)
+        day = (t - START) // 86400 * 86400 + START
+        if t - day < start:
+            t = day + start + rng.expovariate(self.rate)
+        elif t - day >= end:
+            t = day + 86400 + start + rng.expovariate(self.rate)
+        return t
+
+
+class User(object):
+
+    def __init__(self, name, account, groups, client, password):
+        self.name = name
+        self.account = account
+        self.groups = groups
+        self.client = client
+        self.password = password
+        self.token = None
+        self.logged_in = None
+
+
+class Simulation(object):
+    """
+    Simulates population (a dict as described in the module docstring)
+    against a KerbAuth built from conf.
+    """
+
+    def __init__(self, conf, population=None):
+        population = population or {}
+        self.hours = float(population.get('hours', 24))
+        self.steady_state = population.get('steady_state', True)
+        self.rng = random.Random(population.get('seed', 1))
+        self.clock = SimClock()
+        self.load = Load(self.clock, int(population.get('bucket', 300)))
+        self.memcache = SimMemcache(self.clock, self.load)
+        conf = dict(conf)
+        conf.setdefault('ext_authentication_url', 'http://localhost/')
+        conf.setdefault('log_level', 'ERROR')
+        for name in ('capture_path', 'audit_log', 'warmup',
+                     'memory_snapshot_path', 'profile_sample_rate'):
+            conf.pop(name, None)
+        self.auth = KerbAuth(self.app, conf)
+        self.auth.run_kinit = self.run_kinit
+        self.auth.get_groups_from_username = self.get_groups_from_username
+        self.users = self.make_users(population)
+
+    def make_users(self, population):
+        clients = [ClientModel(**dict((str(k), v) for k, v in c.items()))
+                   for c in population.get('clients', [{}])]
+        shares = sum(client.share for client in clients)
+        accounts = int(population.get('accounts', 100))
+        extra_groups = int(population.get('groups_per_user', 5))
+        prefix = self.auth.reseller_prefix
+        users = {}
+        for i in range(int(population.get('users', 1000))):
+            pick = self.rng.uniform(0, shares)
+            for client in clients:
+                pick -= client.share
+                if pick <= 0:
+                    break
+            name = 'user%d' % i
+            account = 'acct%d' % (i % accounts)
+            groups = [name, ('%s%s' % (prefix, account)).lower()] + \
+                ['group%d' % self.rng.randrange(1000)
+                 for g in range(extra_groups)]
+            password = 'bad' if self.rng.random() < client.bad_password \
+                else 'good'
+            users[name] = User(name, account, ','.join(groups), client,
+                               password)
+        return users
+
+    def app(self, env, start_response):
+        start_response('200 OK', [('Content-Length', '0')])
+        return ['']
+
+    def run_kinit(self, user, key):
+        self.load.count('kinit')
+        return 0 if key == 'good' else 1
+
+    def get_groups_from_username(self, user):
+        self.load.count('groups')
+        return self.users[user].groups
+
+    def call(self, path, headers):
+        """Returns the response of kerbauth to a GET of path."""
+        return Request.blank(path, environ={'swift.cache': self.memcache},
+                             headers=headers).get_response(self.auth)
+
+    def login(self, user):
+        self.load.count('logins')
+        resp = self.call('%sv1.0' % self.auth.auth_prefix,
+                         {'X-Auth-User': '%s:%s' % (user.account, user.name),
+                          'X-Auth-Key': user.password})
+        if resp.status_int == 200:
+            user.token = resp.headers['X-Auth-Token']
+            user.logged_in = self.clock()
+        return resp.status_int
+
+    def request(self, user):
+        """Makes one storage request of user, logging in as needed."""
+        self.load.count('requests')
+        client = user.client
+        if user.token is None or (
+                client.login_every is not None and
+                self.clock() - user.logged_in >= client.login_every):
+            if self.login(user) != 200:
+                return
+        path = '/v1/%s%s/c/o' % (self.auth.reseller_prefix, user.account)
+        if self.call(path, {'X-Auth-Token': user.token}).status_int == 401:
+            # The token has expired: log in again and retry
+            self.load.count('refused')
+            user.token = None
+            if self.login(user) == 200:
+                self.call(path, {'X-Auth-Token': user.token})
+
+    def run(self):
+        end = START + self.hours * 3600
+        events = [(user.client.next_arrival(START, self.rng), name)
+                  for name, user in self.users.iteritems()]
+        heapq.heapify(events)
+        saved = [(module, module.time) for module in CLOCK_MODULES]
+        for module in CLOCK_MODULES:
+            module.time = self.clock
+        try:
+            if self.steady_state:
+                self.log_in_before_start()
+            while events and events[0][0] < end:
+                t, name = heapq.heappop(events)
+                self.clock.now = t
+                self.load.sample_memory(self.memcache, self.load.index())
+                user = self.users[name]
+                self.request(user)
+                heapq.heappush(events,
+                               (user.client.next_arrival(t, self.rng), name))
+            self.clock.now = end
+            self.load.sample_memory(self.memcache, self.load.index())
+        finally:
+            for module, time in saved:
+                module.time = time
+
+    def log_in_before_start(self):
+        """
+        Logs every user in at a random time within the token life before
+        the simulation starts, without counting the load it takes.
+        """
+        token_life = self.auth.reseller_options[
+            self.auth.reseller_prefix]['token_life']
+        self.load.counting = False
+        try:
+            for user in sorted(self.users.values(),
+                               key=lambda user: user.name):
+                self.clock.now = START - self.rng.uniform(0, token_life)
+                self.login(user)
+        finally:
+            self.load.counting = True
+            self.clock.now = START
+
+    def curves(self):
+        """Returns the load curves as CSV lines, one per bucket."""
+        names = ('requests', 'logins', 'refused') + DEPENDENCIES
+        lines = ['seconds,%s,memcache.items,memcache.bytes' %
+                 ','.join('%s/s' % name for name in names)]
+        bucket = self.load.bucket
+        for i, counts in enumerate(self.load.counts):
+            items, size = self.load.memory[i] \
+                if i < len(self.load.memory) else (0, 0)
+            lines.append('%d,%s,%d,%d' % (
+                i * bucket, ','.join('%.3f' % (float(counts[name]) / bucket)
+                                     for name in names), items, size))
+        return lines
+
+    def peaks(self):
+        """Returns a dict of the peak rates and memory of the simulation."""
+        peaks = {}
+        if not self.load.counts:
+            return peaks
+        for name in ('requests', 'logins') + DEPENDENCIES:
+            peaks[name] = self.load.peak(name)[0]
+        peaks['memcache.bytes'] = max(size for items, size in
+                                      self.load.memory or [(0, 0)])
+        peaks['memcache.items'] = max(items for items, size in
+                                      self.load.memory or [(0, 0)])
+        return peaks
+
+    def report(self):
+        """Returns the results as a list of lines."""
+        lines = ['%.1fh simulated: %d users, %d requests, %d logins, '
+                 '%d tokens refused' % (
+                     self.hours, len(self.users), self.load.total('requests'),
+                     self.load.total('logins'), self.load.total('refused')),
+                 '%-16s %10s %10s %10s %8s' % (
+                     'dependency', 'calls', 'mean/s', 'peak/s', 'peak at')]
+        if not self.load.counts:
+            return lines
+        seconds = self.hours * 3600
+        for name in DEPENDENCIES:
+            rate, index = self.load.peak(name)
+            at = index * self.load.bucket
+            lines.append('%-16s %10d %10.2f %10.2f %8s' % (
+                name, self.load.total(name), self.load.total(name) / seconds,
+                rate, '%d:%02d' % (at // 3600, at % 3600 // 60)
+                if rate else '-'))
+        peaks = self.peaks()
+        lines.append('memcache memory peak: %d bytes in %d items' % (
+            peaks['memcache.bytes'], peaks['memcache.items']))
+        return lines
+
+
+def parse_options(values):
+    conf = {}
+    for option in values:
+        name, _junk, value = option.partition('=')
+        conf[name.strip()] = value.strip()
+    return conf
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [population.json]')
+    parser.add_option('-f', '--conf-file',
+                      help='read [filter:kerbauth] of this proxy-server.conf')
+    parser.add_option('-o', '--option', action='append', default=[],
+                      metavar='NAME=VALUE',
+                      help='set a kerbauth option, may be repeated')
+    parser.add_option('-w', '--what-if', action='append', default=[],
+                      metavar='NAME=VALUE',
+                      help='also simulate with this kerbauth option changed '
+                           'and compare, may be repeated')
+    parser.add_option('--csv', metavar='FILE',
+                      help='write the load curves to FILE')
+    options, paths = parser.parse_args(argv)
+    population = {}
+    if paths:
+        with open(paths[0]) as f:
+            population = json.load(f)
+    conf = {}
+    if options.conf_file:
+        conf.update(readconf(options.conf_file, 'filter:kerbauth'))
+    conf.update(parse_options(options.option))
+    sim = Simulation(conf, population)
+    sim.run()
+    print '\n'.join(sim.report())
+    if options.csv:
+        with open(options.csv, 'w') as f:
+            f.write('\n'.join(sim.curves()) + '\n')
+    if options.what_if:
+        conf.update(parse_options(options.what_if))
+        other = Simulation(conf, population)
+        other.run()
+        print '\nwith %s:' % ', '.join(options.what_if)
+        print '\n'.join(other.report())
+        before, after = sim.peaks(), other.peaks()
+        print '\n%-16s %12s %12s %8s' % ('peak', 'current', 'what-if',
+                                         'change')
+        for name in sorted(before):
+            change = '%+.0f%%' % (100.0 * (after[name] - before[name]) /
+                                  before[name]) if before[name] else '-'
+            print '%-16s %12.2f %12.2f %8s' % (name, before[name],
+                                               after[name], change)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,47 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from eventlet.event import Event
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent identical calls made by greenthreads of a worker.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result (or its exception) instead
+    of repeating the call. Nothing is cached once the call has returned.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        event = self.in_flight.get(key)
+        if event is not None:
+            self.coalesced += 1
+            return event.wait()
+        event = self.in_flight[key] = Event()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            del self.in_flight[key]
+            event.send_exception(*sys.exc_info())
+            raise
+        del self.in_flight[key]
+        event.send(result)
+        return result
@@ -0,0 +1,221 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Token stores hold the (token, expires+groups) and (user, token) pairs
+written by set_auth_data() and read by get_auth_data(). Every store exposes
+the get/set/delete subset of the MemcacheRing interface, so a MemcacheRing
+can be used as a store as it is.
+"""
+
+import json
+import sqlite3
+from time import time
+from eventlet import GreenPool, tpool
+from eventlet.semaphore import Semaphore
+
+from swift.common.memcached import MemcacheRing
+
+DEFAULT_SQLITE_PATH = '/var/lib/swift/kerbauth_tokens.db'
+
+
+class TokenStore(object):
+    """Interface implemented by all token stores."""
+
+    def get(self, key):
+        """Returns the value stored under key, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=0):
+        """Stores value under key for timeout seconds (0 means forever)."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Removes key from the store."""
+        raise NotImplementedError
+
+    def get_multi(self, keys):
+        """Returns the values of keys as a list, None for missing keys."""
+        return [self.get(key) for key in keys]
+
+
+class MemoryTokenStore(TokenStore):
+    """
+    Unbounded in-process store; meant for tests, single workers, and as the
+    memcache stand-in of the replay and simulate tools.
+    """
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires and expires <= time():
+            del self.store[key]
+            return None
+        return value
+
+    def set(self, key, value, timeout=0):
+        self.store[key] = (value, time() + timeout if timeout else 0)
+        return True
+
+    def delete(self, key):
+        self.store.pop(key, None)
+        return True
+
+    def incr(self, key, delta=1, time=0):
+        # Not through self.get/set, which subclasses may instrument
+        value = (MemoryTokenStore.get(self, key) or 0) + delta
+        MemoryTokenStore.set(self, key, value, time)
+        return value
+
+
+class SQLiteTokenStore(TokenStore):
+    """
+    On-disk store backed by a SQLite database, so tokens survive restarts
+    of memcache and of the proxy server. Values are JSON encoded like
+    MemcacheRing does, hence tuples are read back as lists.
+
+    SQLite calls block, for up to 5 seconds when another process holds the
+    database lock, so they run one at a time in the eventlet thread pool:
+    a busy database delays the requests using the store, not the whole
+    worker.
+
+    :param path: path of the database file, created if missing
+    :param purge_interval: number of writes between purges of expired rows
+    """
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, purge_interval=1000):
+        self.path = path
+        self.purge_interval = purge_interval
+        self.writes = 0
+        self.lock = Semaphore()
+        self.conn = sqlite3.connect(path, timeout=5,
+                                    check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tokens ('
+                          'key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+        self.conn.commit()
+
+    def _execute(self, func, *args):
+        """Runs func in the eventlet thread pool, one call at a time."""
+        with self.lock:
+            return tpool.execute(func, *args)
+
+    def get(self, key):
+        return self._execute(self._get, key)
+
+    def set(self, key, value, timeout=0):
+        return self._execute(self._set, key, value, timeout)
+
+    def delete(self, key):
+        return self._execute(self._delete, key)
+
+    def get_multi(self, keys):
+        return self._execute(self._get_multi, keys)
+
+    def _get(self, key):
+        row = self.conn.execute('SELECT value, expires FROM tokens '
+                                'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires and expires <= time():
+            self._delete(key)
+            return None
+        return json.loads(value)
+
+    def _set(self, key, value, timeout=0):
+        self.conn.execute('INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)',
+                          (key, json.dumps(value),
+                           time() + timeout if timeout else 0))
+        self.writes += 1
+        if self.writes % self.purge_interval == 0:
+            self.purge()
+        self.conn.commit()
+        return True
+
+    def _delete(self, key):
+        self.conn.execute('DELETE FROM tokens WHERE key = ?', (key,))
+        self.conn.commit()
+        return True
+
+    def _get_multi(self, keys):
+        now = time()
+        found = {}
+        # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                'SELECT key, value, expires FROM tokens WHERE key IN (%s)'
+                % ','.join('?' * len(chunk)), chunk)
+            for key, value, expires in rows:
+                if not expires or expires > now:
+                    found[key] = json.loads(value)
+        return [found.get(key) for key in keys]
+
+    def purge(self):
+        """Removes expired rows."""
+        self.conn.execute('DELETE FROM tokens WHERE expires > 0 AND '
+                          'expires <= ?', (time(),))
+
+
+def get_token_store(conf):
+    """
+    Returns the token store selected by the token_store option of conf, or
+    None when memcache (the default) is selected. Memcache clients are
+    per request in the middleware, so they are not built here.
+
+    :param conf: dict of configuration values
+    :raises ValueError: if the token_store option is not recognized
+    """
+    backend = conf.get('token_store', 'memcache').strip().lower()
+    if backend == 'memcache':
+        return None
+    if backend == 'sqlite':
+        return SQLiteTokenStore(conf.get('token_store_path',
+                                         DEFAULT_SQLITE_PATH))
+    if backend == 'memory':
+        return MemoryTokenStore()
+    raise ValueError('Unknown token_store "%s"' % backend)
+
+
+def get_multi(store, keys, concurrency=32):
+    """
+    Returns the values of keys in store as a list, None for missing keys.
+
+    Token stores answer with their own get_multi(). MemcacheRing.get_multi()
+    expects all keys to live on the server of a single server_key, which is
+    not how set_auth_data() spreads token keys over the ring, so for memcache
+    the gets are issued concurrency at a time: about one round trip per
+    concurrency keys.
+
+    :param store: token store or memcache client
+    :param keys: list of keys to fetch
+    :param concurrency: maximum number of concurrent memcache gets
+    """
+    if isinstance(store, TokenStore):
+        return store.get_multi(keys)
+    return list(GreenPool(concurrency).imap(store.get, keys))
+
+
+def memcache_store(memcache_servers):
+    """
+    Returns a MemcacheRing for a comma separated list of memcache servers.
+    """
+    servers = [s.strip() for s in memcache_servers.split(',') if s.strip()]
+    return MemcacheRing(servers)
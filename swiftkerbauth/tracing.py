@@ -0,0 +1,182 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Lightweight tracing of the stages of a request through kerbauth.
+
+A trace holds the spans of one request, identified by its swift.trans_id,
+so it can be matched with the proxy logs. Whether a request is traced is
+decided when it arrives (head-based sampling), from its transaction id, so
+all proxies make the same choice for the same transaction.
+
+Finished traces are handed to an exporter, any object with an
+export(spans) method taking a list of span dicts and a flush() method.
+JSONLinesExporter writes one span per line, with the keys:
+
+    trans_id  transaction id of the request
+    id        number of the span within the trace, 0 for the request
+    parent    id of the enclosing span
+    name      stage, such as "memcache.get", "kinit" or "acl"
+    start     start time
+    ms        milliseconds spent in the stage
+    error     name of the exception the stage raised, if any
+
+plus the attributes of the span.
+"""
+
+import random
+from zlib import crc32
+from time import time
+
+from swiftkerbauth.jsonlines import JSONLinesWriter
+
+
+class NoSpan(object):
+    """Stands in for a span when the request is not traced."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+class Span(object):
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Adds attributes to the span."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        trace = self.trace
+        trace.next_id += 1
+        self.id = trace.next_id
+        self.parent = trace.stack[-1]
+        trace.stack.append(self.id)
+        self.start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time() - self.start
+        trace = self.trace
+        trace.stack.pop()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        trace.add(self.id, self.parent, self.name, self.start, elapsed,
+                  self.attrs)
+        return False
+
+
+class Trace(object):
+    """The spans of one request."""
+
+    def __init__(self, trans_id):
+        self.trans_id = trans_id
+        self.start = time()
+        self.spans = []
+        self.stack = [0]
+        self.next_id = 0
+        self.finished = False
+
+    def span(self, name, **attrs):
+        """Returns a context manager timing the stage name."""
+        if self.finished:
+            return NO_SPAN
+        return Span(self, name, attrs)
+
+    def add(self, span_id, parent, name, start, elapsed, attrs):
+        if self.finished:
+            return
+        span = {'trans_id': self.trans_id, 'id': span_id, 'parent': parent,
+                'name': name, 'start': round(start, 6),
+                'ms': round(elapsed * 1000, 3)}
+        span.update(attrs)
+        self.spans.append(span)
+
+    def finish(self, **attrs):
+        """Adds the span of the whole request and returns all spans."""
+        self.add(0, None, 'request', self.start, time() - self.start, attrs)
+        self.finished = True
+        return self.spans
+
+
+class Tracer(object):
+    """
+    Traces one request in sample_rate and exports the finished traces.
+
+    :param exporter: object with export(spans) and flush() methods
+    :param sample_rate: trace one request in sample_rate
+    """
+
+    def __init__(self, exporter, sample_rate=1):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start(self, env):
+        """Returns a Trace for the request of env, or None if unsampled."""
+        trans_id = env.get('swift.trans_id')
+        if self.sample_rate > 1:
+            if trans_id:
+                sampled = crc32(trans_id) % self.sample_rate == 0
+            else:
+                sampled = random.randrange(self.sample_rate) == 0
+            if not sampled:
+                return None
+        return Trace(trans_id)
+
+    def finish(self, trace, **attrs):
+        self.exporter.export(trace.finish(**attrs))
+
+
+class JSONLinesExporter(JSONLinesWriter):
+    """
+    Appends spans to <path>.<pid>, one file per worker, see
+    JSONLinesWriter.
+    """
+
+    def export(self, spans):
+        self.write(spans)
+
+
+def get_tracer(conf):
+    """
+    Returns the Tracer configured by conf, or None if trace_path and
+    trace_exporter are both unset.
+
+    trace_exporter may name a collector as "package.module:name", a
+    callable returning an exporter when called with conf.
+    """
+    exporter = None
+    if conf.get('trace_exporter'):
+        module_name, _junk, name = conf['trace_exporter'].partition(':')
+        module = __import__(module_name, fromlist=[name])
+        exporter = getattr(module, name)(conf)
+    elif conf.get('trace_path'):
+        exporter = JSONLinesExporter(
+            conf['trace_path'], int(conf.get('trace_flush_every', 100)))
+    if exporter is None:
+        return None
+    return Tracer(exporter, int(conf.get('trace_sample_rate', 100)))
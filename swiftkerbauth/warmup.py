@@ -0,0 +1,86 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Snapshots of recently active tokens, used to warm up the local token cache
+of freshly started workers. Tokens are bearer credentials, so snapshots are
+only readable by their owner.
+
+All workers share one snapshot, written by whichever worker holds the lock
+of lock_token_snapshot().
+"""
+
+import os
+import errno
+import fcntl
+import tempfile
+
+
+def read_token_snapshot(path, limit):
+    """
+    Returns at most limit tokens from the snapshot at path, or an empty list
+    if there is no snapshot yet.
+    """
+    tokens = []
+    try:
+        with open(path) as f:
+            for line in f:
+                if len(tokens) >= limit:
+                    break
+                token = line.strip()
+                if token:
+                    tokens.append(token)
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    return tokens
+
+
+def lock_token_snapshot(path):
+    """
+    Tries to become the writer of the snapshot at path. The lock is held
+    until the returned file is closed or the process exits, after which
+    another worker may take it over.
+
+    :returns: the open lock file, or None if another process holds the lock
+    """
+    f = open(path + '.lock', 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as err:
+        f.close()
+        if err.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return None
+    return f
+
+
+def write_token_snapshot(path, tokens):
+    """
+    Atomically replaces the snapshot at path with tokens: readers see the
+    previous snapshot or the new one, never a partial file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix='.kerbauth_snapshot')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for token in tokens:
+                f.write('%s\n' % token)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
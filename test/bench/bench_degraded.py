@@ -0,0 +1,85 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the latency distribution of token requests and token validations
+through KerbAuth while memcache, the KDC and NSS are slow or failing, using
+the stand-ins of test.unit.
+
+    python -m test.bench.bench_degraded [requests] [concurrency] [error_rate]
+"""
+
+import sys
+from time import time
+from eventlet import GreenPool
+from mock import patch
+from swift.common.swob import Request
+
+from swiftkerbauth import kerbauth
+from swiftkerbauth.kerbauth_utils import percentile
+from test.unit import Faults, FaultyMemcache, FakeKDC, FakeNSS, lognormal
+
+
+def percentiles(samples):
+    return ' '.join('p%d=%.1fms' % (p, 1000 * percentile(samples, p))
+                    for p in (50, 90, 99))
+
+
+def main(requests=2000, concurrency=50, error_rate=0.05):
+    mc = FaultyMemcache(Faults(latency=lognormal(0.001, 1),
+                               error_rate=error_rate, seed=1))
+    kdc = FakeKDC({'user': 'secret'},
+                  Faults(latency=lognormal(0.02, 1), timeout_rate=0.01,
+                         error_rate=error_rate, seed=2))
+    nss = FakeNSS({'user': ['auth_test']},
+                  Faults(latency=lognormal(0.005, 1.5), seed=3))
+    app = kerbauth.filter_factory({
+        'auth_method': 'passive', 'memcache_breaker': 'yes',
+        'memcache_timeout': '0.1',
+        'failed_login_cache_ttl': '0', 'log_level': 'CRITICAL',
+        'ext_authentication_url': 'http://127.0.0.1/'})(None)
+    for i in range(requests):
+        mc.store['AUTH_/token/AUTH_tk%d' % i] = (time() + 3600,
+                                                 'user,auth_test')
+    logins, validations, statuses = [], [], {}
+
+    def one(i):
+        start = time()
+        if i % 10 == 0:
+            req = Request.blank('/auth/v1.0',
+                                headers={'X-Auth-User': 'test:user',
+                                         'X-Auth-Key': 'secret'})
+            req.environ['swift.cache'] = mc
+            status = app.handle_get_token(req).status_int
+            logins.append(time() - start)
+        else:
+            env = {'swift.cache': mc}
+            status = 200 if app.get_groups(env, 'AUTH_tk%d' % i) else 401
+            validations.append(time() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    with patch('swiftkerbauth.kerbauth.run_kinit',
+               lambda user, key: kdc.run_kinit(user, key, 1)):
+        with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                   nss.get_groups_from_username):
+            list(GreenPool(concurrency).imap(one, range(requests)))
+    print "logins:      %s" % percentiles(logins)
+    print "validations: %s" % percentiles(validations)
+    print "statuses:    %s" % ', '.join('%d: %d' % item
+                                        for item in sorted(statuses.items()))
+
+
+if __name__ == '__main__':
+    main(*[conv(arg) for conv, arg in zip((int, int, float), sys.argv[1:])])
@@ -0,0 +1,72 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures password verifications per second through run_kinit() with a
+kinit stand-in, so the cost of forking and of the credential cache handling
+can be compared between versions.
+
+    python -m test.bench.bench_logins [logins] [concurrency]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from time import time
+
+from swiftkerbauth.kerbauth_utils import run_kinit
+
+STUB_KINIT = '''#!/bin/sh
+read password
+[ "$password" = "secret" ]
+'''
+
+
+def main(logins=500, concurrency=8):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'kinit')
+        with open(path, 'w') as f:
+            f.write(STUB_KINIT)
+        os.chmod(path, 0755)
+        os.environ['PATH'] = tmpdir + os.pathsep + os.environ['PATH']
+
+        failures = []
+        per_thread = logins // concurrency
+
+        def worker():
+            for i in range(per_thread):
+                if run_kinit('user', 'secret') != 0:
+                    failures.append(i)
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(concurrency)]
+        start = time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time() - start
+    finally:
+        shutil.rmtree(tmpdir)
+    total = per_thread * concurrency
+    print "%d logins, %d threads: %.1f logins/s, %d failures" % \
+        (total, concurrency, total / elapsed, len(failures))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,88 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures rejected requests per second through KerbAuth, for requests with
+an invalid token and for anonymous requests denied by swift.authorize, with
+the prebuilt rejections and batched counters against swob responses built
+for each request and a statsd packet per rejection, as before.
+
+    python -m test.bench.bench_rejections [requests]
+"""
+
+import sys
+from time import time
+from swift.common.swob import Request, Response
+
+from swiftkerbauth import kerbauth
+from swiftkerbauth.rejection import Counters
+from test.unit import FakeMemcache
+
+CONF = {'auth_method': 'passive', 'log_level': 'CRITICAL',
+        'log_statsd_host': '127.0.0.1', 'log_statsd_port': '9',
+        'ext_authentication_url': 'http://127.0.0.1/'}
+
+
+class SwobRejection(object):
+    """Builds a swob response for each rejection."""
+
+    def __init__(self, status_int, location=None):
+        self.status_int = status_int
+        self.location = location
+
+    def __call__(self, env, start_response):
+        return Response(status=self.status_int, location=self.location,
+                        request=Request(env))(env, start_response)
+
+
+def proxy(env, start_response):
+    """Stands in for the proxy, asking swift.authorize about every request."""
+    req = Request(env)
+    return env['swift.authorize'](req)(env, start_response)
+
+
+def start_response(status, headers):
+    pass
+
+
+def rate(app, requests, token):
+    mc = FakeMemcache()
+    start = time()
+    for i in range(requests):
+        env = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/v1/AUTH_test/c/o',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080',
+               'wsgi.url_scheme': 'http', 'swift.cache': mc}
+        if token:
+            env['HTTP_X_AUTH_TOKEN'] = 'AUTH_tk%d' % i
+        ''.join(app(env, start_response))
+    return requests / (time() - start)
+
+
+def main(requests=20000):
+    before = kerbauth.filter_factory(CONF)(proxy)
+    before.unauthorized = SwobRejection(401)
+    before.forbidden = SwobRejection(403)
+    before.redirect = SwobRejection(303, before.ext_authentication_url)
+    before.rejection_stats = Counters(before.logger, 0)
+    after = kerbauth.filter_factory(CONF)(proxy)
+    for name, token in (('invalid token', True), ('anonymous', False)):
+        old = rate(before, requests, token)
+        new = rate(after, requests, token)
+        print "%-14s swob: %8.0f/s  prebuilt: %8.0f/s  (x%.2f)" % \
+            (name, old, new, new / old)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -12,7 +12,13 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import random
+from zlib import crc32
+from math import log
 from contextlib import contextmanager
+import eventlet
+
+from swiftkerbauth.kerbauth_utils import format_groups, KINIT_UNREACHABLE
 
 
 class FakeMemcache(object):
@@ -28,8 +34,8 @@ class FakeMemcache(object):
         self.store[key] = value
         return True
 
-    def incr(self, key, time=0):
-        self.store[key] = self.store.setdefault(key, 0) + 1
+    def incr(self, key, delta=1, time=0):
+        self.store[key] = self.store.setdefault(key, 0) + delta
         return self.store[key]
 
     @contextmanager
@@ -42,3 +48,172 @@ class FakeMemcache(object):
         except Exception:
             pass
         return True
+
+
+def constant(seconds):
+    """Latency distribution always taking seconds."""
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    """Latency distribution uniform between low and high seconds."""
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median, sigma):
+    """
+    Long tailed latency distribution: half the calls take less than median
+    seconds, and a larger sigma makes the slow calls slower.
+    """
+    return lambda rng: rng.lognormvariate(log(median), sigma)
+
+
+class Faults(object):
+    """
+    Latency and failure model shared by the stand-ins below.
+
+    Each call first waits a delay drawn from latency, or hang seconds for
+    the fraction timeout_rate of the calls, and then fails for the fraction
+    error_rate of the calls, or always while outage is set.
+
+    :param latency: latency distribution, such as lognormal(0.002, 1)
+    :param error_rate: fraction of the calls failing
+    :param timeout_rate: fraction of the calls hanging
+    :param hang: seconds a hanging call waits
+    :param seed: seed of the random generator, for reproducible runs
+    :param sleep: function used to wait, eventlet.sleep by default
+    """
+
+    OK, ERROR, TIMEOUT = 'ok', 'error', 'timeout'
+
+    def __init__(self, latency=None, error_rate=0, timeout_rate=0, hang=60,
+                 seed=None, sleep=None):
+        self.latency = latency or constant(0)
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.sleep = sleep or eventlet.sleep
+        self.outage = False
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    @contextmanager
+    def down(self):
+        """Fails every call made in the block."""
+        self.outage = True
+        try:
+            yield
+        finally:
+            self.outage = False
+
+    def inject(self, timeout=None):
+        """
+        Waits and decides the outcome of one call. A caller giving up after
+        timeout seconds waits at most that long.
+
+        :returns: Faults.OK, Faults.ERROR or Faults.TIMEOUT
+        """
+        self.calls += 1
+        if self.random.random() < self.timeout_rate:
+            delay = self.hang
+        else:
+            delay = self.latency(self.random)
+        if timeout is not None and delay >= timeout:
+            self.sleep(timeout)
+            self.timeouts += 1
+            return self.TIMEOUT
+        if delay:
+            self.sleep(delay)
+        if self.outage or self.random.random() < self.error_rate:
+            self.errors += 1
+            return self.ERROR
+        return self.OK
+
+
+class FaultyMemcache(FakeMemcache):
+    """
+    FakeMemcache behind Faults. Like MemcacheRing, failed gets return None,
+    failed sets and deletes are ignored and failed incrs raise, unless
+    raise_errors is set. Keys hashing to one of down_servers out of servers
+    always fail, to simulate a partial outage of the ring.
+    """
+
+    def __init__(self, faults=None, servers=1, down_servers=(),
+                 raise_errors=False):
+        super(FaultyMemcache, self).__init__()
+        self.faults = faults or Faults()
+        self.servers = servers
+        self.down_servers = set(down_servers)
+        self.raise_errors = raise_errors
+
+    def _failed(self, key):
+        outcome = self.faults.inject()
+        if crc32(key) % self.servers in self.down_servers:
+            outcome = Faults.ERROR
+        if outcome != Faults.OK and self.raise_errors:
+            raise IOError('Memcache %s for %s' % (outcome, key))
+        return outcome != Faults.OK
+
+    def get(self, key):
+        if self._failed(key):
+            return None
+        return super(FaultyMemcache, self).get(key)
+
+    def set(self, key, value, timeout=0):
+        if self._failed(key):
+            return False
+        return super(FaultyMemcache, self).set(key, value, timeout)
+
+    def incr(self, key, delta=1, time=0):
+        if self._failed(key):
+            raise IOError('No Memcached connections succeeded.')
+        return super(FaultyMemcache, self).incr(key, delta, time)
+
+    def delete(self, key):
+        if self._failed(key):
+            return False
+        return super(FaultyMemcache, self).delete(key)
+
+
+class FakeKDC(object):
+    """
+    Stand-in for kerbauth_utils.run_kinit() verifying passwords against a
+    dict. Like run_kinit(), it returns 1 for a wrong password,
+    KINIT_UNREACHABLE for an unreachable KDC, and -1 when the answer takes
+    timeout seconds or more.
+    """
+
+    def __init__(self, passwords, faults=None):
+        self.passwords = passwords
+        self.faults = faults or Faults()
+
+    def run_kinit(self, username, password, timeout=1):
+        outcome = self.faults.inject(timeout)
+        if outcome == Faults.TIMEOUT:
+            return -1
+        if outcome == Faults.ERROR:
+            return KINIT_UNREACHABLE
+        if username in self.passwords and \
+                self.passwords[username] == password:
+            return 0
+        return 1
+
+
+class FakeNSS(object):
+    """
+    Stand-in for kerbauth_utils.get_groups_from_username() answering from
+    a dict of username to group names. Failures raise RuntimeError, like a
+    failing id -G.
+    """
+
+    def __init__(self, groups, faults=None):
+        self.groups = groups
+        self.faults = faults or Faults()
+
+    def get_groups_from_username(self, username):
+        outcome = self.faults.inject()
+        if outcome != Faults.OK or username not in self.groups:
+            raise RuntimeError("Failure running id -G for %s" % username)
+        return format_groups(username, self.groups[username])
@@ -0,0 +1,121 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+from logging.handlers import RotatingFileHandler, SysLogHandler
+from mock import patch, Mock
+from swiftkerbauth.audit import AuditLog, get_audit_log
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestAuditLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_batches(self):
+        handler = ListHandler()
+        audit = AuditLog(handler)
+        with patch('swiftkerbauth.audit.spawn_n') as spawn_n:
+            audit.record('login', 200, 'alice', 'test', '10.0.0.1', 'tx1')
+            audit.record('denied', 401, client='10.0.0.2')
+        self.assertEqual(spawn_n.call_count, 1)
+        self.assertEqual(handler.messages, [])
+        audit.flush()
+        self.assertEqual(len(handler.messages), 1)
+        records = [json.loads(line)
+                   for line in handler.messages[0].split('\n')]
+        self.assertEqual(records[0]['event'], 'login')
+        self.assertEqual(records[0]['user'], 'alice')
+        self.assertEqual(records[0]['trans_id'], 'tx1')
+        self.assertEqual(records[1], {'time': records[1]['time'],
+                                      'event': 'denied', 'status': 401,
+                                      'client': '10.0.0.2'})
+        audit.flush()
+        self.assertEqual(len(handler.messages), 1)
+
+    def test_drops_oldest(self):
+        handler = ListHandler()
+        logger = Mock()
+        audit = AuditLog(handler, buffer_size=3, logger=logger)
+        with patch('swiftkerbauth.audit.spawn_n'):
+            for i in range(5):
+                audit.record('token', 0, 'user%d' % i)
+        self.assertEqual(audit.dropped, 2)
+        audit.flush()
+        records = [json.loads(line)
+                   for line in handler.messages[0].split('\n')]
+        self.assertEqual(records[0]['event'], 'dropped')
+        self.assertEqual(records[0]['count'], 2)
+        self.assertEqual([r['user'] for r in records[1:]],
+                         ['user2', 'user3', 'user4'])
+        logger.update_stats.assert_called_once_with('audit.dropped', 2)
+        self.assertEqual(audit.dropped, 0)
+
+    def test_syslog_per_line(self):
+        handler = ListHandler()
+        audit = AuditLog(handler)
+        audit.per_line = True
+        with patch('swiftkerbauth.audit.spawn_n'):
+            audit.record('login', 200, 'alice')
+            audit.record('login', 401, 'bob')
+        audit.flush()
+        self.assertEqual(len(handler.messages), 2)
+
+    def test_get_audit_log(self):
+        self.assertEqual(get_audit_log({}), None)
+        path = os.path.join(self.tmpdir, 'audit.log')
+        audit = get_audit_log({'audit_log': path, 'audit_buffer_size': '5',
+                               'audit_log_max_bytes': '200'})
+        self.assertTrue(isinstance(audit.handler, RotatingFileHandler))
+        self.assertFalse(audit.per_line)
+        self.assertEqual(audit.ring.maxlen, 5)
+        with patch('swiftkerbauth.audit.spawn_n'):
+            for i in range(3):
+                audit.record('login', 200, 'alice', 'test')
+                audit.flush()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['audit.log', 'audit.log.1'])
+        with open(path) as f:
+            self.assertEqual(json.loads(f.readline())['user'], 'alice')
+        audit.handler.close()
+        with patch.object(SysLogHandler, '__init__',
+                          Mock(return_value=None)) as init:
+            audit = get_audit_log({'audit_log': 'syslog',
+                                   'audit_syslog_facility': 'LOG_LOCAL0'})
+        init.assert_called_once_with(address='/dev/log',
+                                     facility=SysLogHandler.LOG_LOCAL0)
+        self.assertTrue(audit.per_line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import eventlet
+from mock import patch
+from test.unit import FakeMemcache
+from swiftkerbauth import breaker
+
+
+def _fail():
+    raise IOError('connection refused')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.transitions = []
+        self.breaker = breaker.CircuitBreaker(
+            call_timeout=0.05, latency_threshold=0.02, error_threshold=2,
+            reset_timeout=10, on_transition=self.transitions.append)
+
+    def test_success_keeps_closed(self):
+        self.assertEqual(self.breaker.call(lambda: 'v'), 'v')
+        self.assertEqual(self.breaker.state, breaker.CircuitBreaker.CLOSED)
+        self.assertEqual(self.transitions, [])
+
+    def test_errors_trip_breaker(self):
+        for i in range(2):
+            self.assertRaises(breaker.MemcacheUnavailable,
+                              self.breaker.call, _fail)
+        self.assertEqual(self.breaker.state, breaker.CircuitBreaker.OPEN)
+        self.assertEqual(self.transitions, ['open'])
+        # Open circuit fails fast without calling through
+        calls = []
+        self.assertRaises(breaker.MemcacheUnavailable,
+                          self.breaker.call, calls.append, 1)
+        self.assertEqual(calls, [])
+
+    def test_deadline(self):
+        self.assertRaises(breaker.MemcacheUnavailable,
+                          self.breaker.call, eventlet.sleep, 1)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_slow_call_counts_as_failure(self):
+        self.breaker.call(eventlet.sleep, 0.03)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_half_open_recovery(self):
+        for i in range(2):
+            self.assertRaises(breaker.MemcacheUnavailable,
+                              self.breaker.call, _fail)
+        opened_at = self.breaker.opened_at
+        with patch('swiftkerbauth.breaker.time',
+                   return_value=opened_at + 11):
+            self.assertEqual(self.breaker.call(lambda: 'v'), 'v')
+        self.assertEqual(self.transitions, ['open', 'half_open', 'closed'])
+
+    def test_half_open_failure_reopens(self):
+        for i in range(2):
+            self.assertRaises(breaker.MemcacheUnavailable,
+                              self.breaker.call, _fail)
+        opened_at = self.breaker.opened_at
+        with patch('swiftkerbauth.breaker.time',
+                   return_value=opened_at + 11):
+            self.assertRaises(breaker.MemcacheUnavailable,
+                              self.breaker.call, _fail)
+        self.assertEqual(self.transitions, ['open', 'half_open', 'open'])
+
+    def test_guarded_memcache(self):
+        mc = breaker.GuardedMemcache(FakeMemcache(), self.breaker)
+        mc.set('key', 'value', timeout=10)
+        self.assertEqual(mc.get('key'), 'value')
+        self.assertEqual(mc.incr('counter'), 1)
+        mc.delete('key')
+        self.assertEqual(mc.get('key'), None)
@@ -0,0 +1,60 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from time import time
+from swiftkerbauth.capture import TrafficCapture, read_events
+
+
+class TestTrafficCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'capture')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_record(self):
+        capture = TrafficCapture(self.path, flush_every=2,
+                                 flush_interval=3600)
+        start = time()
+        capture.record(start + 1, 0.0015, 'token', 'GET', 0,
+                       token='AUTH_tksecret', user='alice', account='test')
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        capture.record(start, 0.03, 'get_token', 'GET', 401, user='alice',
+                       account='test')
+        self.assertEqual(os.listdir(self.tmpdir),
+                         ['capture.%d' % os.getpid()])
+        with open(capture.path) as f:
+            data = f.read()
+        self.assertFalse('secret' in data or 'alice' in data)
+        events = read_events([capture.path])
+        self.assertEqual([e['p'] for e in events], ['get_token', 'token'])
+        self.assertEqual(events[0]['u'], events[1]['u'])
+        self.assertEqual(events[0]['a'], capture.digest('test'))
+        self.assertEqual(events[0]['o'], 401)
+        self.assertEqual(events[1]['ms'], 1.5)
+        self.assertFalse('k' in events[0])
+
+    def test_keys(self):
+        self.assertEqual(TrafficCapture(self.path, 'key').digest('alice'),
+                         TrafficCapture(self.path, 'key').digest('alice'))
+        self.assertNotEqual(TrafficCapture(self.path).digest('alice'),
+                            TrafficCapture(self.path).digest('alice'))
+        self.assertEqual(TrafficCapture(self.path).digest(''), None)
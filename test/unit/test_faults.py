@@ -0,0 +1,90 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from test.unit import Faults, FaultyMemcache, FakeKDC, FakeNSS, constant, \
+    uniform, lognormal
+from swiftkerbauth.kerbauth_utils import KINIT_UNREACHABLE
+
+
+class TestFaults(unittest.TestCase):
+
+    def setUp(self):
+        self.slept = []
+
+    def test_distributions(self):
+        faults = Faults(seed=1)
+        self.assertEqual(constant(0.5)(faults.random), 0.5)
+        self.assertTrue(0.1 <= uniform(0.1, 0.2)(faults.random) <= 0.2)
+        samples = sorted(lognormal(0.01, 1)(faults.random)
+                         for i in range(1000))
+        self.assertTrue(0.008 < samples[500] < 0.012)
+        self.assertTrue(samples[990] > 0.05)
+
+    def test_inject(self):
+        faults = Faults(latency=constant(0.2), error_rate=0.5,
+                        sleep=self.slept.append, seed=1)
+        outcomes = [faults.inject() for i in range(100)]
+        self.assertTrue(30 < outcomes.count(Faults.ERROR) < 70)
+        self.assertEqual(faults.errors, outcomes.count(Faults.ERROR))
+        self.assertEqual(self.slept, [0.2] * 100)
+        self.assertEqual(faults.inject(timeout=0.1), Faults.TIMEOUT)
+        self.assertEqual(self.slept[-1], 0.1)
+        with faults.down():
+            self.assertEqual(Faults(sleep=self.slept.append).inject(),
+                             Faults.OK)
+            faults.error_rate = 0
+            self.assertEqual(faults.inject(), Faults.ERROR)
+        self.assertEqual(faults.inject(), Faults.OK)
+
+    def test_hang(self):
+        faults = Faults(timeout_rate=1, hang=30, sleep=self.slept.append)
+        self.assertEqual(faults.inject(timeout=2), Faults.TIMEOUT)
+        self.assertEqual(faults.inject(), Faults.OK)
+        self.assertEqual(self.slept, [2, 30])
+        self.assertEqual(faults.timeouts, 1)
+
+    def test_faulty_memcache(self):
+        mc = FaultyMemcache(servers=2, down_servers=[0])
+        up = [key for key in 'abcdefgh' if mc.set(key, 1)]
+        self.assertTrue(0 < len(up) < 8)
+        for key in 'abcdefgh':
+            self.assertEqual(mc.get(key), 1 if key in up else None)
+        mc = FaultyMemcache(raise_errors=True)
+        mc.set('a', 1)
+        with mc.faults.down():
+            self.assertRaises(IOError, mc.get, 'a')
+        self.assertEqual(mc.get('a'), 1)
+
+    def test_fake_kdc(self):
+        kdc = FakeKDC({'user': 'secret'},
+                      Faults(sleep=self.slept.append))
+        self.assertEqual(kdc.run_kinit('user', 'secret'), 0)
+        self.assertEqual(kdc.run_kinit('user', 'wrong'), 1)
+        with kdc.faults.down():
+            self.assertEqual(kdc.run_kinit('user', 'secret'),
+                             KINIT_UNREACHABLE)
+        kdc.faults.timeout_rate = 1
+        self.assertEqual(kdc.run_kinit('user', 'secret', timeout=3), -1)
+        self.assertEqual(self.slept, [3])
+
+    def test_fake_nss(self):
+        nss = FakeNSS({'user': ['user', 'auth_test']})
+        self.assertEqual(nss.get_groups_from_username('user'),
+                         'user,auth_test')
+        self.assertRaises(RuntimeError, nss.get_groups_from_username, 'x')
+        with nss.faults.down():
+            self.assertRaises(RuntimeError, nss.get_groups_from_username,
+                              'user')
@@ -0,0 +1,112 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import errno
+import unittest
+from StringIO import StringIO
+from mock import patch, Mock
+from swiftkerbauth import helper
+
+
+class TestServe(unittest.TestCase):
+
+    def _serve(self, *jobs):
+        stdin = StringIO(''.join(json.dumps(job) + '\n' for job in jobs))
+        stdout = StringIO()
+        helper.serve(stdin, stdout)
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_serve(self):
+        _mock_run_kinit = Mock(return_value=0)
+        with patch('swiftkerbauth.kerbauth_utils.run_kinit', _mock_run_kinit):
+            replies = self._serve({'op': 'kinit', 'args': ['user', 'pw']},
+                                  {'op': 'groups', 'args': ['Zroot']})
+        _mock_run_kinit.assert_called_once_with('user', 'pw')
+        self.assertEqual(replies[0], {'result': 0})
+        self.assertEqual(replies[1]['error'], 'RuntimeError')
+        self.assertTrue(replies[1]['message'].startswith('Failure running'))
+
+    def test_serve_oserror(self):
+        _mock_run_kinit = Mock(side_effect=OSError(errno.ENOENT, 'No kinit'))
+        with patch('swiftkerbauth.kerbauth_utils.run_kinit', _mock_run_kinit):
+            replies = self._serve({'op': 'kinit', 'args': ['user', 'pw']})
+        self.assertEqual(replies, [{'error': 'OSError', 'errno': errno.ENOENT,
+                                    'message': 'No kinit'}])
+
+
+class TestHelperPool(unittest.TestCase):
+
+    def test_call(self):
+        pool = helper.HelperPool(2)
+        try:
+            self.assertTrue('root' in pool.get_groups_from_username('root'))
+            self.assertRaises(RuntimeError, pool.get_groups_from_username,
+                              'Zroot')
+            self.assertEqual(pool.respawns, 0)
+        finally:
+            pool.close()
+
+    def test_lazy_start(self):
+        pool = helper.HelperPool(2)
+        try:
+            # Nothing is started when the filter is loaded
+            self.assertEqual(pool.idle.qsize(), 0)
+            self.assertTrue('root' in pool.get_groups_from_username('root'))
+            self.assertEqual(pool.idle.qsize(), 2)
+            self.assertEqual(pool.pid, os.getpid())
+        finally:
+            pool.close()
+        self.assertEqual(pool.idle.qsize(), 0)
+        self.assertEqual(pool.pid, None)
+
+    def test_forked(self):
+        pool = helper.HelperPool(1, command=['cat'])
+        pool.start()
+        inherited = list(pool.idle.queue)
+        try:
+            with patch('os.getpid', return_value=pool.pid + 1):
+                # The helpers of the parent are left alone
+                pool.close()
+                self.assertEqual(list(pool.idle.queue), inherited)
+                pool.start()
+                self.assertTrue(inherited[0].stdin.closed)
+                self.assertNotEqual(list(pool.idle.queue), inherited)
+                pool.close()
+        finally:
+            # Exits as its stdin is closed, the parent being this process
+            inherited[0].wait()
+
+    def test_timeout_respawns(self):
+        pool = helper.HelperPool(1, timeout=0.1, command=['sleep', '10'])
+        try:
+            self.assertEqual(pool.run_kinit('user', 'pw'), -1)
+            self.assertEqual(pool.respawns, 1)
+            self.assertRaises(RuntimeError, pool.get_groups_from_username,
+                              'user')
+            self.assertEqual(pool.respawns, 2)
+        finally:
+            for h in list(pool.idle.queue):
+                h.kill()
+
+    def test_dead_helper_respawns(self):
+        pool = helper.HelperPool(1, command=['true'])
+        try:
+            self.assertRaises(helper.HelperError, pool.call, 'kinit', 'u', 'p')
+            self.assertEqual(pool.respawns, 1)
+        finally:
+            for h in list(pool.idle.queue):
+                h.kill()
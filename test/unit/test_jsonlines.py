@@ -0,0 +1,62 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from time import time
+from mock import patch
+from swiftkerbauth.jsonlines import JSONLinesWriter
+
+
+class TestJSONLinesWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, writer):
+        with open(writer.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_flush_every(self):
+        writer = JSONLinesWriter(os.path.join(self.tmpdir, 'out'),
+                                 flush_every=2, flush_interval=3600)
+        self.assertEqual(writer.path,
+                         os.path.join(self.tmpdir, 'out.%d' % os.getpid()))
+        writer.write([{'a': 1}])
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        writer.write([{'a': 2}, {'a': 3}])
+        self.assertEqual(self.read(writer), [{'a': 1}, {'a': 2}, {'a': 3}])
+        writer.write([{'a': 4}])
+        writer.flush()
+        self.assertEqual(self.read(writer)[-1], {'a': 4})
+
+    def test_flush_interval(self):
+        writer = JSONLinesWriter(os.path.join(self.tmpdir, 'out'),
+                                 flush_every=100, flush_interval=1)
+        writer.write([{'a': 1}])
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        with patch('swiftkerbauth.jsonlines.time', return_value=time() + 2):
+            writer.write([{'a': 2}])
+        self.assertEqual(self.read(writer), [{'a': 1}, {'a': 2}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,12 +14,22 @@
 # limitations under the License.
 
 import os
+import shutil
+import tempfile
+import base64
 import errno
+import json
 import unittest
+import eventlet
 from time import time
-from mock import patch, Mock
+from zlib import crc32
+from mock import patch, Mock, ANY
 from swiftkerbauth import kerbauth as auth
-from test.unit import FakeMemcache
+from test.unit import FakeMemcache, FaultyMemcache, FakeKDC, FakeNSS, \
+    Faults, constant
+from swiftkerbauth.breaker import CircuitBreaker
+from swiftkerbauth.negotiate import NegotiateError
+from swiftkerbauth.capture import read_events
 from swift.common.swob import Request, Response
 
 EXT_AUTHENTICATION_URL = "127.0.0.1"
@@ -74,6 +84,25 @@ class FakeApp(object):
                         body=body)(env, start_response)
 
 
+class DownMemcache(FakeMemcache):
+    """A memcache stand-in whose every call fails."""
+
+    def get(self, key):
+        raise IOError('memcache down')
+
+    def set(self, key, value, timeout=0):
+        raise IOError('memcache down')
+
+
+class FakeAcceptor(object):
+    """A GSS acceptor stand-in accepting the token 'good' only."""
+
+    def accept(self, in_token):
+        if in_token != 'good':
+            raise NegotiateError('bad token')
+        return 'user@EXAMPLE.COM', 'mutual'
+
+
 class TestAuth(unittest.TestCase):
 
     # Patch auth.filter_factory()
@@ -180,6 +209,391 @@ class TestAuth(unittest.TestCase):
         self.assertEquals(resp.status_int, 500)
         self.assertEquals(req.environ['swift.authorize'], fake_authorize)
 
+    def test_profiler(self):
+        self.assertEquals(self.test_auth.profiler, None)
+        self.assertEquals(self.test_auth.dispatch, self.test_auth._call)
+        ath = auth.filter_factory({'profile_sample_rate': '2'})(FakeApp())
+        self.assertEquals(ath.dispatch, ath._observed_call)
+        for path in ('/v1/AUTH_cfa', '/auth/v1.0', '/auth/validate/'):
+            self._make_request(path).get_response(ath)
+            self._make_request(path).get_response(ath)
+        self.assertEquals(sorted(ath.profiler.stats),
+                          ['anonymous', 'get_token', 'validate'])
+        self.assertEquals(ath.code_path({'HTTP_X_AUTH_TOKEN': 'AUTH_t'}),
+                          'token')
+
+    def test_capture(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ath = auth.filter_factory({
+                'capture_path': os.path.join(tmpdir, 'capture'),
+                'capture_flush_every': '1'})(FakeApp())
+            req = self._make_request('/v1/AUTH_test/c',
+                                     headers={'X-Auth-Token': 'AUTH_t'})
+            req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                           (time() + 3600, 'user,auth_test'))
+            self.assertEquals(req.get_response(ath).status_int, 404)
+            req = self._make_request('/v1/AUTH_test/c',
+                                     headers={'X-Auth-Token': 'AUTH_x'})
+            self.assertEquals(req.get_response(ath).status_int, 401)
+            req = self._make_request('/auth/v1.0',
+                                     headers={'X-Auth-User': 'test:user',
+                                              'X-Auth-Key': 'password'})
+            with patch('swiftkerbauth.kerbauth.run_kinit',
+                       Mock(return_value=1)):
+                self.assertEquals(req.get_response(ath).status_int, 401)
+            events = read_events([ath.capture.path])
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEquals([(e['p'], e['o']) for e in events],
+                          [('token', 0), ('token', 401), ('get_token', 401)])
+        digest = ath.capture.digest
+        self.assertEquals(events[0]['k'], digest('AUTH_t'))
+        self.assertEquals(events[0]['u'], digest('user'))
+        self.assertEquals(events[2]['u'], digest('user'))
+        self.assertEquals(events[2]['a'], digest('test'))
+        self.assertFalse('u' in events[1])
+
+    def test_audit(self):
+        ath = auth.filter_factory({'audit_log': '/dev/null'})(FakeApp(iter([
+            ('404 Not Found', {}, ''), ('404 Not Found', {}, '')])))
+        records = []
+        ath.audit.record = lambda *args: records.append(args)
+        req = self._make_request('/v1/AUTH_test/c',
+                                 headers={'X-Auth-Token': 'AUTH_t'},
+                                 environ={'REMOTE_ADDR': '10.0.0.1'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'user,auth_test'))
+        self.assertEquals(req.get_response(ath).status_int, 404)
+        req = self._make_request('/v1/AUTH_other/c',
+                                 headers={'X-Auth-Token': 'AUTH_t'},
+                                 environ={'REMOTE_ADDR': '10.0.0.1'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'user,auth_test'))
+        self.assertEquals(req.get_response(ath).status_int, 403)
+        req = self._make_request('/v1/AUTH_test/c',
+                                 headers={'X-Auth-Token': 'AUTH_x'})
+        self.assertEquals(req.get_response(ath).status_int, 401)
+        req = self._make_request('/v1/AUTH_test/c')
+        self.assertEquals(req.get_response(ath).status_int, 401)
+        with patch('swiftkerbauth.kerbauth.run_kinit', Mock(return_value=1)):
+            req = self._make_request('/auth/v1.0',
+                                     headers={'X-Auth-User': 'test:user',
+                                              'X-Auth-Key': 'password'})
+            self.assertEquals(req.get_response(ath).status_int, 401)
+        self.assertEquals(records, [
+            ('token', 0, 'user', 'AUTH_test', '10.0.0.1', ANY),
+            ('token', 0, 'user', 'AUTH_other', '10.0.0.1', ANY),
+            ('denied', 403, 'user', 'AUTH_other', '10.0.0.1', ANY),
+            ('token', 401, None, 'AUTH_test', None, ANY),
+            ('denied', 401, None, 'AUTH_test', None, ANY),
+            ('login', 401, 'user', 'test', None, ANY)])
+        self.assertFalse("'AUTH_t'" in repr(records))
+
+    def test_memory_usage(self):
+        ath = auth.filter_factory({'local_token_cache_bytes': '100000'})(
+            FakeApp())
+        self.assertEquals(ath.local_cache.max_bytes, 100000)
+        req = self._make_request('/v1/AUTH_test/c',
+                                 headers={'X-Auth-Token': 'AUTH_t'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'user,auth_test'))
+        self.assertEquals(req.get_response(ath).status_int, 404)
+        usage = ath.memory_usage()
+        self.assertEquals(usage['local_token_cache'],
+                          (1, ath.local_cache.bytes))
+        self.assertTrue(usage['local_token_cache'][1] > 0)
+        self.assertEquals(usage['failed_login_cache'], (0, 0))
+        self.assertFalse('ldap_group_cache' in usage)
+        with patch.object(ath.logger, 'timing') as timing:
+            ath.report_memory()
+        timing.assert_any_call('memory.local_token_cache.entries', 1)
+        self.assertEquals(timing.call_count, 2 * len(usage))
+
+    def test_memory_snapshot(self):
+        with patch('signal.signal') as signal:
+            ath = auth.filter_factory({'memory_snapshot_path': '/tmp/m'})(
+                FakeApp(iter([('404 Not Found', {}, '')] * 2)))
+            # Not in the parent process, which only loads the filter
+            self.assertFalse(signal.called)
+            for i in range(2):
+                self._make_request('/v1/AUTH_test/c').get_response(ath)
+        signal.assert_called_once_with(auth.signal.SIGUSR2,
+                                       ath._memory_snapshot_signal)
+        self.assertEquals(ath.dispatch, ath._call)
+        other = auth.filter_factory({})(FakeApp())
+        self.assertEquals(other.dispatch, other._call)
+        with patch('swiftkerbauth.kerbauth.write_memory_snapshot',
+                   return_value='/tmp/m.1.txt') as write:
+            with patch.object(ath.logger, 'info') as info:
+                ath.memory_snapshot()
+        write.assert_called_once_with('/tmp/m')
+        self.assertEquals(info.call_args[0][1], '/tmp/m.1.txt')
+
+    def test_tracing(self):
+        ath = auth.filter_factory({'trace_path': '/tmp/spans',
+                                   'trace_sample_rate': '1'})(FakeApp(iter([
+                                       ('404 Not Found', {}, ''),
+                                       ('404 Not Found', {}, '')])))
+        spans = []
+        ath.tracer.exporter.export = spans.extend
+        req = self._make_request('/v1/AUTH_test/c',
+                                 headers={'X-Auth-Token': 'AUTH_t'},
+                                 environ={'swift.trans_id': 'tx1'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'user,auth_test'))
+        self.assertEquals(req.get_response(ath).status_int, 404)
+        self.assertEquals([(s['name'], s['parent']) for s in spans],
+                          [('memcache.get', 0), ('authorize', 2),
+                           ('app', 0), ('request', None)])
+        self.assertTrue(spans[0]['hit'])
+        self.assertEquals(spans[-1]['trans_id'], 'tx1')
+        self.assertEquals(spans[-1]['code_path'], 'token')
+        self.assertEquals(spans[-1]['status'], 404)
+
+        del spans[:]
+        req = self._make_request('/v1/AUTH_other/c',
+                                 headers={'X-Auth-Token': 'AUTH_t'},
+                                 environ={'swift.trans_id': 'tx2'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'user,auth_test'))
+        req.acl = '.r:*'
+        self.assertEquals(req.get_response(ath).status_int, 403)
+        self.assertTrue('acl' in [s['name'] for s in spans])
+        self.assertTrue([s for s in spans if s['name'] == 'authorize'][0]
+                        ['denied'])
+
+        del spans[:]
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'test:user',
+                                          'X-Auth-Key': 'password'},
+                                 environ={'swift.trans_id': 'tx3'})
+        with patch('swiftkerbauth.kerbauth.run_kinit', Mock(return_value=0)):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       Mock(return_value='user,auth_test')):
+                self.assertEquals(req.get_response(ath).status_int, 200)
+        self.assertEquals([s['name'] for s in spans],
+                          ['kinit', 'groups', 'memcache.get', 'groups',
+                           'memcache.set', 'request'])
+        self.assertEquals(spans[0]['ret'], 0)
+        self.assertEquals(spans[-1]['code_path'], 'get_token')
+
+    def test_debug_sampled(self):
+        self.assertFalse(self.test_auth.debug_sampled({}))
+        ath = auth.filter_factory({'log_level': 'DEBUG'})(FakeApp())
+        self.assertTrue(ath.debug_sampled({}))
+        ath = auth.filter_factory({'log_level': 'DEBUG',
+                                   'debug_sample_rate': '4'})(FakeApp())
+        sampled = [ath.debug_sampled({'swift.trans_id': 'tx%d' % i})
+                   for i in range(1000)]
+        self.assertTrue(150 < sampled.count(True) < 350)
+        self.assertEquals(sampled, [
+            ath.debug_sampled({'swift.trans_id': 'tx%d' % i})
+            for i in range(1000)])
+
+    def test_debug_logging_is_lazy(self):
+        req = self._make_request('/v1/AUTH_cfa/c/o',
+                                 headers={'X-Auth-Token': 'AUTH_t'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'usr,auth_cfa'))
+        with patch.object(self.test_auth.logger, 'debug') as debug:
+            self.assertEquals(req.get_response(self.test_auth).status_int,
+                              404)
+        self.assertFalse(debug.called)
+        ath = auth.filter_factory({'log_level': 'DEBUG'})(FakeApp())
+        req = self._make_request('/v1/AUTH_cfa/c/o',
+                                 headers={'X-Auth-Token': 'AUTH_t'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'usr,auth_cfa'))
+        with patch.object(ath.logger, 'debug') as debug:
+            req.get_response(ath)
+        debug.assert_any_call('User: %s uses token %s (trans_id %s)',
+                              'usr', 'AUTH_t', None)
+
+    def test_handle_exception_logging(self):
+        ath = auth.filter_factory({'exception_log_rate': '0.001',
+                                   'exception_log_burst': '2'})(FakeApp())
+        with patch.object(ath, 'handle_request',
+                          Mock(side_effect=ValueError('boom'))):
+            with patch.object(ath.logger, 'exception') as exception:
+                for i in range(4):
+                    req = self._make_request('/auth/v1.0',
+                                             headers={'X-Auth-Key': 'pw'})
+                    self.assertEquals(req.get_response(ath).status_int, 500)
+        self.assertEquals(exception.call_count, 2)
+        args = exception.call_args[0]
+        self.assertEquals(args[1:4], ('handle', 'GET', '/v1.0'))
+        self.assertFalse('pw' in repr(args))
+        self.assertEquals(ath.suppressed_exceptions, {'ValueError': 2})
+        ath.exception_limiter.buckets.clear()
+        with patch.object(ath, 'handle_request',
+                          Mock(side_effect=ValueError('boom'))):
+            with patch.object(ath.logger, 'exception') as exception:
+                self._make_request('/auth/v1.0').get_response(ath)
+        self.assertEquals(exception.call_args[0][-1], 2)
+        self.assertEquals(ath.suppressed_exceptions, {})
+
+    def test_reseller_prefixes(self):
+        self.assertEquals(self.test_auth.reseller_prefixes, ['AUTH_'])
+        ath = auth.filter_factory({'reseller_prefix': 'AUTH, SERVICE_,AUTH',
+                                   'token_life': '100',
+                                   'SERVICE_token_life': '10',
+                                   'SERVICE_auth_method': 'active',
+                                   'SERVICE_realm_name': 'EXAMPLE.COM',
+                                   })(FakeApp())
+        self.assertEquals(ath.reseller_prefixes, ['AUTH_', 'SERVICE_'])
+        self.assertEquals(ath.reseller_prefix, 'AUTH_')
+        self.assertEquals(ath.reseller_options, {
+            'AUTH_': {'token_life': 100, 'auth_method': 'passive',
+                      'realm_name': None},
+            'SERVICE_': {'token_life': 10, 'auth_method': 'active',
+                         'realm_name': 'EXAMPLE.COM'}})
+        ath = auth.filter_factory({'reseller_prefix': 'AUTH, AUTH_ADMIN'})(
+            FakeApp())
+        self.assertEquals(ath.match_prefix('AUTH_ADMIN_tk1'), 'AUTH_ADMIN_')
+        self.assertEquals(ath.match_prefix('AUTH_tk1'), 'AUTH_')
+        self.assertEquals(ath.match_prefix('OTHER_tk1'), None)
+        self.assertEquals(ath.match_prefix(None), None)
+        ath = auth.filter_factory({'reseller_prefix': ''})(FakeApp())
+        self.assertEquals(ath.reseller_prefixes, [''])
+        self.assertEquals(ath.match_prefix('anything'), '')
+        self.assertEquals(ath.match_prefix(''), None)
+        self.assertEquals(ath.match_prefix(None), None)
+
+    def test_empty_reseller_prefix(self):
+        ath = auth.filter_factory({'reseller_prefix': ''})(
+            FakeApp(iter([('200 OK', {}, '')])))
+        # Requests without a token are left to an upstream authorize
+        req = self._make_request('/v1/cfa/c')
+        mc = req.environ['swift.cache'] = Mock(wraps=FakeMemcache())
+        req.environ['swift.authorize'] = lambda req: None
+        self.assertEquals(req.get_response(ath).status_int, 200)
+        self.assertFalse(mc.get.called)
+        # and denied without one
+        req = self._make_request('/v1/cfa/c')
+        self.assertEquals(req.get_response(ath).status_int, 401)
+        # Requests without an account are denied, not crashed on
+        req = self._make_request('/v1')
+        req.remote_user = 'act:usr,act'
+        self.assertEquals(ath.authorize(req).status_int, 403)
+        req = self._make_request('/v1/cfa')
+        req.remote_user = 'act:usr,cfa'
+        self.assertEquals(ath.authorize(req), None)
+
+    def test_reseller_prefixes_token_validation(self):
+        ath = auth.filter_factory({'reseller_prefix': 'AUTH, SERVICE',
+                                   'SERVICE_auth_method': 'active',
+                                   })(FakeApp())
+        req = self._make_request('/v1/SERVICE_cfa/c',
+                                 headers={'X-Auth-Token': 'SERVICE_t'})
+        req.environ['swift.cache'].set('SERVICE_/token/SERVICE_t',
+                                       (time() + 3600, 'usr,service_cfa'))
+        # The AUTH_ namespace is a separate one
+        req.environ['swift.cache'].set('AUTH_/token/SERVICE_t',
+                                       (time() + 3600, 'usr,auth_other'))
+        self.assertEquals(req.get_response(ath).status_int, 404)
+        self.assertEquals(req.environ['REMOTE_USER'], 'usr,service_cfa')
+        self.assertTrue(ath.app.request.environ['swift_owner'])
+
+        req = self._make_request('/v1/SERVICE_cfa/c',
+                                 headers={'X-Auth-Token': 'SERVICE_x'})
+        self.assertEquals(req.get_response(ath).status_int, REDIRECT_STATUS)
+        req = self._make_request('/v1/AUTH_cfa/c',
+                                 headers={'X-Auth-Token': 'AUTH_x'})
+        self.assertEquals(req.get_response(ath).status_int, 401)
+        self.assertEquals(ath.get_auth_data_multi(
+            {'swift.cache': req.environ['swift.cache']},
+            ['SERVICE_t', 'AUTH_t', 'OTHER_t']),
+            {'SERVICE_t': ANY, 'AUTH_t': None, 'OTHER_t': None})
+
+    def test_reseller_prefixes_login(self):
+        ath = auth.filter_factory({'reseller_prefix': 'AUTH, SERVICE',
+                                   'SERVICE_token_life': '60',
+                                   'SERVICE_realm_name': 'EXAMPLE.COM',
+                                   })(FakeApp())
+        _mock_run_kinit = Mock(return_value=0)
+        _mock_get_groups = Mock(return_value='user,service_test')
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'SERVICE_test:user',
+                                          'X-Auth-Key': 'password'})
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       _mock_get_groups):
+                resp = ath.handle_get_token(req)
+                self.assertEquals(resp.status_int, 200)
+                _mock_run_kinit.assert_called_once_with(
+                    'user@EXAMPLE.COM', 'password')
+                self.assertTrue(resp.headers['X-Auth-Token'].startswith(
+                    'SERVICE_tk'))
+                self.assertTrue(resp.headers['X-Storage-Url'].endswith(
+                    '/v1/SERVICE_test'))
+                self.assertEquals(resp.headers['X-Debug-Token-Life'], '60')
+                self.assertEquals(
+                    ath.get_groups(req.environ,
+                                   resp.headers['X-Auth-Token']),
+                    'user,service_test')
+                # The default prefix is not granted by SERVICE_ groups
+                req = self._make_request(
+                    '/auth/v1.0', headers={'X-Auth-User': 'test:user',
+                                           'X-Auth-Key': 'password'})
+                self.assertEquals(ath.handle_get_token(req).status_int, 401)
+
+    def test_memoized_authorize(self):
+        authorize = auth.MemoizedAuthorize(self.test_auth)
+        calls = []
+        orig = self.test_auth.authorize
+
+        def counting_authorize(req):
+            calls.append(req.path)
+            return orig(req)
+
+        def segment(path, method='GET', acl=None):
+            req = self._make_request(path, environ={'REQUEST_METHOD': method})
+            req.remote_user = 'usr,auth_cfa'
+            if acl:
+                req.acl = acl
+            return req
+
+        with patch.object(self.test_auth, 'authorize', counting_authorize):
+            for i in range(100):
+                req = segment('/v1/AUTH_cfa/segments/%d' % i)
+                self.assertEquals(authorize(req), None)
+                self.assertTrue(req.environ['swift_owner'])
+            self.assertEquals(len(calls), 1)
+            self.assertEquals(authorize.hits, 99)
+            # Other accounts, containers, methods and ACLs are evaluated
+            req = segment('/v1/AUTH_other/segments/1')
+            self.assertEquals(authorize(req).status_int, 403)
+            req = segment('/v1/AUTH_other/segments/2')
+            self.assertEquals(authorize(req).status_int, 403)
+            req = segment('/v1/AUTH_other/segments/3', acl='auth_cfa')
+            self.assertEquals(authorize(req), None)
+            self.assertFalse('swift_owner' in req.environ)
+            self.assertEquals(authorize(segment('/v1/AUTH_cfa')), None)
+            self.assertEquals(authorize(segment('/v1/AUTH_cfa', 'DELETE'))
+                              .status_int, 403)
+            self.assertEquals(len(calls), 5)
+            # Container sync requests are never memoized
+            req = segment('/v1/AUTH_other/segments/1')
+            req.environ['swift_sync_key'] = 'key'
+            authorize(req)
+            authorize(req)
+            self.assertEquals(len(calls), 7)
+
+    def test_memoized_authorize_shared_by_subrequests(self):
+        req = self._make_request('/v1/AUTH_cfa/c/o',
+                                 headers={'X-Auth-Token': 'AUTH_t'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'usr,auth_cfa'))
+        req.get_response(self.test_auth)
+        authorize = req.environ['swift.authorize']
+        self.assertTrue(isinstance(authorize, auth.MemoizedAuthorize))
+        sub_req = Request.blank('/v1/AUTH_cfa/c/seg1',
+                                environ={'swift.authorize': authorize,
+                                         'REMOTE_USER': 'usr,auth_cfa'})
+        self.assertEquals(sub_req.environ['swift.authorize'](sub_req), None)
+        self.assertEquals(authorize.hits, 1)
+
     def test_authorize_acl_group_access(self):
         req = self._make_request('/v1/AUTH_cfa')
         req.remote_user = 'act:usr,act'
@@ -474,5 +888,684 @@ class TestAuth(unittest.TestCase):
         resp = req.get_response(self.test_auth)
         self.assertEquals(resp.status_int, REDIRECT_STATUS)
 
+    def test_memcache_breaker_init(self):
+        self.assertTrue(self.test_auth.memcache_breaker is None)
+        ath = auth.filter_factory({'memcache_breaker': 'yes',
+                                   'memcache_timeout': '0.1',
+                                   'breaker_error_threshold': '3'})(FakeApp())
+        self.assertTrue(isinstance(ath.memcache_breaker, CircuitBreaker))
+        self.assertEquals(ath.memcache_breaker.call_timeout, 0.1)
+        self.assertEquals(ath.memcache_breaker.error_threshold, 3)
+
+    def test_memcache_breaker_validation_fallback(self):
+        ath = auth.filter_factory({'memcache_breaker': 'yes',
+                                   'breaker_error_threshold': '1'})(FakeApp())
+        req = self._make_request('/v1/AUTH_test/c',
+                                 headers={'X-Auth-Token': 'AUTH_t'})
+        req.environ['swift.cache'].set('AUTH_/token/AUTH_t',
+                                       (time() + 3600, 'user,auth_test'))
+        self.assertEquals(ath.get_groups(req.environ, 'AUTH_t'),
+                          'user,auth_test')
+        req.environ['swift.cache'] = DownMemcache()
+        with patch.object(ath.logger, 'increment') as mock_increment:
+            self.assertEquals(ath.get_groups(req.environ, 'AUTH_t'),
+                              'user,auth_test')
+            self.assertEquals(ath.get_groups(req.environ, 'AUTH_other'),
+                              None)
+        self.assertEquals(ath.memcache_breaker.state, CircuitBreaker.OPEN)
+        mock_increment.assert_any_call('memcache_breaker.open')
+        mock_increment.assert_any_call('memcache_breaker.fallback')
+
+    def test_slow_memcache_validation(self):
+        ath = auth.filter_factory({'memcache_breaker': 'yes',
+                                   'memcache_timeout': '0.01',
+                                   'breaker_error_threshold': '2'})(FakeApp())
+        mc = FaultyMemcache(Faults(latency=constant(0.05)))
+        mc.store['AUTH_/token/AUTH_t'] = (time() + 3600, 'user,auth_test')
+        ath.local_cache.set('AUTH_/token/AUTH_t',
+                            (time() + 3600, 'user,auth_test'))
+        env = {'swift.cache': mc}
+        for i in range(3):
+            start = time()
+            self.assertEquals(ath.get_groups(env, 'AUTH_t'),
+                              'user,auth_test')
+            self.assertTrue(time() - start < 0.04)
+        self.assertEquals(ath.memcache_breaker.state, CircuitBreaker.OPEN)
+        self.assertEquals(mc.faults.calls, 2)
+
+    def test_kdc_timeout(self):
+        kdc = FakeKDC({'user': 'password'}, Faults(timeout_rate=1))
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'test:user',
+                                          'X-Auth-Key': 'password'})
+        with patch('swiftkerbauth.kerbauth.run_kinit',
+                   lambda user, key: kdc.run_kinit(user, key, 0.01)):
+            resp = self.test_auth_passive.handle_get_token(req)
+        self.assertEquals(resp.status_int, 500)
+        self.assertEquals(kdc.faults.timeouts, 1)
+
+    def test_kdc_and_nss_outages(self):
+        kdc = FakeKDC({'user': 'password'})
+        nss = FakeNSS({'user': ['auth_test']})
+
+        def login():
+            req = self._make_request('/auth/v1.0',
+                                     headers={'X-Auth-User': 'test:user',
+                                              'X-Auth-Key': 'password'})
+            return req.get_response(self.test_auth_passive).status_int
+
+        with patch('swiftkerbauth.kerbauth.run_kinit', kdc.run_kinit):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       nss.get_groups_from_username):
+                with nss.faults.down():
+                    self.assertEquals(login(), 500)
+                self.assertEquals(login(), 200)
+                with kdc.faults.down():
+                    self.assertEquals(login(), 500)
+                # The outage did not get the password cached as wrong
+                self.assertEquals(login(), 200)
+
+    def test_memcache_breaker_login_fallback(self):
+        ath = auth.filter_factory({'auth_method': 'passive',
+                                   'memcache_breaker': 'yes',
+                                   'breaker_error_threshold': '1'})(FakeApp())
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'test:user',
+                                          'X-Auth-Key': 'password'})
+        req.environ['swift.cache'] = DownMemcache()
+        _mock_run_kinit = Mock(return_value=0)
+        _mock_get_groups = Mock(return_value="user,auth_test")
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       _mock_get_groups):
+                resp = ath.handle_get_token(req)
+        self.assertEquals(resp.status_int, 200)
+        token = resp.headers['X-Auth-Token']
+        # The local-only token validates on this worker while memcache is out
+        self.assertEquals(ath.get_groups(req.environ, token),
+                          'user,auth_test')
+
+    def test_token_store_replaces_memcache(self):
+        ath = auth.filter_factory({'auth_method': 'passive',
+                                   'token_store': 'memory'})(FakeApp())
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'test:user',
+                                          'X-Auth-Key': 'password'})
+        req.environ['swift.cache'] = None
+        _mock_run_kinit = Mock(return_value=0)
+        _mock_get_groups = Mock(return_value="user,auth_test")
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       _mock_get_groups):
+                resp = ath.handle_get_token(req)
+        self.assertEquals(resp.status_int, 200)
+        token = resp.headers['X-Auth-Token']
+        self.assertEquals(ath.token_store.get('AUTH_/token/%s' % token)[1],
+                          'user,auth_test')
+        self.assertEquals(ath.get_groups({}, token), 'user,auth_test')
+
+    def test_get_groups_coalesces_concurrent_lookups(self):
+        mc = FakeMemcache()
+        mc.set('AUTH_/token/AUTH_t', (time() + 3600, 'user,auth_test'))
+        orig_get = mc.get
+        gets = []
+
+        def slow_get(key):
+            gets.append(key)
+            eventlet.sleep(0.01)
+            return orig_get(key)
+
+        mc.get = slow_get
+        env = {'swift.cache': mc}
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda i: self.test_auth.get_groups(env, 'AUTH_t'), range(20)))
+        self.assertEquals(results, ['user,auth_test'] * 20)
+        self.assertEquals(gets, ['AUTH_/generation', 'AUTH_/token/AUTH_t'])
+
+    def test_active_negotiate(self):
+        self.test_auth.negotiate_acceptor = FakeAcceptor()
+        req = self._make_request('/auth/v1.0', headers={
+            'Authorization': 'Negotiate %s' % base64.b64encode('good')})
+        _mock_get_groups = Mock(return_value="user,auth_test")
+        with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                   _mock_get_groups):
+            resp = self.test_auth.handle_get_token(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertTrue(resp.headers['X-Auth-Token'].startswith('AUTH_tk'))
+        self.assertEquals(resp.headers['WWW-Authenticate'],
+                          'Negotiate %s' % base64.b64encode('mutual'))
+        _mock_get_groups.assert_called_once_with('user')
+
+    def test_negotiate_reseller_prefix(self):
+        ath = auth.filter_factory({'reseller_prefix': 'AUTH, SERVICE',
+                                   'auth_method': 'active',
+                                   'SERVICE_token_life': '10'})(FakeApp())
+        ath.negotiate_acceptor = FakeAcceptor()
+        req = self._make_request('/auth/v1.0', headers={
+            'Authorization': 'Negotiate %s' % base64.b64encode('good'),
+            'X-Auth-User': 'SERVICE_test:user'})
+        with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                   Mock(return_value="user,service_test")):
+            resp = ath.handle_get_token(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertTrue(
+            resp.headers['X-Auth-Token'].startswith('SERVICE_tk'))
+        self.assertEquals(resp.headers['X-Debug-Token-Life'], '10')
+
+    def test_active_negotiate_falls_back_to_redirect(self):
+        # No acceptor configured
+        req = self._make_request('/auth/v1.0', headers={
+            'Authorization': 'Negotiate %s' % base64.b64encode('good')})
+        resp = self.test_auth.handle_get_token(req)
+        self.assertEquals(resp.status_int, REDIRECT_STATUS)
+        # Bad token or no token
+        self.test_auth.negotiate_acceptor = FakeAcceptor()
+        req = self._make_request('/auth/v1.0', headers={
+            'Authorization': 'Negotiate %s' % base64.b64encode('bad')})
+        resp = self.test_auth.handle_get_token(req)
+        self.assertEquals(resp.status_int, REDIRECT_STATUS)
+        req = self._make_request('/auth/v1.0')
+        resp = self.test_auth.handle_get_token(req)
+        self.assertEquals(resp.status_int, REDIRECT_STATUS)
+
+    def _validate_request(self, body, token='AUTH_admin',
+                          groups='admin,auth_reseller_admin'):
+        req = self._make_request('/auth/validate',
+                                 environ={'REQUEST_METHOD': 'POST'},
+                                 headers={'X-Auth-Token': token},
+                                 body=body)
+        mc = req.environ['swift.cache']
+        mc.set('AUTH_/token/AUTH_admin', (time() + 3600, groups))
+        mc.set('AUTH_/token/AUTH_tk1', (time() + 3600, 'user1,auth_test'))
+        mc.set('AUTH_/token/AUTH_tk2', (time() - 1, 'user2,auth_test'))
+        return req
+
+    def test_validate_tokens(self):
+        req = self._validate_request(json.dumps(
+            ['AUTH_tk1', 'AUTH_tk2', 'AUTH_tk3', 'OTHER_tk1']))
+        resp = req.get_response(self.test_auth)
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(resp.content_type, 'application/json')
+        results = json.loads(resp.body)
+        self.assertEquals(sorted(results.keys()),
+                          ['AUTH_tk1', 'AUTH_tk2', 'AUTH_tk3', 'OTHER_tk1'])
+        self.assertEquals(results['AUTH_tk1']['user'], 'user1')
+        self.assertEquals(results['AUTH_tk1']['groups'],
+                          ['user1', 'auth_test'])
+        self.assertTrue(results['AUTH_tk1']['expires'] > time())
+        self.assertEquals(results['AUTH_tk2'], None)
+        self.assertEquals(results['AUTH_tk3'], None)
+        self.assertEquals(results['OTHER_tk1'], None)
+        # Tokens may also be wrapped in an object
+        req = self._validate_request(json.dumps({'tokens': ['AUTH_tk1']}))
+        resp = req.get_response(self.test_auth)
+        self.assertEquals(json.loads(resp.body).keys(), ['AUTH_tk1'])
+
+    def test_get_auth_data_multi_local_cache(self):
+        ath = auth.filter_factory({'local_token_ttl': '10'})(FakeApp())
+        mc = FakeMemcache()
+        expires = time() + 100
+        mc.set('AUTH_/token/AUTH_tk1', (expires, 'user1,auth_test'))
+        mc.set('AUTH_/token/AUTH_tk2', (expires, 'user2,auth_test'))
+        env = {'swift.cache': mc}
+        self.assertEquals(ath.get_groups(env, 'AUTH_tk1'), 'user1,auth_test')
+        with patch('swiftkerbauth.kerbauth.get_multi',
+                   side_effect=lambda store, keys: map(store.get, keys)) \
+                as mock_get_multi:
+            self.assertEquals(
+                ath.get_auth_data_multi(env, ['AUTH_tk1', 'AUTH_tk2']),
+                {'AUTH_tk1': (expires, 'user1,auth_test'),
+                 'AUTH_tk2': (expires, 'user2,auth_test')})
+            self.assertEquals(mock_get_multi.call_args[0][1],
+                              ['AUTH_/token/AUTH_tk2'])
+            mock_get_multi.reset_mock()
+            ath.get_auth_data_multi(env, ['AUTH_tk1', 'AUTH_tk2'])
+            self.assertFalse(mock_get_multi.called)
+
+    def test_validate_requires_reseller_admin(self):
+        req = self._validate_request('[]', token='AUTH_nope')
+        self.assertEquals(req.get_response(self.test_auth).status_int, 401)
+        req = self._validate_request('[]', groups='admin,auth_test')
+        self.assertEquals(req.get_response(self.test_auth).status_int, 403)
+
+    def test_validate_bad_requests(self):
+        req = self._validate_request('not json')
+        self.assertEquals(req.get_response(self.test_auth).status_int, 400)
+        req = self._validate_request('{"tokens": [1, 2]}')
+        self.assertEquals(req.get_response(self.test_auth).status_int, 400)
+        self.test_auth.validate_max_tokens = 1
+        req = self._validate_request('["AUTH_tk1", "AUTH_tk2"]')
+        self.assertEquals(req.get_response(self.test_auth).status_int, 413)
+        req = self._make_request('/auth/validate')
+        self.assertEquals(req.get_response(self.test_auth).status_int, 400)
+
+    def test_validate_body_limit(self):
+        self.test_auth.validate_max_body = 20
+        body = '["AUTH_tk1", "AUTH_tk2"]'
+        req = self._validate_request(body)
+        self.assertEquals(req.get_response(self.test_auth).status_int, 413)
+        # Without Content-Length, only the limit and one byte are read
+        req = self._validate_request(body)
+        del req.headers['Content-Length']
+        req.environ['HTTP_TRANSFER_ENCODING'] = 'chunked'
+        body_file = req.environ['wsgi.input']
+        self.assertEquals(req.get_response(self.test_auth).status_int, 413)
+        self.assertEquals(body_file.tell(), 21)
+        req = self._validate_request('["AUTH_tk1"]')
+        del req.headers['Content-Length']
+        req.environ['HTTP_TRANSFER_ENCODING'] = 'chunked'
+        self.assertEquals(req.get_response(self.test_auth).status_int, 200)
+
+    def test_helper_pool_used_for_kinit_and_groups(self):
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'test:user',
+                                          'X-Auth-Key': 'password'})
+        pool = Mock()
+        pool.run_kinit.return_value = 0
+        pool.get_groups_from_username.return_value = 'user,auth_test'
+        self.test_auth_passive.helper_pool = pool
+        _mock_run_kinit = Mock(return_value=1)
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            resp = self.test_auth_passive.handle_get_token(req)
+        self.assertEquals(resp.status_int, 200)
+        self.assertFalse(_mock_run_kinit.called)
+        pool.run_kinit.assert_called_once_with('user', 'password')
+        self.assertEquals(pool.get_groups_from_username.call_count, 2)
+
+    def test_group_resolver_used_for_groups(self):
+        resolver = Mock()
+        resolver.get_groups.return_value = 'user,auth_test'
+        self.test_auth_passive.group_resolver = resolver
+        self.test_auth_passive.helper_pool = Mock()
+        self.assertEquals(
+            self.test_auth_passive.get_groups_from_username('user'),
+            'user,auth_test')
+        resolver.get_groups.assert_called_once_with('user')
+        self.assertFalse(
+            self.test_auth_passive.helper_pool.get_groups_from_username.called)
+
+    def test_kinit_hedging(self):
+        ath = auth.filter_factory({
+            'auth_method': 'passive',
+            'kinit_hedge_configs': '/etc/krb5.conf, /etc/krb5-alt.conf',
+            'kinit_hedge_delay': '0.1'})(FakeApp())
+        self.assertEquals(ath.kinit_hedge_configs,
+                          ['/etc/krb5.conf', '/etc/krb5-alt.conf'])
+        _mock_hedged = Mock(return_value=0)
+        with patch('swiftkerbauth.kerbauth.run_kinit_hedged', _mock_hedged):
+            self.assertEquals(ath.run_kinit('user', 'password'), 0)
+            for i in range(20):
+                ath.kinit_latency.add(0.5)
+            ath.run_kinit('user', 'password')
+        self.assertEquals(_mock_hedged.call_args_list[0][0],
+                          ('user', 'password', ath.kinit_hedge_configs, 0.1))
+        self.assertEquals(_mock_hedged.call_args_list[1][0][3], 0.5)
+
+    def test_failed_login_cache(self):
+        def login(password):
+            req = self._make_request('/auth/v1.0',
+                                     headers={'X-Auth-User': 'test:user',
+                                              'X-Auth-Key': password})
+            return self.test_auth_passive.handle_get_token(req)
+
+        _mock_run_kinit = Mock(side_effect=lambda user, key:
+                               0 if key == 'password' else 1)
+        _mock_get_groups = Mock(return_value="user,auth_test")
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       _mock_get_groups):
+                with patch.object(self.test_auth_passive.logger,
+                                  'increment') as mock_increment:
+                    self.assertEquals(login('wrong').status_int, 401)
+                    self.assertEquals(login('wrong').status_int, 401)
+                    self.assertEquals(login('wrong').status_int, 401)
+                    self.assertEquals(login('password').status_int, 200)
+        self.assertEquals(_mock_run_kinit.call_count, 2)
+        self.assertEquals(
+            mock_increment.call_args_list.count((('failed_login_cache.hit',),
+                                                 {})), 2)
+        self.assertEquals(len(self.test_auth_passive.failed_logins), 1)
+        self.assertFalse('wrong' in
+                         self.test_auth_passive.failed_logins.store.keys()[0])
+
+    def test_failed_login_cache_ignores_kdc_outage(self):
+        ath = self.test_auth_passive
+        _mock_run_kinit = Mock(return_value=auth.KINIT_UNREACHABLE)
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            for i in range(2):
+                req = self._make_request('/auth/v1.0', headers={
+                    'X-Auth-User': 'test:user', 'X-Auth-Key': 'password'})
+                self.assertEquals(ath.handle_get_token(req).status_int, 500)
+        self.assertEquals(_mock_run_kinit.call_count, 2)
+        self.assertEquals(len(ath.failed_logins), 0)
+
+    def test_failed_login_cache_disabled(self):
+        ath = auth.filter_factory({'auth_method': 'passive',
+                                   'failed_login_cache_ttl': '0'})(FakeApp())
+        _mock_run_kinit = Mock(return_value=1)
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            for i in range(2):
+                req = self._make_request('/auth/v1.0', headers={
+                    'X-Auth-User': 'test:user', 'X-Auth-Key': 'wrong'})
+                self.assertEquals(ath.handle_get_token(req).status_int, 401)
+        self.assertEquals(_mock_run_kinit.call_count, 2)
+
+    def test_login_rate_limits(self):
+        ath = auth.filter_factory({'auth_method': 'passive',
+                                   'login_rate_per_user': '0.1',
+                                   'login_rate_per_ip': '0.1',
+                                   'login_rate_burst': '2'})(FakeApp())
+
+        def login(user, addr):
+            req = self._make_request('/auth/v1.0',
+                                     environ={'REMOTE_ADDR': addr},
+                                     headers={'X-Auth-User': 'test:' + user,
+                                              'X-Auth-Key': 'wrong'})
+            return ath.handle_get_token(req)
+
+        _mock_run_kinit = Mock(return_value=1)
+        with patch('swiftkerbauth.kerbauth.run_kinit', _mock_run_kinit):
+            self.assertEquals(login('user', '10.0.0.1').status_int, 401)
+            # User names are case insensitive
+            self.assertEquals(login('USER', '10.0.0.2').status_int, 401)
+            resp = login('User', '10.0.0.3')
+            self.assertEquals(resp.status_int, 429)
+            self.assertEquals(resp.headers['Retry-After'], '10')
+            self.assertEquals(login('other', '10.0.0.1').status_int, 401)
+            self.assertEquals(login('another', '10.0.0.1').status_int, 429)
+        # The second attempt of user was answered by the failed login cache
+        self.assertEquals(_mock_run_kinit.call_count, 2)
+
+    def test_login_rate_limits_shared(self):
+        ath = auth.filter_factory({'auth_method': 'passive',
+                                   'login_rate_per_ip': '1',
+                                   'login_rate_burst': '1',
+                                   'login_ratelimit_shared': 'yes'})(FakeApp())
+        req = self._make_request('/auth/v1.0',
+                                 environ={'REMOTE_ADDR': '10.0.0.1'})
+        mc = req.environ['swift.cache']
+        self.assertEquals(ath.handle_get_token(req).status_int,
+                          REDIRECT_STATUS)
+        req = self._make_request('/auth/v1.0',
+                                 environ={'REMOTE_ADDR': '10.0.0.1'})
+        req.environ['swift.cache'] = mc
+        self.assertEquals(ath.handle_get_token(req).status_int, 429)
+
+    def test_local_token_ttl(self):
+        ath = auth.filter_factory({'local_token_ttl': '10'})(FakeApp())
+        env = {'swift.cache': FakeMemcache()}
+        env['swift.cache'].set('AUTH_/token/AUTH_t',
+                               (time() + 3600, 'user,auth_test'))
+        self.assertEquals(ath.get_groups(env, 'AUTH_t'), 'user,auth_test')
+        # Served from the local cache without asking memcache
+        env['swift.cache'].delete('AUTH_/token/AUTH_t')
+        self.assertEquals(ath.get_groups(env, 'AUTH_t'), 'user,auth_test')
+        # Without local_token_ttl memcache stays authoritative
+        self.test_auth.get_groups(env, 'AUTH_t')
+        self.assertEquals(self.test_auth.get_groups(env, 'AUTH_t'), None)
+
+    def test_token_generation(self):
+        mc = FakeMemcache()
+        mc.set('AUTH_/token/AUTH_t', (time() + 3600, 'user,auth_test'))
+        mc.set('AUTH_/token/AUTH_admin',
+               (time() + 3600, 'admin,auth_reseller_admin'))
+        other_worker = auth.filter_factory({})(FakeApp())
+
+        def invalidate(token):
+            req = self._make_request('/auth/invalidate',
+                                     environ={'REQUEST_METHOD': 'POST'},
+                                     headers={'X-Auth-Token': token})
+            req.environ['swift.cache'] = mc
+            return req.get_response(self.test_auth_passive)
+
+        env = {'swift.cache': mc}
+        ath = self.test_auth_passive
+        self.assertEquals(ath.generation(env, 'AUTH_'), 0)
+        self.assertEquals(other_worker.get_groups(env, 'AUTH_t'),
+                          'user,auth_test')
+        self.assertEquals(invalidate('AUTH_t').status_int, 403)
+        self.assertEquals(invalidate('AUTH_x').status_int, 401)
+        resp = invalidate('AUTH_admin')
+        self.assertEquals(resp.status_int, 200)
+        self.assertEquals(json.loads(resp.body), {'generation': 1})
+        self.assertEquals(ath.get_groups(env, 'AUTH_t'), None)
+        self.assertEquals(ath.get_groups(env, 'AUTH_admin'), None)
+        # Other workers catch up within token_generation_ttl
+        self.assertEquals(other_worker.get_groups(env, 'AUTH_t'),
+                          'user,auth_test')
+        with patch('swiftkerbauth.kerbauth.time', return_value=time() + 6):
+            self.assertEquals(other_worker.get_groups(env, 'AUTH_t'), None)
+
+        # New tokens live in the new generation
+        req = self._make_request('/auth/v1.0',
+                                 headers={'X-Auth-User': 'test:user',
+                                          'X-Auth-Key': 'password'})
+        req.environ['swift.cache'] = mc
+        mc.set('AUTH_/user/user', 'AUTH_t')
+        with patch('swiftkerbauth.kerbauth.run_kinit', Mock(return_value=0)):
+            with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                       Mock(return_value='user,auth_test')):
+                resp = ath.handle_get_token(req)
+        token = resp.headers['X-Auth-Token']
+        self.assertNotEquals(token, 'AUTH_t')
+        self.assertEquals(mc.get('AUTH_/g1/user/user'), token)
+        self.assertEquals(mc.get('AUTH_/g1/token/%s' % token)[1],
+                          'user,auth_test')
+        self.assertEquals(ath.get_groups(env, token),
+                          'user,auth_test')
+        self.assertEquals(ath.get_auth_data_multi(
+            env, [token, 'AUTH_t']), {token: ANY, 'AUTH_t': None})
+
+        # Generations never go back, even if memcache loses the key
+        mc.delete('AUTH_/generation')
+        with patch('swiftkerbauth.kerbauth.time', return_value=time() + 6):
+            self.assertEquals(ath.get_groups(env, 'AUTH_t'), None)
+        self.assertEquals(mc.get('AUTH_/generation'), 1)
+
+    def test_token_generation_unknown(self):
+        # Only the memcache server holding the generation is down
+        servers = 1000
+        mc = FaultyMemcache(servers=servers, down_servers=[
+            crc32('AUTH_/generation') % servers])
+        mc.store['AUTH_/generation'] = 1
+        mc.store['AUTH_/token/AUTH_revoked'] = (time() + 3600,
+                                                'user,auth_test')
+        mc.store['AUTH_/g1/token/AUTH_t'] = (time() + 3600, 'user,auth_test')
+        env = {'swift.cache': mc}
+        ath = auth.filter_factory({'auth_method': 'passive'})(FakeApp())
+        with patch.object(ath.logger, 'exception'):
+            self.assertEquals(ath.generation(env, 'AUTH_'), None)
+            self.assertEquals(ath.get_groups(env, 'AUTH_revoked'), None)
+            self.assertEquals(ath.get_groups(env, 'AUTH_t'), None)
+            self.assertEquals(ath.get_auth_data_multi(
+                env, ['AUTH_revoked']), {'AUTH_revoked': None})
+            req = self._make_request('/auth/v1.0',
+                                     headers={'X-Auth-User': 'test:user',
+                                              'X-Auth-Key': 'password'})
+            req.environ['swift.cache'] = mc
+            with patch('swiftkerbauth.kerbauth.run_kinit',
+                       Mock(return_value=0)):
+                with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                           Mock(return_value='user,auth_test')):
+                    self.assertEquals(ath.handle_get_token(req).status_int,
+                                      500)
+        self.assertEquals(ath.generations, {})
+        # Read again once memcache is back
+        mc.down_servers = set()
+        self.assertEquals(ath.get_groups(env, 'AUTH_revoked'), None)
+        self.assertEquals(ath.get_groups(env, 'AUTH_t'), 'user,auth_test')
+
+    def test_token_write_behind(self):
+        ath = auth.filter_factory({'auth_method': 'passive',
+                                   'token_write_behind': 'yes',
+                                   'token_write_retries': '2'})(FakeApp())
+        other_worker = auth.filter_factory({})(FakeApp())
+
+        def login(mc):
+            req = self._make_request('/auth/v1.0',
+                                     headers={'X-Auth-User': 'test:user',
+                                              'X-Auth-Key': 'password'})
+            req.environ['swift.cache'] = mc
+            with patch('swiftkerbauth.kerbauth.run_kinit',
+                       Mock(return_value=0)):
+                with patch('swiftkerbauth.kerbauth.get_groups_from_username',
+                           Mock(return_value='user,auth_test')):
+                    with patch('swiftkerbauth.kerbauth.spawn_n') as spawn_n:
+                        resp = ath.handle_get_token(req)
+            self.assertEquals(resp.status_int, 200)
+            return resp.headers['X-Auth-Token'], \
+                spawn_n.call_args[0] if spawn_n.called else None
+
+        # The response does not wait for memcache
+        mc = FakeMemcache()
+        token, write = login(mc)
+        self.assertEquals(mc.get('AUTH_/token/%s' % token), None)
+        env = {'swift.cache': mc}
+        self.assertEquals(ath.get_groups(env, token), 'user,auth_test')
+        self.assertEquals(other_worker.get_groups(env, token), None)
+        write[0](*write[1:])
+        self.assertEquals(mc.get('AUTH_/user/user'), token)
+        self.assertEquals(other_worker.get_groups(env, token),
+                          'user,auth_test')
+        self.assertEquals(ath.pending_tokens, {})
+
+        # A second login before the write completes gets the same token
+        mc = FakeMemcache()
+        token, write = login(mc)
+        second_token, second_write = login(mc)
+        self.assertEquals(second_token, token)
+        self.assertEquals(second_write, None)
+        self.assertEquals(ath.pending_users, {('AUTH_', 0, 'user'): token})
+        write[0](*write[1:])
+        self.assertEquals(ath.pending_users, {})
+        self.assertEquals(login(mc)[0], token)
+        self.assertEquals(mc.get('AUTH_/user/user'), token)
+
+        # Failed writes are retried, then the token is revoked
+        mc = FakeMemcache()
+        token, write = login(mc)
+        results = [False, True, IOError('down'), True, True]
+
+        def flaky_set(key, value, timeout=0):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            if result:
+                mc.store[key] = value
+            return result
+        with patch.object(mc, 'set', Mock(side_effect=flaky_set)) as mc_set:
+            with patch('swiftkerbauth.kerbauth.sleep') as sleep:
+                write[0](*write[1:])
+        self.assertEquals(mc_set.call_count, 5)
+        self.assertEquals(sleep.call_args_list, [((0.1,),), ((0.2,),)])
+        self.assertTrue(ath.local_cache.get('AUTH_/token/%s' % token))
+        mc = FakeMemcache()
+        token, write = login(mc)
+        with patch.object(mc, 'set', Mock(return_value=False)):
+            with patch('swiftkerbauth.kerbauth.sleep'):
+                with patch.object(ath.logger, 'increment') as increment:
+                    write[0](*write[1:])
+        increment.assert_called_once_with('token_write.errors')
+        self.assertEquals(ath.pending_tokens, {})
+        self.assertEquals(ath.get_groups({'swift.cache': mc}, token), None)
+
+        # MemcacheRing returns None from set whether or not it stored
+        class MemcacheRing(FakeMemcache):
+            def set(self, key, value, timeout=0):
+                FakeMemcache.set(self, key, value, timeout)
+
+        mc = MemcacheRing()
+        token, write = login(mc)
+        write[0](*write[1:])
+        self.assertEquals(other_worker.get_groups({'swift.cache': mc}, token),
+                          'user,auth_test')
+
+        class DroppingMemcacheRing(FakeMemcache):
+            def set(self, key, value, timeout=0):
+                pass
+
+        mc = DroppingMemcacheRing()
+        token, write = login(mc)
+        with patch('swiftkerbauth.kerbauth.sleep'):
+            with patch.object(ath.logger, 'increment') as increment:
+                write[0](*write[1:])
+        increment.assert_called_once_with('token_write.errors')
+        self.assertEquals(ath.get_groups({'swift.cache': mc}, token), None)
+
+    def test_prebuilt_rejections(self):
+        ath = self.test_auth_passive
+        with patch('swiftkerbauth.rejection.spawn_n'):
+            req = self._make_request('/v1/AUTH_test/c',
+                                     headers={'X-Auth-Token': 'AUTH_t'})
+            resp = req.get_response(ath)
+            self.assertEquals(resp.status_int, 401)
+            self.assertEquals(resp.headers['Www-Authenticate'],
+                              'Swift realm="AUTH_test"')
+            req = self._make_request('/v1/AUTH_test/c')
+            self.assertEquals(req.get_response(ath).status_int, 401)
+            self.assertTrue(ath.denied_response(req) is ath.unauthorized)
+            req.remote_user = 'act:usr,act'
+            self.assertTrue(ath.denied_response(req) is ath.forbidden)
+            self.assertTrue(self.test_auth.denied_response(
+                self._make_request('/v1/AUTH_test')) is
+                self.test_auth.redirect)
+        self.assertEquals(ath.rejection_stats.counts,
+                          {'unauthorized': 3, 'forbidden': 1})
+        with patch.object(ath.logger, 'update_stats') as update_stats:
+            ath.rejection_stats.flush()
+        update_stats.assert_any_call('unauthorized', 3)
+        update_stats.assert_any_call('forbidden', 1)
+
+    def test_warmup(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join(tmpdir, 'tokens')
+            ath = auth.filter_factory({'token_store': 'memory',
+                                       'local_token_ttl': '60',
+                                       'warmup_token_snapshot': snapshot,
+                                       })(FakeApp())
+            ath.token_store.set('AUTH_/token/AUTH_tk1',
+                                (time() + 3600, 'user1,auth_test'))
+            ath.get_groups({}, 'AUTH_tk1')
+            ath.snapshot_tokens()
+            writer = ath
+
+            ath = auth.filter_factory({'token_store': 'memory',
+                                       'local_token_ttl': '60',
+                                       'warmup': 'yes',
+                                       'warmup_max_groups': '5',
+                                       'warmup_token_snapshot': snapshot,
+                                       })(FakeApp())
+            ath.token_store.set('AUTH_/token/AUTH_tk1',
+                                (time() + 3600, 'user1,auth_test'))
+            with patch('swiftkerbauth.kerbauth.GROUP_NAMES') as group_names:
+                group_names.preload.return_value = 5
+                with patch('swiftkerbauth.kerbauth.tpool') as tpool:
+                    tpool.execute.side_effect = lambda func, *args: \
+                        func(*args)
+                    eventlet.sleep(0)
+            # The enumeration of groups does not block the hub
+            tpool.execute.assert_called_once_with(group_names.preload, 5)
+            self.assertEquals(len(ath.local_cache), 1)
+            ath.token_store = None
+            self.assertEquals(ath.get_groups({}, 'AUTH_tk1'),
+                              'user1,auth_test')
+
+            # Only one worker writes the snapshot
+            with patch('swiftkerbauth.kerbauth.write_token_snapshot') as w:
+                ath.snapshot_tokens()
+                self.assertFalse(w.called)
+                writer.snapshot_tokens()
+                self.assertTrue(w.called)
+
+            # Without local_token_ttl the prefetched tokens would be unused
+            ath = auth.filter_factory({'token_store': 'memory',
+                                       'warmup_token_snapshot': snapshot,
+                                       })(FakeApp())
+            self.assertEquals(ath.warmup_token_snapshot, None)
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     unittest.main()
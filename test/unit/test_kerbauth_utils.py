@@ -13,11 +13,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import unittest
+import os
 import re
+import grp
+import shutil
+import tempfile
+import threading
+import unittest
 from time import time
-from test.unit import FakeMemcache
+from mock import patch, Mock
+from test.unit import FakeMemcache, FaultyMemcache
 from swiftkerbauth import kerbauth_utils as ku
+from swiftkerbauth.local_cache import LocalCache
+
+STUB_KINIT = '''#!/bin/sh
+read password
+echo "$KRB5CCNAME" >> "%(log)s"
+sleep %(delay)s
+case "$KRB5CCNAME" in MEMORY:*) ;; *) exit 3 ;; esac
+[ "$password" = "secret" ]
+'''
+
+# Sleeps for the number of seconds written in its krb5.conf, or fails like
+# kinit does when its krb5.conf says "down".
+HEDGE_KINIT = '''#!/bin/sh
+read password
+echo "$KRB5_CONFIG" >> "%(log)s"
+delay=`cat "$KRB5_CONFIG"`
+if [ "$delay" = "down" ]; then
+    echo "kinit: Cannot contact any KDC for realm 'EXAMPLE.COM'" >&2
+    exit 1
+fi
+sleep $delay
+[ "$password" = "secret" ]
+'''
+
+
+def install_stub_kinit(bindir, log, delay=0, script=STUB_KINIT):
+    """Writes a kinit stand-in that accepts the password "secret"."""
+    path = os.path.join(bindir, 'kinit')
+    with open(path, 'w') as f:
+        f.write(script % {'log': log, 'delay': delay})
+    os.chmod(path, 0755)
 
 
 class TestKerbUtils(unittest.TestCase):
@@ -57,7 +94,51 @@ class TestKerbUtils(unittest.TestCase):
     def test_set_auth_data(self):
         mc = FakeMemcache()
         expiry = time() + 100
-        ku.set_auth_data(mc, "root", "AUTH_tk", expiry, "root,admin")
+        self.assertTrue(ku.set_auth_data(mc, "root", "AUTH_tk", expiry,
+                                         "root,admin"))
+        mc.set = Mock(return_value=False)
+        self.assertFalse(ku.set_auth_data(mc, "root", "AUTH_tk", expiry,
+                                          "root,admin"))
+
+    def test_auth_data_reseller_prefix(self):
+        mc = FakeMemcache()
+        expiry = time() + 200
+        ku.set_auth_data(mc, "root", "SERVICE_tk", expiry, "root,admin",
+                         "SERVICE_", 100)
+        self.assertEqual(mc.get("SERVICE_/user/root"), "SERVICE_tk")
+        self.assertEqual(ku.get_auth_data(mc, "root"), (None, None, None))
+        self.assertEqual(ku.get_auth_data(mc, "root", "SERVICE_"),
+                         ("SERVICE_tk", expiry, "root,admin"))
+        self.assertTrue(ku.generate_token("SERVICE_").startswith(
+            "SERVICE_tk"))
+
+    def test_generation(self):
+        mc = FakeMemcache()
+        self.assertEqual(ku.token_key("AUTH_tk1"), "AUTH_/token/AUTH_tk1")
+        self.assertEqual(ku.token_key("AUTH_tk1", "AUTH_", 2),
+                         "AUTH_/g2/token/AUTH_tk1")
+        self.assertEqual(ku.get_generation(mc), 0)
+        self.assertEqual(ku.bump_generation(mc), 1)
+        self.assertEqual(ku.bump_generation(mc), 2)
+        self.assertEqual(ku.get_generation(mc), 2)
+        self.assertEqual(ku.get_generation(mc, "SERVICE_"), 0)
+        # A missing generation is created, a failing memcache raises
+        self.assertEqual(mc.get("SERVICE_/generation"), 0)
+        mc = FaultyMemcache()
+        with mc.faults.down():
+            self.assertRaises(IOError, ku.get_generation, mc)
+        # Token stores without incr
+        store = LocalCache()
+        self.assertEqual(ku.bump_generation(store, "AUTH_"), 1)
+        self.assertEqual(ku.get_generation(store, "AUTH_"), 1)
+
+        expiry = time() + 200
+        ku.set_auth_data(mc, "root", "AUTH_tk", expiry, "root", "AUTH_",
+                         100, 2)
+        self.assertEqual(mc.get("AUTH_/g2/user/root"), "AUTH_tk")
+        self.assertEqual(ku.get_auth_data(mc, "root"), (None, None, None))
+        self.assertEqual(ku.get_auth_data(mc, "root", "AUTH_", 2),
+                         ("AUTH_tk", expiry, "root"))
 
     def test_generate_token(self):
         token = ku.generate_token()
@@ -68,6 +149,27 @@ class TestKerbUtils(unittest.TestCase):
         groups = ku.get_groups_from_username("root")
         self.assertTrue("root" in groups)
 
+    def test_group_name_index(self):
+        index = ku.GroupNameIndex(ttl=60)
+        self.assertTrue(index.preload(limit=2) <= 2)
+        self.assertEqual(sorted(ku.iter_groups()),
+                         sorted((g.gr_gid, g.gr_name) for g in grp.getgrall()))
+        with patch('swiftkerbauth.kerbauth_utils.grp.getgrall') as getgrall:
+            groups = ku.iter_groups()
+            groups.next()
+            groups.close()
+            self.assertFalse(getgrall.called)
+        root = [g for g in grp.getgrall() if g.gr_gid == 0][0]
+        self.assertEqual(index.name(0), root.gr_name)
+        with patch('swiftkerbauth.kerbauth_utils.grp.getgrgid') as getgrgid:
+            getgrgid.return_value = ('cached',)
+            index.names[12345] = 'stale'
+            self.assertEqual(index.name(12345), 'stale')
+            index.created -= 61
+            self.assertEqual(index.name(12345), 'cached')
+            self.assertEqual(index.name(12345), 'cached')
+            self.assertEqual(getgrgid.call_count, 1)
+
     def test_get_groups_from_username_err(self):
         try:
             ku.get_groups_from_username("Zroot")
@@ -75,3 +177,120 @@ class TestKerbUtils(unittest.TestCase):
             self.assertTrue(err.args[0].startswith("Failure running id -G"))
         else:
             self.fail("Expected RuntimeError")
+
+
+class TestRunKinit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'ccaches')
+        path = self.tmpdir + os.pathsep + os.environ.get('PATH', '')
+        self.path_patcher = patch.dict(os.environ, {'PATH': path})
+        self.path_patcher.start()
+
+    def tearDown(self):
+        self.path_patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _ccaches(self):
+        with open(self.log) as f:
+            return f.read().split()
+
+    def test_private_ccache(self):
+        self.assertTrue(ku.private_ccache().startswith('MEMORY:kerbauth_'))
+        self.assertNotEqual(ku.private_ccache(), ku.private_ccache())
+
+    def test_run_kinit(self):
+        install_stub_kinit(self.tmpdir, self.log)
+        self.assertEqual(ku.run_kinit('user', 'secret'), 0)
+        self.assertEqual(ku.run_kinit('user', 'wrong'), 1)
+        self.assertEqual(len(set(self._ccaches())), 2)
+
+    def test_run_kinit_unreachable_kdc(self):
+        install_stub_kinit(self.tmpdir, self.log, script=HEDGE_KINIT)
+        os.environ['KRB5_CONFIG'] = self._krb5_conf('down.conf', 'down')
+        try:
+            self.assertEqual(ku.run_kinit('user', 'secret'),
+                             ku.KINIT_UNREACHABLE)
+        finally:
+            del os.environ['KRB5_CONFIG']
+
+    def test_run_kinit_timeout(self):
+        install_stub_kinit(self.tmpdir, self.log, delay=5)
+        start = time()
+        self.assertEqual(ku.run_kinit('user', 'secret', timeout=0.2), -1)
+        self.assertTrue(time() - start < 2)
+
+    def test_run_kinit_concurrent_logins_are_isolated(self):
+        install_stub_kinit(self.tmpdir, self.log, delay=0.1)
+        results = []
+
+        def login(password):
+            results.append((password, ku.run_kinit('user', password)))
+
+        threads = [threading.Thread(target=login,
+                                    args=('secret' if i % 2 else 'wrong',))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results),
+                         [('secret', 0)] * 5 + [('wrong', 1)] * 5)
+        ccaches = self._ccaches()
+        self.assertEqual(len(ccaches), 10)
+        self.assertEqual(len(set(ccaches)), 10)
+
+    def _krb5_conf(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_run_kinit_hedged_fast_primary(self):
+        install_stub_kinit(self.tmpdir, self.log, script=HEDGE_KINIT)
+        fast = self._krb5_conf('fast.conf', '0')
+        slow = self._krb5_conf('slow.conf', '5')
+        self.assertEqual(ku.run_kinit_hedged('user', 'secret', [fast, slow],
+                                             0.5), 0)
+        self.assertEqual(self._ccaches(), [fast])
+
+    def test_run_kinit_hedged_slow_primary(self):
+        install_stub_kinit(self.tmpdir, self.log, script=HEDGE_KINIT)
+        fast = self._krb5_conf('fast.conf', '0')
+        slow = self._krb5_conf('slow.conf', '5')
+        start = time()
+        self.assertEqual(ku.run_kinit_hedged('user', 'wrong', [slow, fast],
+                                             0.1, timeout=2), 1)
+        self.assertTrue(time() - start < 1)
+        self.assertEqual(self._ccaches(), [slow, fast])
+
+    def test_run_kinit_hedged_unreachable_kdc(self):
+        install_stub_kinit(self.tmpdir, self.log, script=HEDGE_KINIT)
+        down = self._krb5_conf('down.conf', 'down')
+        fast = self._krb5_conf('fast.conf', '0')
+        self.assertEqual(ku.run_kinit_hedged('user', 'secret', [down, fast],
+                                             0.5), 0)
+        self.assertEqual(self._ccaches(), [down, fast])
+        self.assertEqual(ku.run_kinit_hedged('user', 'secret', [down, down],
+                                             0.5), ku.KINIT_UNREACHABLE)
+
+    def test_run_kinit_hedged_timeout(self):
+        install_stub_kinit(self.tmpdir, self.log, script=HEDGE_KINIT)
+        slow = self._krb5_conf('slow.conf', '5')
+        self.assertEqual(ku.run_kinit_hedged('user', 'secret', [slow, slow],
+                                             0.1, timeout=0.3), -1)
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_percentile(self):
+        tracker = ku.LatencyTracker(size=100)
+        self.assertEqual(tracker.percentile(95), None)
+        for i in range(200):
+            tracker.add(i % 100)
+        self.assertEqual(len(tracker.samples), 100)
+        self.assertEqual(tracker.percentile(95), 95)
+        self.assertEqual(tracker.percentile(0), 0)
+        self.assertEqual(ku.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(ku.percentile([], 50), None)
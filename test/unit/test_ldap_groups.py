@@ -0,0 +1,193 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import unittest
+from mock import patch
+from swiftkerbauth import ldap_groups
+
+
+class FakeLDAPError(Exception):
+    pass
+
+
+class FakeServerDown(FakeLDAPError):
+    pass
+
+
+class FakePagedControl(object):
+    controlType = '1.2.840.113556.1.4.319'
+
+    def __init__(self, criticality, size, cookie):
+        self.size = size
+        self.cookie = cookie
+
+
+class FakeDirectory(object):
+    """
+    In-process stand-in for the python-ldap module and a directory server.
+    Only filters of the form (attr=value) are supported.
+    """
+    SCOPE_SUBTREE = 2
+    OPT_REFERRALS = 8
+    OPT_NETWORK_TIMEOUT = 0x5005
+    OPT_TIMEOUT = 0x5002
+    LDAPError = FakeLDAPError
+    SERVER_DOWN = FakeServerDown
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.connections = []
+        self.searches = 0
+
+    def initialize(self, uri):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+    def search(self, base, filterstr):
+        self.searches += 1
+        attr, value = re.match(r'\((\w+)=(.*)\)$', filterstr).groups()
+        value = re.sub(r'\\([0-9a-f]{2})',
+                       lambda m: chr(int(m.group(1), 16)), value)
+        return [(dn, attrs) for dn, attrs in sorted(self.entries.items())
+                if dn.endswith(base) and value in attrs.get(attr, [])]
+
+
+class FakeConnection(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.down = False
+        self.results = {}
+
+    def set_option(self, option, value):
+        pass
+
+    def simple_bind_s(self, who, cred):
+        pass
+
+    def unbind_s(self):
+        pass
+
+    def search_ext(self, base, scope, filterstr, attrs, serverctrls,
+                   timeout):
+        if self.down:
+            raise FakeServerDown('Can\'t contact LDAP server')
+        control = serverctrls[0]
+        start = int(control.cookie or 0)
+        entries = self.directory.search(base, filterstr)
+        page = entries[start:start + control.size]
+        cookie = ''
+        if start + control.size < len(entries):
+            cookie = str(start + control.size)
+        msgid = len(self.results) + 1
+        self.results[msgid] = (page, cookie)
+        return msgid
+
+    def result3(self, msgid, timeout):
+        page, cookie = self.results.pop(msgid)
+        # Search references come without a DN
+        return (101, page + [(None, ['ldap://other/'])], msgid,
+                [FakePagedControl(True, 0, cookie)])
+
+
+ENTRIES = {
+    'uid=alice,cn=users,dc=example,dc=com': {
+        'uid': ['alice'],
+        'memberOf': ['cn=alice,cn=groups,dc=example,dc=com',
+                     'cn=auth_test,cn=groups,dc=example,dc=com',
+                     'cn=ops\\2C eu,cn=groups,dc=example,dc=com']},
+}
+for i in range(5):
+    ENTRIES['cn=group%d,cn=groups,dc=example,dc=com' % i] = {
+        'cn': ['group%d' % i], 'memberUid': ['bob']}
+
+
+class TestLDAPGroupResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = FakeDirectory(ENTRIES)
+        self.patches = [
+            patch('swiftkerbauth.ldap_groups.ldap', self.directory),
+            patch('swiftkerbauth.ldap_groups.SimplePagedResultsControl',
+                  FakePagedControl)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_member_of(self):
+        resolver = ldap_groups.LDAPGroupResolver(
+            'ldap://localhost', 'dc=example,dc=com')
+        self.assertEqual(resolver.get_groups('alice'),
+                         'alice,auth_test,ops, eu')
+        self.assertEqual(resolver.get_groups('alice'),
+                         'alice,auth_test,ops, eu')
+        self.assertEqual(self.directory.searches, 1)
+        self.assertEqual(len(self.directory.connections), 1)
+
+    def test_unknown_user(self):
+        resolver = ldap_groups.LDAPGroupResolver(
+            'ldap://localhost', 'dc=example,dc=com')
+        self.assertRaises(RuntimeError, resolver.get_groups, 'mallory')
+        self.assertRaises(RuntimeError, resolver.get_groups, 'al*')
+
+    def test_group_filter_paged(self):
+        resolver = ldap_groups.LDAPGroupResolver(
+            'ldap://localhost', 'dc=example,dc=com',
+            group_filter='(memberUid=%s)',
+            group_base_dn='cn=groups,dc=example,dc=com', page_size=2)
+        self.assertEqual(resolver.get_groups('bob'),
+                         'bob,group0,group1,group2,group3,group4')
+        self.assertEqual(self.directory.searches, 3)
+
+    def test_server_down(self):
+        resolver = ldap_groups.LDAPGroupResolver(
+            'ldap://localhost', 'dc=example,dc=com', cache_ttl=0,
+            cache_size=0)
+        resolver.get_groups('alice')
+        self.directory.connections[0].down = True
+        self.assertEqual(resolver.get_groups('alice'),
+                         'alice,auth_test,ops, eu')
+        self.assertEqual(len(self.directory.connections), 2)
+        self.assertEqual(resolver.connections, 1)
+        self.directory.connections[1].down = True
+        with patch.object(self.directory, 'initialize') as initialize:
+            initialize.return_value.search_ext.side_effect = \
+                FakeServerDown('down')
+            self.assertRaises(RuntimeError, resolver.get_groups, 'alice')
+        self.assertEqual(resolver.connections, 0)
+
+    def test_get_group_resolver(self):
+        self.assertEqual(ldap_groups.get_group_resolver({}), None)
+        resolver = ldap_groups.get_group_resolver(
+            {'group_resolver': 'ldap', 'ldap_base_dn': 'dc=example,dc=com',
+             'ldap_pool_size': '8'})
+        self.assertEqual(resolver.pool_size, 8)
+        self.assertRaises(ValueError, ldap_groups.get_group_resolver,
+                          {'group_resolver': 'winbind'})
+        with patch('swiftkerbauth.ldap_groups.ldap', None):
+            self.assertRaises(RuntimeError, ldap_groups.get_group_resolver,
+                              {'group_resolver': 'ldap'})
+
+    def test_helpers(self):
+        self.assertEqual(ldap_groups.escape_filter('a*(b)\\'),
+                         'a\\2a\\28b\\29\\5c')
+        self.assertEqual(ldap_groups.first_rdn_value('cn=a\\,b+x=y,dc=c'),
+                         'a,b')
+        self.assertEqual(ldap_groups.first_rdn_value('nodn'), 'nodn')
@@ -0,0 +1,88 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from time import time
+from mock import patch
+from swiftkerbauth.local_cache import LocalCache
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_get_set_delete(self):
+        cache = LocalCache(10)
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', 1, timeout=100)
+        self.assertEqual(cache.get('a'), 1)
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_expiry(self):
+        cache = LocalCache(10)
+        cache.set('a', 1, timeout=100)
+        with patch('swiftkerbauth.local_cache.time',
+                   return_value=time() + 101):
+            self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_max_age(self):
+        cache = LocalCache(10)
+        cache.set('a', 1, timeout=100)
+        self.assertEqual(cache.get('a', max_age=10), 1)
+        with patch('swiftkerbauth.local_cache.time',
+                   return_value=time() + 11):
+            self.assertEqual(cache.get('a', max_age=10), None)
+            self.assertEqual(cache.get('a'), 1)
+
+    def test_bounded(self):
+        cache = LocalCache(3)
+        for i in range(10):
+            cache.set(i, i)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(9), 9)
+
+    def test_bytes(self):
+        cache = LocalCache(10)
+        self.assertEqual(cache.bytes, 0)
+        cache.set('a', (1.0, 'user,auth_test'))
+        size = cache.bytes
+        self.assertTrue(size > len('user,auth_test'))
+        cache.set('a', (1.0, 'user,auth_test' + 'x' * 1000))
+        self.assertEqual(cache.bytes, size + 1000)
+        cache.set('b', (1.0, 'user,auth_test'))
+        self.assertEqual(cache.bytes, 2 * size + 1000)
+        cache.delete('a')
+        cache.delete('a')
+        self.assertEqual(cache.bytes, size)
+        cache.set('c', 'x', timeout=100)
+        with patch('swiftkerbauth.local_cache.time',
+                   return_value=time() + 101):
+            self.assertEqual(cache.get('c'), None)
+        self.assertEqual(cache.bytes, size)
+
+    def test_max_bytes(self):
+        cache = LocalCache(100, max_bytes=2000)
+        self.assertFalse(cache.set('big', 'x' * 2000))
+        for i in range(10):
+            self.assertTrue(cache.set(i, 'x' * 500))
+            self.assertTrue(cache.bytes <= 2000)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(9), 'x' * 500)
+
+    def test_disabled(self):
+        cache = LocalCache(0)
+        self.assertFalse(cache.set('a', 1))
+        self.assertEqual(cache.get('a'), None)
@@ -0,0 +1,62 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from mock import patch, Mock
+from swiftkerbauth import memory
+
+
+class TestMemory(unittest.TestCase):
+
+    def test_sizeof(self):
+        self.assertEqual(memory.sizeof('abc'), sys.getsizeof('abc'))
+        groups = 'user,auth_test,' + 'x' * 1000
+        self.assertEqual(memory.sizeof((1.0, groups)),
+                         sys.getsizeof((1.0, groups)) +
+                         sys.getsizeof(1.0) + sys.getsizeof(groups))
+        self.assertEqual(memory.sizeof({1: 'a'}),
+                         sys.getsizeof({1: 'a'}) + sys.getsizeof(1) +
+                         sys.getsizeof('a'))
+
+    def test_write_memory_snapshot(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, 'mem')
+            with patch.object(memory, 'tracemalloc', None):
+                path = memory.write_memory_snapshot(prefix)
+            self.assertTrue(path.startswith('%s.%d.' % (prefix, os.getpid())))
+            self.assertTrue(path.endswith('.txt'))
+            with open(path) as f:
+                lines = f.readlines()
+            self.assertTrue(0 < len(lines) <= 50)
+            self.assertTrue(int(lines[0].split()[0]) >=
+                            int(lines[-1].split()[0]))
+            tracemalloc = Mock()
+            tracemalloc.is_tracing.return_value = True
+            with patch.object(memory, 'tracemalloc', tracemalloc):
+                path = memory.write_memory_snapshot(prefix)
+            self.assertTrue(path.endswith('.tracemalloc'))
+            tracemalloc.take_snapshot.return_value.dump \
+                .assert_called_once_with(path)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from mock import patch
+from swiftkerbauth import negotiate
+
+
+class TestNegotiate(unittest.TestCase):
+
+    def test_parse_negotiate_header(self):
+        self.assertEqual(negotiate.parse_negotiate_header('Negotiate YWJj'),
+                         'abc')
+        self.assertEqual(negotiate.parse_negotiate_header('negotiate  YWJj'),
+                         'abc')
+        self.assertEqual(negotiate.parse_negotiate_header('Basic YWJj'), None)
+        self.assertEqual(negotiate.parse_negotiate_header('Negotiate'), None)
+        self.assertEqual(negotiate.parse_negotiate_header(None), None)
+        self.assertEqual(negotiate.parse_negotiate_header('Negotiate Y'),
+                         None)
+
+    def test_acceptor_requires_gssapi(self):
+        with patch('swiftkerbauth.negotiate.gssapi', None):
+            self.assertRaises(RuntimeError, negotiate.GSSAcceptor,
+                              '/etc/swift/http.keytab')
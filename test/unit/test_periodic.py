@@ -0,0 +1,40 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from mock import patch, Mock
+from swiftkerbauth.periodic import call_every
+
+
+class Stop(BaseException):
+    pass
+
+
+class TestCallEvery(unittest.TestCase):
+
+    def test_survives_exceptions(self):
+        func = Mock(side_effect=[IOError('disk full'), None, Stop()])
+        logger = Mock()
+        with patch('swiftkerbauth.periodic.sleep') as sleep:
+            self.assertRaises(Stop, call_every, 5, func, logger,
+                              'Writing things')
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(sleep.call_args_list, [((5,),)] * 3)
+        logger.exception.assert_called_once_with('%s failed',
+                                                 'Writing things')
+
+
+if __name__ == '__main__':
+    unittest.main()
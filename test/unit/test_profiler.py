@@ -0,0 +1,65 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+from swiftkerbauth.profiler import RequestProfiler
+
+
+def work(n):
+    return sum(range(n))
+
+
+class TestRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dump_path = os.path.join(self.tmpdir, 'kerbauth')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sample(self):
+        profiler = RequestProfiler(3, self.dump_path)
+        self.assertEqual([profiler.sample() for i in range(6)],
+                         [False, False, True, False, False, True])
+        profiler.active = True
+        self.assertEqual([profiler.sample() for i in range(3)],
+                         [False, False, False])
+
+    def test_run_and_dump(self):
+        profiler = RequestProfiler(1, self.dump_path, dump_interval=3600)
+        self.assertEqual(profiler.run('token', work, 10), 45)
+        self.assertEqual(profiler.run('token', work, 5), 10)
+        profiler.run('get_token', work, 1)
+        self.assertFalse(profiler.active)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        stats = profiler.stats['token'].stats
+        calls = [stat[1] for func, stat in stats.items()
+                 if func[2] == 'work']
+        self.assertEqual(calls, [2])
+
+        profiler.dump_interval = 0
+        self.assertRaises(ZeroDivisionError, profiler.run, 'token',
+                          lambda: 1 / 0)
+        self.assertFalse(profiler.active)
+        path = '%s.token.%d.prof' % (self.dump_path, os.getpid())
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted([os.path.basename(path),
+                                 'kerbauth.get_token.%d.prof' % os.getpid()]))
+        self.assertTrue(pstats.Stats(path).total_calls > 0)
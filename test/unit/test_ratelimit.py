@@ -0,0 +1,67 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from mock import patch
+from test.unit import FakeMemcache
+from swiftkerbauth import ratelimit
+
+
+class TestLimiters(unittest.TestCase):
+
+    def test_token_bucket(self):
+        limiter = ratelimit.TokenBucketLimiter(rate=2, burst=3)
+        with patch('swiftkerbauth.ratelimit.time', return_value=1000.0):
+            self.assertEqual([limiter.acquire('a') for i in range(3)],
+                             [0, 0, 0])
+            self.assertEqual(limiter.acquire('a'), 0.5)
+            # Other keys have their own bucket
+            self.assertEqual(limiter.acquire('b'), 0)
+        with patch('swiftkerbauth.ratelimit.time', return_value=1000.5):
+            self.assertEqual(limiter.acquire('a'), 0)
+            self.assertEqual(limiter.acquire('a'), 0.5)
+
+    def test_token_bucket_bounded(self):
+        limiter = ratelimit.TokenBucketLimiter(rate=1, burst=1, max_keys=10)
+        with patch('swiftkerbauth.ratelimit.time', return_value=1000.0):
+            limiter.acquire('a')
+            for i in range(1000):
+                self.assertEqual(limiter.acquire(i), 0)
+                self.assertTrue(len(limiter.buckets) <= 10)
+                if i % 5 == 0:
+                    # Recently used buckets are kept
+                    self.assertEqual(limiter.acquire('a'), 1)
+        self.assertEqual(len(limiter.buckets), 10)
+        self.assertEqual(limiter.buckets.keys()[-1], 999)
+
+    def test_memcache_limiter(self):
+        mc = FakeMemcache()
+        limiter = ratelimit.MemcacheLimiter(rate=1, burst=2)
+        with patch('swiftkerbauth.ratelimit.time', return_value=1000.5):
+            self.assertEqual(limiter.acquire('a', mc), 0)
+            self.assertEqual(limiter.acquire('a', mc), 0)
+            self.assertEqual(limiter.acquire('a', mc), 1.5)
+            self.assertEqual(limiter.acquire('b', mc), 0)
+            # Fails open without memcache
+            self.assertEqual(limiter.acquire('a', None), 0)
+        with patch('swiftkerbauth.ratelimit.time', return_value=1002.0):
+            self.assertEqual(limiter.acquire('a', mc), 0)
+
+    def test_get_limiter(self):
+        self.assertEqual(ratelimit.get_limiter(0, 10), None)
+        self.assertTrue(isinstance(ratelimit.get_limiter(1, 10),
+                                   ratelimit.TokenBucketLimiter))
+        self.assertTrue(isinstance(ratelimit.get_limiter(1, 10, True),
+                                   ratelimit.MemcacheLimiter))
@@ -0,0 +1,94 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from mock import Mock, patch
+from swift.common.swob import Request, HTTPForbidden, HTTPSeeOther, \
+    HTTPUnauthorized
+from swiftkerbauth.rejection import Counters, Rejection
+
+
+class TestRejection(unittest.TestCase):
+
+    def assertSameResponse(self, rejection, swob_response, path='/v1/AUTH_a',
+                           method='GET'):
+        expected = Request.blank(path, method=method).get_response(
+            swob_response)
+        resp = Request.blank(path, method=method).get_response(rejection)
+        self.assertEquals(resp.status, expected.status)
+        self.assertEquals(resp.body, expected.body)
+        self.assertEquals(sorted(resp.headers.items()),
+                          sorted(expected.headers.items()))
+
+    def test_matches_swob(self):
+        self.assertSameResponse(Rejection(403), HTTPForbidden())
+        self.assertSameResponse(
+            Rejection(303, location='http://a.example.com/auth'),
+            HTTPSeeOther(location='http://a.example.com/auth'))
+
+    def test_unauthorized_realm(self):
+        for path in ('/v1/AUTH_a/c/o', '/v1/AUTH_%20a', '/v1.0', '/',
+                     '/auth/v1.0', ''):
+            resp = Request.blank(path).get_response(Rejection(401))
+            expected = Request.blank(path).get_response(
+                HTTPUnauthorized(request=Request.blank(path)))
+            self.assertEquals(resp.headers['Www-Authenticate'],
+                              expected.headers['Www-Authenticate'])
+
+    def test_head(self):
+        self.assertSameResponse(Rejection(401), HTTPUnauthorized(
+            request=Request.blank('/v1/AUTH_a', method='HEAD')),
+            method='HEAD')
+
+    def test_relative_location(self):
+        resp = Request.blank('/v1/AUTH_a').get_response(
+            Rejection(303, location='/auth'))
+        self.assertEquals(resp.status_int, 303)
+        self.assertEquals(resp.location, 'http://localhost/auth')
+
+    def test_shared(self):
+        rejection = Rejection(401)
+        Request.blank('/v1/AUTH_a').get_response(rejection)
+        self.assertEquals(len(rejection.headers), 2)
+
+
+class TestCounters(unittest.TestCase):
+
+    def test_batched(self):
+        logger = Mock()
+        counters = Counters(logger, 1)
+        with patch('swiftkerbauth.rejection.spawn_n') as spawn_n:
+            for i in range(1000):
+                counters.increment('unauthorized')
+            counters.increment('forbidden')
+        self.assertEquals(spawn_n.call_count, 1)
+        self.assertFalse(logger.increment.called)
+        counters.flush()
+        self.assertEquals(sorted(logger.update_stats.call_args_list),
+                          [(('forbidden', 1),), (('unauthorized', 1000),)])
+        logger.update_stats.reset_mock()
+        counters.flush()
+        self.assertFalse(logger.update_stats.called)
+
+    def test_unbatched(self):
+        logger = Mock()
+        counters = Counters(logger, 0)
+        counters.increment('unauthorized')
+        logger.increment.assert_called_once_with('unauthorized')
+        self.assertEquals(counters.counts, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
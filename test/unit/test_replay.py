@@ -0,0 +1,69 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from time import time
+from mock import patch
+from swiftkerbauth.capture import TrafficCapture, read_events
+from swiftkerbauth import replay
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        capture = TrafficCapture(os.path.join(self.tmpdir, 'capture'))
+        start = time()
+        capture.record(start, 0.03, 'get_token', 'GET', 200, user='alice',
+                       account='test')
+        capture.record(start + 1, 0.03, 'get_token', 'GET', 401,
+                       user='bob', account='test')
+        for i in range(5):
+            capture.record(start + 2 + i, 0.001, 'token', 'GET', 0,
+                           token='AUTH_tk1', user='alice', account='test')
+        capture.record(start + 8, 0.001, 'token', 'GET', 401,
+                       token='AUTH_tk2', account='test')
+        capture.record(start + 9, 0.001, 'validate', 'POST', 200)
+        capture.flush()
+        self.path = capture.path
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay(self):
+        run = replay.Replay({'ext_authentication_url': 'http://localhost/',
+                             'local_token_ttl': '60'},
+                            read_events([self.path]), memcache_latency=0,
+                            kinit_latency=0, groups_latency=0)
+        run.run()
+        self.assertEqual(run.matched, 8)
+        self.assertEqual(run.skipped, 1)
+        self.assertEqual(run.kinits, 2)
+        self.assertEqual(run.group_lookups, 2)
+        self.assertEqual(run.auth.local_cache.hits, 4)
+        report = run.report()
+        self.assertTrue(report[0].startswith('8 events replayed'))
+        self.assertEqual(report[1], 'outcomes matching the capture: 8/8')
+        self.assertEqual(sorted(line.split(':')[0] for line in report[5:]),
+                         ['get_token', 'token'])
+
+    def test_main(self):
+        with patch('sys.stderr'):
+            self.assertRaises(SystemExit, replay.main, [])
+        replay.main(['-o', 'local_token_ttl=60', '--kinit-ms', '0',
+                     '--concurrency', '4', self.path])
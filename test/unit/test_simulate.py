@@ -0,0 +1,99 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from swiftkerbauth import kerbauth, local_cache, simulate
+
+POPULATION = {'users': 20, 'accounts': 4, 'hours': 3, 'bucket': 600,
+              'clients': [{'requests_per_hour': 20}]}
+
+
+class TestSimulate(unittest.TestCase):
+
+    def test_steady_state(self):
+        sim = simulate.Simulation({'token_life': '86400'}, POPULATION)
+        sim.run()
+        self.assertEqual(kerbauth.time, time.time)
+        self.assertEqual(local_cache.time, time.time)
+        self.assertEqual(len(sim.load.counts), 18)
+        self.assertEqual(len(sim.load.memory), 18)
+        requests = sim.load.total('requests')
+        self.assertTrue(900 < requests < 1500)
+        # Tokens were issued before the start and few expire in 3 hours
+        self.assertTrue(sim.load.total('kinit') < 10)
+        self.assertEqual(sim.load.total('kinit'), sim.load.total('logins'))
+        # Plus the reads of the token generation
+        self.assertTrue(requests + 2 * sim.load.total('logins') <
+                        sim.load.total('memcache.get') <
+                        2 * requests + 3 * sim.load.total('logins'))
+        self.assertTrue(30 < sim.load.memory[-1][0] <= 40)
+        report = sim.report()
+        self.assertTrue(report[0].startswith('3.0h simulated: 20 users'))
+        self.assertTrue(report[-1].startswith('memcache memory peak'))
+        curves = sim.curves()
+        self.assertEqual(len(curves), 19)
+        self.assertEqual(curves[1].split(',')[0], '0')
+
+    def test_token_life(self):
+        long_life = simulate.Simulation({'token_life': '86400'}, POPULATION)
+        long_life.run()
+        short_life = simulate.Simulation({'token_life': '1800'}, POPULATION)
+        short_life.run()
+        self.assertTrue(short_life.load.total('kinit') >
+                        5 * long_life.load.total('kinit'))
+        self.assertTrue(short_life.load.total('refused') > 0)
+        self.assertEqual(short_life.load.total('requests'),
+                         long_life.load.total('requests'))
+
+    def test_clients(self):
+        population = dict(POPULATION, steady_state=False, clients=[
+            {'share': 1, 'requests_per_hour': 10, 'active_hours': [1, 2]},
+            {'share': 1, 'requests_per_hour': 10, 'login_every': 0,
+             'bad_password': 1}])
+        sim = simulate.Simulation({}, population)
+        sim.run()
+        for counts in sim.load.counts[:6]:
+            self.assertEqual(counts['requests'], counts['logins'])
+        self.assertTrue(sum(counts['requests']
+                            for counts in sim.load.counts[6:12]) >
+                        sum(counts['logins']
+                            for counts in sim.load.counts[6:12]))
+        # Wrong passwords are answered from the failed login cache
+        self.assertTrue(sim.load.total('kinit') < sim.load.total('logins'))
+
+    def test_main(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'population.json')
+            with open(path, 'w') as f:
+                json.dump(POPULATION, f)
+            csv = os.path.join(tmpdir, 'curves.csv')
+            with patch('sys.stdout'):
+                simulate.main(['-o', 'token_life=86400', '-w',
+                               'token_life=3600', '--csv', csv, path])
+            with open(csv) as f:
+                self.assertEqual(len(f.readlines()), 19)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import eventlet
+from swiftkerbauth.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_coalesce(self):
+        calls = []
+
+        def slow_get(key):
+            calls.append(key)
+            eventlet.sleep(0.01)
+            return 'value-%s' % key
+
+        flight = SingleFlight()
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(lambda i: flight.do('k', slow_get, 'k'),
+                                 range(50)))
+        self.assertEqual(results, ['value-k'] * 50)
+        self.assertEqual(calls, ['k'])
+        self.assertEqual(flight.coalesced, 49)
+        self.assertEqual(flight.in_flight, {})
+
+    def test_sequential_calls_are_not_cached(self):
+        calls = []
+        flight = SingleFlight()
+        flight.do('k', calls.append, 1)
+        flight.do('k', calls.append, 2)
+        self.assertEqual(calls, [1, 2])
+
+    def test_exception_shared(self):
+        def failing_get():
+            eventlet.sleep(0.01)
+            raise IOError('down')
+
+        flight = SingleFlight()
+        errors = []
+
+        def call():
+            try:
+                flight.do('k', failing_get)
+            except IOError as err:
+                errors.append(err)
+
+        pool = eventlet.GreenPool()
+        for i in range(5):
+            pool.spawn(call)
+        pool.waitall()
+        self.assertEqual(len(errors), 5)
+        self.assertEqual(flight.in_flight, {})
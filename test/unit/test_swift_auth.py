@@ -0,0 +1,107 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import imp
+import unittest
+from StringIO import StringIO
+from time import time
+from mock import patch
+from test.unit import FakeMemcache
+from swiftkerbauth import parse_reseller_prefixes
+from swiftkerbauth import kerbauth
+from swiftkerbauth.kerbauth_utils import bump_generation
+
+CGI_PATH = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'apachekerbauth', 'var', 'www', 'cgi-bin',
+                        'swift-auth')
+swift_auth = imp.load_source('swift_auth', CGI_PATH)
+
+
+class TestSwiftAuthCGI(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.multiple(swift_auth,
+                                 RESELLER_PREFIX='AUTH_',
+                                 RESELLER_PREFIXES=['AUTH_', 'SERVICE_'],
+                                 TOKEN_LIFES={'AUTH_': 86400,
+                                              'SERVICE_': 600},
+                                 DEBUG_HEADERS=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mc = FakeMemcache()
+
+    def login(self, **environ):
+        environ.setdefault('REMOTE_USER', 'user@EXAMPLE.COM')
+        out = StringIO()
+        with patch('sys.stdout', out):
+            with patch.object(swift_auth, 'get_groups_from_username',
+                              return_value='user,auth_test'):
+                swift_auth.main(environ, self.mc)
+        headers = {}
+        for line in out.getvalue().splitlines():
+            name, sep, value = line.partition(': ')
+            if sep:
+                headers[name] = value
+        return headers
+
+    def test_parse_reseller_prefixes(self):
+        self.assertEqual(parse_reseller_prefixes('AUTH, SERVICE_,AUTH_'),
+                         ['AUTH_', 'SERVICE_'])
+        self.assertEqual(parse_reseller_prefixes(''), [''])
+
+    def test_login(self):
+        headers = self.login()
+        token = headers['X-Auth-Token']
+        self.assertTrue(token.startswith('AUTH_tk'))
+        self.assertEqual(headers['X-Debug-Token-Life'], '86400s')
+        self.assertEqual(self.mc.get('AUTH_/user/user'), token)
+        self.assertEqual(self.login()['X-Auth-Token'], token)
+
+    def test_login_reseller_prefix(self):
+        start = time()
+        headers = self.login(HTTP_X_AUTH_USER='SERVICE_test:user')
+        token = headers['X-Auth-Token']
+        self.assertTrue(token.startswith('SERVICE_tk'))
+        self.assertEqual(headers['X-Debug-Token-Life'], '600s')
+        self.assertEqual(self.mc.get('SERVICE_/user/user'), token)
+        expires = self.mc.get('SERVICE_/token/%s' % token)[0]
+        self.assertTrue(start + 600 <= expires < time() + 601)
+        self.assertEqual(self.mc.get('AUTH_/user/user'), None)
+        self.assertTrue(self.login(HTTP_X_STORAGE_USER='other:user')[
+            'X-Auth-Token'].startswith('AUTH_tk'))
+
+    def test_login_after_invalidation(self):
+        old_token = self.login()['X-Auth-Token']
+        ath = kerbauth.filter_factory(
+            {'ext_authentication_url': 'http://127.0.0.1/'})(None)
+        env = {'swift.cache': self.mc}
+        self.assertEqual(ath.get_groups(env, old_token), 'user,auth_test')
+        bump_generation(self.mc, 'AUTH_')
+        ath.generations.clear()
+        self.assertEqual(ath.get_groups(env, old_token), None)
+        token = self.login()['X-Auth-Token']
+        self.assertNotEqual(token, old_token)
+        self.assertEqual(self.mc.get('AUTH_/g1/user/user'), token)
+        self.assertEqual(ath.get_groups(env, token), 'user,auth_test')
+        self.assertEqual(self.login()['X-Auth-Token'], token)
+
+    def test_malformed_remote_user(self):
+        self.assertEqual(self.login(REMOTE_USER='user'),
+                         {'Status': '401 Unauthorized'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from time import time
+from mock import patch
+from test.unit import FakeMemcache
+from swiftkerbauth import kerbauth_utils as ku
+from swiftkerbauth import token_store as ts
+
+
+class TestTokenStores(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'tokens.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_store(self, store):
+        expiry = time() + 100
+        ku.set_auth_data(store, "root", "AUTH_tk", expiry, "root,admin")
+        (token, expires, groups) = ku.get_auth_data(store, "root")
+        self.assertEqual(("AUTH_tk", expiry, "root,admin"),
+                         (token, expires, groups))
+        store.delete('AUTH_/user/root')
+        self.assertEqual(ku.get_auth_data(store, "root"), (None, None, None))
+
+    def test_memory_store(self):
+        self._check_store(ts.MemoryTokenStore())
+        store = ts.MemoryTokenStore()
+        self.assertEqual(store.incr('n', 2), 2)
+        self.assertEqual(store.incr('n'), 3)
+        self.assertEqual(ku.bump_generation(store), 1)
+
+    def test_sqlite_store(self):
+        self._check_store(ts.SQLiteTokenStore(self.db_path))
+
+    def test_sqlite_store_persists(self):
+        store = ts.SQLiteTokenStore(self.db_path)
+        store.set('key', (1.5, 'user,group'), timeout=100)
+        store = ts.SQLiteTokenStore(self.db_path)
+        self.assertEqual(store.get('key'), [1.5, 'user,group'])
+
+    def test_sqlite_store_off_hub(self):
+        store = ts.SQLiteTokenStore(self.db_path)
+        with patch('swiftkerbauth.token_store.tpool.execute',
+                   side_effect=lambda func, *args: func(*args)) as execute:
+            store.set('key', 'value', timeout=10)
+            self.assertEqual(store.get('key'), 'value')
+            self.assertEqual(store.get_multi(['key']), ['value'])
+            store.delete('key')
+        self.assertEqual([c[0][0] for c in execute.call_args_list],
+                         [store._set, store._get, store._get_multi,
+                          store._delete])
+
+    def test_expiry(self):
+        for store in (ts.MemoryTokenStore(),
+                      ts.SQLiteTokenStore(self.db_path)):
+            store.set('key', 'value', timeout=10)
+            with patch('swiftkerbauth.token_store.time',
+                       return_value=time() + 11):
+                self.assertEqual(store.get('key'), None)
+            self.assertEqual(store.get('key'), None)
+
+    def test_get_multi(self):
+        for store in (ts.MemoryTokenStore(),
+                      ts.SQLiteTokenStore(self.db_path), FakeMemcache()):
+            store.set('a', [1, 'x'], timeout=100)
+            store.set('b', [2, 'y'], timeout=100)
+            self.assertEqual(ts.get_multi(store, ['b', 'c', 'a']),
+                             [[2, 'y'], None, [1, 'x']])
+
+    def test_get_token_store(self):
+        self.assertEqual(ts.get_token_store({}), None)
+        self.assertTrue(isinstance(
+            ts.get_token_store({'token_store': 'memory'}),
+            ts.MemoryTokenStore))
+        store = ts.get_token_store({'token_store': 'sqlite',
+                                    'token_store_path': self.db_path})
+        self.assertTrue(isinstance(store, ts.SQLiteTokenStore))
+        self.assertEqual(store.path, self.db_path)
+        self.assertRaises(ValueError, ts.get_token_store,
+                          {'token_store': 'bogus'})
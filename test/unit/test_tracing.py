@@ -0,0 +1,106 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from swiftkerbauth.tracing import Trace, Tracer, JSONLinesExporter, \
+    NO_SPAN, get_tracer
+
+
+class ListExporter(object):
+
+    def __init__(self, conf=None):
+        self.conf = conf
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def flush(self):
+        pass
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_trace(self):
+        trace = Trace('tx1')
+        with trace.span('memcache.get', key='token') as span:
+            span.set(hit=True)
+            with trace.span('inner'):
+                pass
+        try:
+            with trace.span('kinit'):
+                raise OSError()
+        except OSError:
+            pass
+        spans = trace.finish(status=200)
+        self.assertEqual([(s['name'], s['id'], s['parent']) for s in spans],
+                         [('inner', 2, 1), ('memcache.get', 1, 0),
+                          ('kinit', 3, 0), ('request', 0, None)])
+        self.assertEqual(spans[1]['key'], 'token')
+        self.assertTrue(spans[1]['hit'])
+        self.assertEqual(spans[2]['error'], 'OSError')
+        self.assertEqual(spans[3]['status'], 200)
+        self.assertTrue(all(s['trans_id'] == 'tx1' for s in spans))
+        self.assertTrue(spans[3]['ms'] >= spans[1]['ms'] >= spans[0]['ms'])
+        # Spans of a finished trace are dropped
+        self.assertTrue(trace.span('late') is NO_SPAN)
+        self.assertEqual(len(trace.spans), 4)
+
+    def test_sampling(self):
+        tracer = Tracer(ListExporter(), sample_rate=4)
+        sampled = [tracer.start({'swift.trans_id': 'tx%d' % i}) is not None
+                   for i in range(1000)]
+        self.assertTrue(150 < sampled.count(True) < 350)
+        self.assertEqual(sampled, [
+            tracer.start({'swift.trans_id': 'tx%d' % i}) is not None
+            for i in range(1000)])
+        tracer = Tracer(ListExporter())
+        trace = tracer.start({'swift.trans_id': 'tx1'})
+        tracer.finish(trace, code_path='token')
+        self.assertEqual(tracer.exporter.spans[0]['code_path'], 'token')
+
+    def test_json_lines_exporter(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            exporter = JSONLinesExporter(os.path.join(tmpdir, 'spans'),
+                                         flush_every=3, flush_interval=3600)
+            exporter.export([{'name': 'a'}, {'name': 'b'}])
+            self.assertEqual(os.listdir(tmpdir), [])
+            exporter.export([{'name': 'c'}])
+            with open(exporter.path) as f:
+                self.assertEqual([json.loads(line)['name'] for line in f],
+                                 ['a', 'b', 'c'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_tracer(self):
+        self.assertEqual(get_tracer({}), None)
+        tracer = get_tracer({'trace_path': '/tmp/spans'})
+        self.assertTrue(isinstance(tracer.exporter, JSONLinesExporter))
+        self.assertEqual(tracer.sample_rate, 100)
+        conf = {'trace_exporter': 'test.unit.test_tracing:ListExporter',
+                'trace_sample_rate': '1'}
+        tracer = get_tracer(conf)
+        self.assertEqual(tracer.exporter.__class__.__name__, 'ListExporter')
+        self.assertEqual(tracer.exporter.conf, conf)
+        self.assertEqual(tracer.sample_rate, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
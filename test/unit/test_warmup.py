@@ -0,0 +1,51 @@
+# Copyright (c) 2013 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from swiftkerbauth import warmup
+
+
+class TestTokenSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'tokens')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        self.assertEqual(warmup.read_token_snapshot(self.path, 10), [])
+        warmup.write_token_snapshot(self.path, ['AUTH_tk1', 'AUTH_tk2'])
+        self.assertEqual(warmup.read_token_snapshot(self.path, 10),
+                         ['AUTH_tk1', 'AUTH_tk2'])
+        self.assertEqual(warmup.read_token_snapshot(self.path, 1),
+                         ['AUTH_tk1'])
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+        self.assertEqual(os.listdir(self.tmpdir), ['tokens'])
+
+    def test_lock(self):
+        lock = warmup.lock_token_snapshot(self.path)
+        self.assertTrue(lock)
+        self.assertEqual(warmup.lock_token_snapshot(self.path), None)
+        lock.close()
+        # Taken over once the writer is gone
+        lock = warmup.lock_token_snapshot(self.path)
+        self.assertTrue(lock)
+        lock.close()